@@ -0,0 +1,61 @@
+# benchmarks/bench_codec.py
+"""
+JSON 编解码微基准：对比标准库与 src/json_codec.py 当前后端 (安装了 orjson 时为 orjson)。
+载荷与 fake_emby.py 生成的媒体库一致，覆盖单个项目、一页 (50 项) 与整个合并库。
+
+用法: python benchmarks/bench_codec.py --sizes 1000,10000 --repeat 20
+"""
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import json_codec  # noqa: E402
+from fake_emby import build_library  # noqa: E402
+
+
+def best_of(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_payload(name: str, payload, repeat: int):
+    std_bytes = json.dumps(payload).encode("utf-8")
+    results = {
+        "stdlib dumps": best_of(lambda: json.dumps(payload).encode("utf-8"), repeat),
+        f"{json_codec.BACKEND} dumps": best_of(lambda: json_codec.dumps(payload), repeat),
+        "stdlib loads": best_of(lambda: json.loads(std_bytes), repeat),
+        f"{json_codec.BACKEND} loads": best_of(lambda: json_codec.loads(std_bytes), repeat),
+    }
+    mb = len(std_bytes) / 1024 / 1024
+    print(f"{name:<22} {len(std_bytes) / 1024:>10.1f} KB")
+    for label, seconds in results.items():
+        print(f"  {label:<16} {seconds * 1000:>9.3f} ms  {mb / seconds:>8.1f} MB/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JSON codec microbenchmark")
+    parser.add_argument("--sizes", default="1000,10000")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"json_codec backend: {json_codec.BACKEND}\n")
+    for size in (int(s) for s in args.sizes.split(",") if s):
+        items = build_library(size)
+        bench_payload("single item", items[0], args.repeat * 50)
+        bench_payload("page of 50", {"Items": items[:50], "TotalRecordCount": size}, args.repeat * 5)
+        bench_payload(f"library of {size}", {"Items": items, "TotalRecordCount": size}, args.repeat)
+        print()
+
+
+if __name__ == "__main__":
+    main()
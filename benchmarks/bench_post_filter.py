@@ -0,0 +1,47 @@
+# benchmarks/bench_post_filter.py
+"""
+后筛选微基准：在 fake_emby.py 生成的项目上，分别以“全部满足”与“任意满足”求值编译后的规则。
+
+用法: python benchmarks/bench_post_filter.py --items 50000 --repeat 5
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from models import AdvancedFilterRule  # noqa: E402
+from proxy_handlers._filter_translator import compile_post_filter  # noqa: E402
+from fake_emby import build_library  # noqa: E402
+
+RULES = [
+    AdvancedFilterRule(field="CommunityRating", operator="greater_than", value="6.5"),
+    AdvancedFilterRule(field="Genres", operator="contains", value="Anime"),
+    AdvancedFilterRule(field="Name", operator="contains", value="series"),
+    AdvancedFilterRule(field="ProviderIds.Tmdb", operator="is_not_empty"),
+    AdvancedFilterRule(field="PremiereDate", operator="greater_than", value="2000-01-01"),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Post-filter microbenchmark")
+    parser.add_argument("--items", type=int, default=50000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    items = build_library(args.items)
+    for match_all in (True, False):
+        post_filter = compile_post_filter(RULES, match_all=match_all)
+        best, kept = float("inf"), 0
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            kept = len(post_filter(items))
+            best = min(best, time.perf_counter() - start)
+        print(f"{'AND' if match_all else 'OR ':<3} {len(RULES)} rules x {len(items)} items: {best * 1000:8.2f} ms, kept {kept}")
+
+
+if __name__ == "__main__":
+    main()
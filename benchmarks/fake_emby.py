@@ -0,0 +1,232 @@
+# benchmarks/fake_emby.py
+"""
+用于基准测试的本地假 Emby 服务器。
+
+数据按固定随机种子生成，相同的 --items 每次生成完全相同的媒体库：
+- 一半电影、一半剧集；相邻的两个剧集共享同一个 TMDB ID，用于触发季/集合并；
+- 每个剧集有 3 季，每季 10 集；
+- 所有剧集属于合集 BENCH_COLLECTION_ID，供“启用合并的虚拟库”使用。
+
+额外的 /__bench/stats 与 /__bench/reset 用于统计上游调用次数。
+
+用法: python benchmarks/fake_emby.py --items 10000 --port 18096
+"""
+
+import argparse
+import json
+import random
+from collections import Counter
+
+from aiohttp import web, WSMsgType
+
+SERVER_ID = "bench-server"
+BENCH_COLLECTION_ID = "900001"
+GENRES = ("Action", "Anime", "Comedy", "Drama", "Documentary", "Horror", "Romance", "SciFi")
+TAGS = ("4K", "Classic", "Family", "Festival", "Indie")
+SEASONS_PER_SERIES = 3
+EPISODES_PER_SEASON = 10
+STREAM_BYTES = 1024 * 1024
+IMAGE_BYTES = 48 * 1024
+
+# 季与集的 ID 从这里开始编号，避免与项目 ID 冲突
+CHILD_ID_BASE = 10_000_000
+
+
+def build_library(count: int, seed: int = 42):
+    rng = random.Random(seed)
+    items = []
+    for i in range(count):
+        item_id = str(100000 + i)
+        is_series = i % 2 == 1
+        items.append({
+            "Id": item_id,
+            "Name": f"Bench {'Series' if is_series else 'Movie'} {i:06d}",
+            "SortName": f"bench {i:06d}",
+            "ServerId": SERVER_ID,
+            "Type": "Series" if is_series else "Movie",
+            "IsFolder": is_series,
+            # 相邻的两个剧集 (i 与 i+2) 共享 TMDB ID，模拟同一部剧在两个媒体库中各有一份
+            "ProviderIds": {"Tmdb": str(i // 4 if is_series else 500000 + i), "Imdb": f"tt{i:07d}"},
+            "Genres": rng.sample(GENRES, 2),
+            "Tags": rng.sample(TAGS, 1),
+            "Studios": [{"Name": f"Studio {i % 17}", "Id": str(800000 + i % 17)}],
+            "CommunityRating": round(rng.uniform(3, 9.5), 1),
+            "OfficialRating": rng.choice(("G", "PG", "PG-13", "R")),
+            "ProductionYear": 1980 + i % 45,
+            "PremiereDate": f"{1980 + i % 45}-06-01T00:00:00.0000000Z",
+            "DateCreated": f"2024-{1 + i % 12:02d}-{1 + i % 28:02d}T00:00:00.0000000Z",
+            "CollectionIds": [BENCH_COLLECTION_ID] if is_series else [],
+            "ImageTags": {"Primary": f"img{i}"},
+            "Overview": "Synthetic item generated for benchmarking. " * 3,
+            "UserData": {"Played": i % 7 == 0, "PlaybackPositionTicks": 0},
+        })
+    return items
+
+
+class FakeEmby:
+    def __init__(self, count: int):
+        self.library = build_library(count)
+        self.by_id = {item["Id"]: item for item in self.library}
+        self.calls: Counter = Counter()
+        self.image_body = bytes(IMAGE_BYTES)
+        self.stream_chunk = bytes(64 * 1024)
+
+    # --- 统计 ---
+    def _count(self, name: str):
+        self.calls[name] += 1
+
+    async def stats(self, request):
+        return web.json_response({"calls": dict(self.calls), "total": sum(self.calls.values())})
+
+    async def reset(self, request):
+        self.calls.clear()
+        return web.json_response({"ok": True})
+
+    # --- 查询 ---
+    def _filter(self, q) -> list:
+        items = self.library
+        if "Ids" in q:
+            wanted = set(q["Ids"].split(","))
+            return [item for item in items if item["Id"] in wanted]
+        if q.get("IncludeItemTypes"):
+            types = set(q["IncludeItemTypes"].split(","))
+            items = [item for item in items if item["Type"] in types]
+        if q.get("IsMovie") == "true":
+            items = [item for item in items if item["Type"] == "Movie"]
+        if q.get("IsSeries") == "true":
+            items = [item for item in items if item["Type"] == "Series"]
+        if q.get("Genres"):
+            genres = set(q["Genres"].split("|"))
+            items = [item for item in items if genres.intersection(item["Genres"])]
+        if q.get("Tags"):
+            tags = set(q["Tags"].split("|"))
+            items = [item for item in items if tags.intersection(item["Tags"])]
+        if q.get("CollectionIds"):
+            collection = q["CollectionIds"]
+            items = [item for item in items if collection in item["CollectionIds"]]
+        if q.get("MinCommunityRating"):
+            minimum = float(q["MinCommunityRating"])
+            items = [item for item in items if item["CommunityRating"] >= minimum]
+        if q.get("MaxCommunityRating"):
+            maximum = float(q["MaxCommunityRating"])
+            items = [item for item in items if item["CommunityRating"] <= maximum]
+        if q.get("NameStartsWith"):
+            prefix = q["NameStartsWith"].lower()
+            items = [item for item in items if item["Name"].lower().startswith(prefix)]
+        if q.get("AnyProviderIdEquals"):
+            wanted = {tuple(pair.split(".", 1)) for pair in q["AnyProviderIdEquals"].split(",")}
+            items = [item for item in items if any((k.lower(), v) in wanted for k, v in item["ProviderIds"].items())]
+        if q.get("ExcludeItemIds"):
+            excluded = set(q["ExcludeItemIds"].split(","))
+            items = [item for item in items if item["Id"] not in excluded]
+        sort_by = (q.get("SortBy") or "").split(",")[0]
+        if sort_by in ("DateCreated", "CommunityRating", "ProductionYear", "SortName"):
+            items = sorted(items, key=lambda item: item[sort_by], reverse=q.get("SortOrder") == "Descending")
+        return items
+
+    async def items(self, request):
+        self._count("items")
+        items = self._filter(request.query)
+        start = int(request.query.get("StartIndex", 0))
+        limit = int(request.query.get("Limit", len(items)))
+        return web.json_response({"Items": items[start:start + limit], "TotalRecordCount": len(items), "StartIndex": start})
+
+    async def latest(self, request):
+        self._count("latest")
+        items = self._filter(request.query)
+        items = sorted(items, key=lambda item: item["DateCreated"], reverse=True)
+        return web.json_response(items[:int(request.query.get("Limit", 16))])
+
+    async def item(self, request):
+        self._count("item")
+        item_id = request.match_info["item_id"]
+        item = self.by_id.get(item_id)
+        if item is None and item_id.isdigit() and int(item_id) >= CHILD_ID_BASE:
+            # 季或集：ID 中编码了季号
+            item = {"Id": item_id, "Type": "Season", "IndexNumber": (int(item_id) // 100) % 10, "ServerId": SERVER_ID}
+        if item is None:
+            return web.json_response({"error": "not found"}, status=404)
+        return web.json_response(item)
+
+    async def views(self, request):
+        self._count("views")
+        views = [{"Id": str(700000 + i), "Name": name, "ServerId": SERVER_ID, "Type": "CollectionFolder", "CollectionType": kind}
+                 for i, (name, kind) in enumerate((("Movies", "movies"), ("Shows", "tvshows"), ("Anime", "tvshows")))]
+        return web.json_response({"Items": views, "TotalRecordCount": len(views)})
+
+    async def seasons(self, request):
+        self._count("seasons")
+        series_id = request.match_info["series_id"]
+        base = CHILD_ID_BASE + (int(series_id) - 100000) * 1000
+        seasons = [{"Id": str(base + n * 100), "Name": f"Season {n}", "IndexNumber": n, "SeriesId": series_id,
+                    "Type": "Season", "ServerId": SERVER_ID} for n in range(1, SEASONS_PER_SERIES + 1)]
+        return web.json_response({"Items": seasons, "TotalRecordCount": len(seasons)})
+
+    async def episodes(self, request):
+        self._count("episodes")
+        series_id = request.match_info["series_id"]
+        base = CHILD_ID_BASE + (int(series_id) - 100000) * 1000
+        episodes = [{"Id": str(base + s * 100 + e), "Name": f"Episode {e}", "IndexNumber": e, "ParentIndexNumber": s,
+                     "SeriesId": series_id, "Type": "Episode", "ServerId": SERVER_ID}
+                    for s in range(1, SEASONS_PER_SERIES + 1) for e in range(1, EPISODES_PER_SEASON + 1)]
+        return web.json_response({"Items": episodes, "TotalRecordCount": len(episodes)})
+
+    async def image(self, request):
+        self._count("image")
+        return web.Response(body=self.image_body, content_type="image/jpeg")
+
+    async def stream(self, request):
+        self._count("stream")
+        response = web.StreamResponse(headers={"Content-Type": "video/mp4"})
+        response.content_length = STREAM_BYTES
+        await response.prepare(request)
+        for _ in range(STREAM_BYTES // len(self.stream_chunk)):
+            await response.write(self.stream_chunk)
+        await response.write_eof()
+        return response
+
+    async def system_info(self, request):
+        self._count("system_info")
+        return web.json_response({"Id": SERVER_ID, "ServerName": "bench", "LocalAddress": "http://127.0.0.1", "WanAddress": "http://127.0.0.1"})
+
+    async def websocket(self, request):
+        self._count("websocket")
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        async for msg in ws:
+            if msg.type == WSMsgType.TEXT:
+                await ws.send_str(msg.data)
+        return ws
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        r = app.router
+        r.add_get("/__bench/stats", self.stats)
+        r.add_post("/__bench/reset", self.reset)
+        for prefix in ("/emby", ""):
+            r.add_get(prefix + "/Users/{user_id}/Views", self.views)
+            r.add_get(prefix + "/Users/{user_id}/Items/Latest", self.latest)
+            r.add_get(prefix + "/Users/{user_id}/Items/{item_id}", self.item)
+            r.add_get(prefix + "/Users/{user_id}/Items", self.items)
+            r.add_get(prefix + "/Items", self.items)
+            r.add_get(prefix + "/Shows/{series_id}/Seasons", self.seasons)
+            r.add_get(prefix + "/Shows/{series_id}/Episodes", self.episodes)
+            r.add_get(prefix + "/Items/{item_id}/Images/{image_type}", self.image)
+            r.add_get(prefix + "/Videos/{item_id}/stream", self.stream)
+            r.add_get(prefix + "/System/Info", self.system_info)
+            r.add_get(prefix + "/embywebsocket", self.websocket)
+        return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Emby server for benchmarks")
+    parser.add_argument("--items", type=int, default=1000)
+    parser.add_argument("--port", type=int, default=18096)
+    args = parser.parse_args()
+    fake = FakeEmby(args.items)
+    print(json.dumps({"ready": True, "items": len(fake.library), "port": args.port}), flush=True)
+    web.run_app(fake.app(), host="127.0.0.1", port=args.port, print=None, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
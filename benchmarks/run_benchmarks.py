@@ -0,0 +1,302 @@
+# benchmarks/run_benchmarks.py
+"""
+可复现的代理基准测试。
+
+对每个数据规模 (默认 1k / 10k / 100k 个项目)：
+1. 启动假 Emby (benchmarks/fake_emby.py) 子进程；
+2. 在临时目录写入基准配置 (通过 CONFIG_DIR 环境变量指定)，以 uvicorn 子进程启动 proxy_app；
+3. 依次压测各个处理器路径，记录吞吐量、p50/p99 延迟以及每个请求触发的上游调用次数；
+4. 结果写入 JSON 文件，可用 --compare 与另一次运行的结果对比。
+
+默认关闭 API 响应缓存，测量的是处理器本身；加 --with-cache 可测量缓存命中路径。
+
+用法:
+    python benchmarks/run_benchmarks.py --sizes 1000,10000 --requests 200 --concurrency 16 --output bench.json
+    python benchmarks/run_benchmarks.py --compare old.json --output new.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import aiohttp
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+SRC_DIR = REPO_ROOT / "src"
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fake_emby import BENCH_COLLECTION_ID, SERVER_ID  # noqa: E402
+
+USER_ID = "benchuser"
+API_KEY = "benchkey"
+
+VLIB_NATIVE = "11111111-1111-4111-8111-111111111111"
+VLIB_MERGE = "22222222-2222-4222-8222-222222222222"
+VLIB_POST_FILTER = "33333333-3333-4333-8333-333333333333"
+
+
+@dataclass
+class Scenario:
+    name: str
+    path: Callable[[int], str]  # 第 i 个请求的路径；变化的 StartIndex 等参数用于避开缓存
+    weight: float = 1.0         # 相对于 --requests 的请求数比例 (全量爬取类场景更少)
+    kind: str = "http"          # http / websocket
+
+
+def build_scenarios(items: int) -> List[Scenario]:
+    series_ids = [str(100000 + i) for i in range(1, min(items, 200), 2)]
+    movie_ids = [str(100000 + i) for i in range(0, min(items, 200), 2)]
+    auth = f"api_key={API_KEY}"
+
+    def season_id(series_id: str, season: int = 1) -> str:
+        return str(10_000_000 + (int(series_id) - 100000) * 1000 + season * 100)
+
+    return [
+        Scenario("views", lambda i: f"/emby/Users/{USER_ID}/Views?{auth}&_={i}"),
+        Scenario("vlib_native", lambda i: f"/emby/Users/{USER_ID}/Items?ParentId={VLIB_NATIVE}&StartIndex={(i * 50) % max(items // 8, 50)}&Limit=50&{auth}"),
+        Scenario("vlib_post_filter", lambda i: f"/emby/Users/{USER_ID}/Items?ParentId={VLIB_POST_FILTER}&StartIndex={(i * 50) % 500}&Limit=50&{auth}"),
+        Scenario("vlib_merge", lambda i: f"/emby/Users/{USER_ID}/Items?ParentId={VLIB_MERGE}&StartIndex={(i * 50) % 500}&Limit=50&{auth}", weight=0.1),
+        Scenario("latest", lambda i: f"/emby/Users/{USER_ID}/Items/Latest?ParentId={VLIB_NATIVE}&Limit={16 + i % 8}&{auth}"),
+        Scenario("seasons_merge", lambda i: f"/emby/Shows/{series_ids[i % len(series_ids)]}/Seasons?UserId={USER_ID}&{auth}&_={i}", weight=0.5),
+        Scenario("episodes_merge", lambda i: f"/emby/Shows/{series_ids[i % len(series_ids)]}/Episodes?SeasonId={season_id(series_ids[i % len(series_ids)])}&UserId={USER_ID}&{auth}&_={i}", weight=0.5),
+        Scenario("item_detail", lambda i: f"/emby/Users/{USER_ID}/Items/{movie_ids[i % len(movie_ids)]}?{auth}&_={i}"),
+        Scenario("image_passthrough", lambda i: f"/emby/Items/{movie_ids[i % len(movie_ids)]}/Images/Primary?tag={i}"),
+        Scenario("stream_passthrough", lambda i: f"/emby/Videos/{movie_ids[i % len(movie_ids)]}/stream?Static=true&{auth}&_={i}", weight=0.25),
+        Scenario("websocket", lambda i: f"/embywebsocket?{auth}&deviceId=bench", kind="websocket"),
+    ]
+
+
+def build_config(emby_url: str, with_cache: bool) -> Dict:
+    return {
+        "emby_url": emby_url,
+        "emby_api_key": API_KEY,
+        "emby_server_id": SERVER_ID,
+        "log_level": "warn",
+        "enable_cache": with_cache,
+        "display_order": ["700000", "700001", "700002", VLIB_NATIVE, VLIB_MERGE, VLIB_POST_FILTER],
+        "advanced_filters": [
+            {"id": "bench-native", "name": "Anime (native)", "rules": [{"field": "Genres", "operator": "equals", "value": "Anime"}]},
+            {"id": "bench-post", "name": "Name contains 7 (post-filter)", "rules": [{"field": "Name", "operator": "contains", "value": "7"}]},
+        ],
+        "library": [
+            {"id": VLIB_NATIVE, "name": "Bench Native", "resource_type": "all", "advanced_filter_id": "bench-native", "image_tag": "bench"},
+            {"id": VLIB_MERGE, "name": "Bench Merge", "resource_type": "collection", "resource_id": BENCH_COLLECTION_ID, "merge_by_tmdb_id": True, "image_tag": "bench"},
+            {"id": VLIB_POST_FILTER, "name": "Bench Post Filter", "resource_type": "all", "advanced_filter_id": "bench-post", "image_tag": "bench"},
+        ],
+    }
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def wait_until_ready(url: str, timeout: float = 120):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            try:
+                async with session.get(url) as resp:
+                    if resp.status < 500:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"服务未在 {timeout}s 内就绪: {url}")
+
+
+def percentile(sorted_values: List[float], q: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))]
+
+
+async def run_http(session: aiohttp.ClientSession, base: str, scenario: Scenario, count: int, concurrency: int):
+    latencies: List[float] = []
+    errors = 0
+    received = 0
+    counter = iter(range(count))
+
+    async def worker():
+        nonlocal errors, received
+        for i in counter:
+            start = time.perf_counter()
+            try:
+                async with session.get(base + scenario.path(i)) as resp:
+                    body = await resp.read()
+                    received += len(body)
+                    if resp.status >= 400:
+                        errors += 1
+            except aiohttp.ClientError:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, errors, received
+
+
+async def run_websocket(session: aiohttp.ClientSession, base: str, scenario: Scenario, count: int, concurrency: int):
+    latencies: List[float] = []
+    errors = 0
+    per_socket = max(1, count // concurrency)
+
+    async def worker(n: int):
+        nonlocal errors
+        try:
+            async with session.ws_connect(base.replace("http", "ws", 1) + scenario.path(n)) as ws:
+                for i in range(per_socket):
+                    start = time.perf_counter()
+                    await ws.send_str(json.dumps({"MessageType": "KeepAlive", "Seq": i}))
+                    msg = await ws.receive(timeout=10)
+                    if msg.type != aiohttp.WSMsgType.TEXT:
+                        errors += 1
+                        break
+                    latencies.append(time.perf_counter() - start)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            errors += 1
+
+    await asyncio.gather(*(worker(n) for n in range(concurrency)))
+    return latencies, errors, 0
+
+
+async def bench_size(items: int, args) -> Dict:
+    emby_port, proxy_port = free_port(), free_port()
+    emby_url = f"http://127.0.0.1:{emby_port}"
+    proxy_url = f"http://127.0.0.1:{proxy_port}"
+    processes = []
+
+    with tempfile.TemporaryDirectory(prefix="evp-bench-") as config_dir:
+        Path(config_dir, "config.json").write_text(json.dumps(build_config(emby_url, args.with_cache)), encoding="utf-8")
+        env = {**os.environ, "CONFIG_DIR": config_dir, "PYTHONPATH": str(SRC_DIR)}
+        try:
+            processes.append(subprocess.Popen(
+                [sys.executable, str(Path(__file__).with_name("fake_emby.py")), "--items", str(items), "--port", str(emby_port)],
+                stdout=subprocess.DEVNULL
+            ))
+            processes.append(subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "proxy_server:proxy_app", "--host", "127.0.0.1", "--port", str(proxy_port),
+                 "--log-level", "warning", "--no-access-log"],
+                cwd=str(SRC_DIR), env=env, stdout=subprocess.DEVNULL
+            ))
+            await wait_until_ready(f"{emby_url}/__bench/stats")
+            await wait_until_ready(f"{proxy_url}/api/internal/route-stats")
+
+            results = {}
+            connector = aiohttp.TCPConnector(limit=args.concurrency)
+            async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=600)) as session:
+                for scenario in build_scenarios(items):
+                    if args.scenarios and scenario.name not in args.scenarios:
+                        continue
+                    count = max(args.concurrency, int(args.requests * scenario.weight))
+                    runner = run_websocket if scenario.kind == "websocket" else run_http
+
+                    # 预热 (不计入结果)，然后清零上游调用计数
+                    await runner(session, proxy_url, scenario, min(count, args.concurrency), args.concurrency)
+                    async with session.post(f"{emby_url}/__bench/reset"):
+                        pass
+
+                    started = time.perf_counter()
+                    latencies, errors, received = await runner(session, proxy_url, scenario, count, args.concurrency)
+                    duration = time.perf_counter() - started
+
+                    async with session.get(f"{emby_url}/__bench/stats") as resp:
+                        upstream = await resp.json()
+                    latencies.sort()
+                    completed = len(latencies)
+                    results[scenario.name] = {
+                        "requests": completed,
+                        "errors": errors,
+                        "duration_s": round(duration, 3),
+                        "rps": round(completed / duration, 1) if duration else None,
+                        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2) if latencies else None,
+                        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+                        "upstream_calls": upstream["total"],
+                        "upstream_calls_per_request": round(upstream["total"] / completed, 2) if completed else None,
+                        "upstream_breakdown": upstream["calls"],
+                        "mb_per_s": round(received / duration / 1024 / 1024, 1) if received and duration else None,
+                    }
+                    print(f"  [{items:>6}] {scenario.name:<20} {results[scenario.name]['rps']:>8} req/s  "
+                          f"p50={results[scenario.name]['p50_ms']}ms  p99={results[scenario.name]['p99_ms']}ms  "
+                          f"upstream/req={results[scenario.name]['upstream_calls_per_request']}", flush=True)
+            return results
+        finally:
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                try:
+                    process.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old: Dict, new: Dict):
+    """打印两次运行之间 rps / p50 / p99 / 上游调用数的变化。"""
+    print(f"\n对比 {old['meta'].get('git')} -> {new['meta'].get('git')}")
+    for size, scenarios in new["results"].items():
+        for name, result in scenarios.items():
+            before = old["results"].get(size, {}).get(name)
+            if not before:
+                continue
+            def delta(key):
+                a, b = before.get(key), result.get(key)
+                if not a or b is None:
+                    return f"{key}={b}"
+                return f"{key}={b} ({(b - a) / a * 100:+.1f}%)"
+            print(f"  [{size:>6}] {name:<20} {delta('rps')}  {delta('p50_ms')}  {delta('p99_ms')}  {delta('upstream_calls_per_request')}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Emby Virtual Proxy benchmarks")
+    parser.add_argument("--sizes", default="1000,10000,100000", help="逗号分隔的媒体库规模")
+    parser.add_argument("--requests", type=int, default=200, help="每个场景的基准请求数 (按场景权重缩放)")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--scenarios", default="", help="只运行这些场景 (逗号分隔)")
+    parser.add_argument("--with-cache", action="store_true", help="开启 API 响应缓存")
+    parser.add_argument("--output", default="benchmark-results.json")
+    parser.add_argument("--compare", help="与之前的结果文件对比")
+    args = parser.parse_args()
+    args.scenarios = set(filter(None, args.scenarios.split(",")))
+
+    report = {
+        "meta": {
+            "git": git_revision(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "with_cache": args.with_cache,
+        },
+        "results": {},
+    }
+    for size in (int(s) for s in args.sizes.split(",") if s):
+        print(f"== {size} items", flush=True)
+        report["results"][str(size)] = asyncio.run(bench_size(size, args))
+
+    Path(args.output).write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+    print(f"\n结果已写入 {args.output}")
+    if args.compare:
+        compare(json.loads(Path(args.compare).read_text(encoding="utf-8")), report)
+
+
+if __name__ == "__main__":
+    main()
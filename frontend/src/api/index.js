@@ -11,6 +11,7 @@ export default {
     getConfig: () => apiClient.get('/config'),
     updateConfig: (config) => apiClient.post('/config', config),
     restartProxy: () => apiClient.post('/proxy/restart'),
+    clearProxyCache: () => apiClient.post('/proxy/cache/clear'),
 
     // Libraries
     addLibrary: (library) => apiClient.post('/libraries', library),
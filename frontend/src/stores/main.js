@@ -252,6 +252,17 @@ export const useMainStore = defineStore('main', {
             this._handleApiError(error, '刷新 RSS 库失败');
         }
     },
+    async clearProxyCache() {
+        this.saving = true;
+        try {
+            const response = await api.clearProxyCache();
+            ElMessage.success(`代理缓存已清除（${response.data.removed} 条）。`);
+        } catch (error) {
+            this._handleApiError(error, "清除代理缓存失败");
+        } finally {
+            this.saving = false;
+        }
+    },
     async restartProxyServer() {
         this.saving = true;
         try {
@@ -26,18 +26,25 @@ from fastapi import Request
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
 import docker
-from proxy_cache import api_cache
+from proxy_cache import api_cache, cover_sample_path, COVER_SAMPLE_DIR
 from models import AppConfig, VirtualLibrary, AdvancedFilter
 import config_manager
+import json_codec
+import logging_setup
+import metrics
+import upstream_pool
 from db_manager import DBManager, RSS_CACHE_DB
 
 # 【【【 在这里添加或者确认你有这几行 】】】
 import logging
-from proxy_handlers._filter_translator import translate_rules
+from proxy_handlers._filter_explain import explain_filter
+from provider_index import provider_index
 
 # 设置日志记录器
 logger = logging.getLogger(__name__)
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+# 日志经由队列在后台线程输出，级别跟随 config.log_level
+logging_setup.setup_logging(config_manager.get_config().log_level, fmt='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+config_manager.add_config_listener(logging_setup.apply_config)
 # 【【【 添加/确认结束 】】】
 
 scheduler = AsyncIOScheduler()
@@ -61,6 +68,30 @@ async def get_advanced_filters():
     """获取所有高级筛选器规则"""
     return config_manager.load_config().advanced_filters
 
+@api_router.get("/advanced-filters/explain", tags=["Advanced Filters"])
+async def explain_advanced_filters():
+    """
+    说明每个高级筛选器的执行计划 (原生参数、后筛选规则、合并需求、每页预计的上游请求数)，
+    并附上代理服务在真实请求中测得的选择率与耗时 (多 worker 时为应答该请求的 worker 的统计)。
+    """
+    config = config_manager.load_config()
+    stats: Dict[str, dict] = {}
+    stats_available = False
+    proxy_core_url = os.getenv("PROXY_CORE_URL")
+    if proxy_core_url:
+        try:
+            session = upstream_pool.get_session()
+            async with session.get(f"{proxy_core_url.rstrip('/')}/api/internal/filter-stats", timeout=5) as response:
+                if response.status == 200:
+                    stats = await response.json()
+                    stats_available = True
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning(f"获取代理服务的筛选器统计失败: {e}")
+    return {
+        "stats_available": stats_available,
+        "filters": [explain_filter(f, config, stats.get(f.id)) for f in config.advanced_filters],
+    }
+
 @api_router.post("/advanced-filters", status_code=204, tags=["Advanced Filters"])
 async def save_advanced_filters(filters: List[AdvancedFilter]):
     """保存所有高级筛选器规则"""
@@ -80,6 +111,7 @@ async def save_advanced_filters(filters: List[AdvancedFilter]):
         
         # 5. 保存这个全新的、有效的配置对象
         config_manager.save_config(new_config)
+        await _invalidate_proxy_cache(all=True)
         
         return Response(status_code=204)
     except Exception as e:
@@ -90,33 +122,27 @@ async def save_advanced_filters(filters: List[AdvancedFilter]):
 # 【【【 最终版本的 _fetch_images_from_vlib 函数 】】】
 async def _fetch_images_from_vlib(library_id: str, temp_dir: Path, config: AppConfig):
     """
-    从 proxy-core 的内部缓存中获取项目列表，并下载封面。
-    (最终架构版)
+    从代理服务落盘的封面素材 (见 proxy_cache.VlibItemsCache) 中获取项目列表，并下载封面。
+    代理以多 worker 运行时项目列表缓存按进程独立，素材文件由所有 worker 共享，admin 直接读取。
     """
-    logger.info(f"开始从内部缓存为虚拟库 {library_id} 获取封面素材...")
-
-    proxy_core_url = os.getenv("PROXY_CORE_URL")
-    if not proxy_core_url:
-        raise HTTPException(status_code=500, detail="环境变量 PROXY_CORE_URL 未设置。")
+    logger.info(f"开始从封面素材缓存为虚拟库 {library_id} 获取封面素材...")
 
-    # --- 1. 向 proxy-core 请求缓存数据 ---
-    target_url = f"{proxy_core_url.rstrip('/')}/api/internal/get-cached-items/{library_id}"
+    # --- 1. 读取代理服务写入的封面素材 ---
+    sample_path = cover_sample_path(COVER_SAMPLE_DIR, library_id)
     items = []
-    
-    logger.info(f"正在向内部代理服务 {target_url} 请求缓存数据...")
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(target_url, timeout=10) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    items = data.get("Items", [])
-                else:
-                    error_detail = (await response.json()).get("detail")
-                    logger.error(f"从内部代理获取缓存失败 (Status: {response.status}): {error_detail}")
-                    raise HTTPException(status_code=response.status, detail=error_detail)
-    except aiohttp.ClientError as e:
-        logger.error(f"连接到内部代理服务时出错: {e}")
-        raise HTTPException(status_code=502, detail=f"无法连接到内部代理服务: {e}")
+        if sample_path is not None:
+            items = json_codec.loads(sample_path.read_bytes()).get("Items") or []
+    except FileNotFoundError:
+        pass
+    except (OSError, json_codec.JSONDecodeError) as e:
+        logger.error(f"读取虚拟库 {library_id} 的封面素材失败: {e}")
+        raise HTTPException(status_code=500, detail=f"读取封面素材失败: {e}")
+    if not items:
+        raise HTTPException(
+            status_code=404,
+            detail="未找到该虚拟库的项目缓存。请先在Emby客户端中实际浏览一次该虚拟库，以生成缓存数据。"
+        )
 
     # --- 2. 后续处理 ---
     items_with_images = [item for item in items if item.get("ImageTags", {}).get("Primary")]
@@ -141,9 +167,9 @@ async def _fetch_images_from_vlib(library_id: str, temp_dir: Path, config: AppCo
         except Exception:
             return False
 
-    async with aiohttp.ClientSession() as session:
-        tasks = [download_image(session, item, i + 1) for i, item in enumerate(selected_items)]
-        results = await asyncio.gather(*tasks)
+    session = upstream_pool.get_session()
+    tasks = [download_image(session, item, i + 1) for i, item in enumerate(selected_items)]
+    results = await asyncio.gather(*tasks)
 
     if not any(results):
         raise HTTPException(status_code=500, detail="所有封面素材下载失败，无法生成海报。")
@@ -206,21 +232,21 @@ async def _fetch_from_emby(endpoint: str, params: Dict = None) -> List:
     url = f"{config.emby_url.rstrip('/')}/emby{endpoint}"
     
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers, params=params, timeout=15) as response:
-                if response.status != 200:
-                    error_text = await response.text()
-                    logger_msg = f"从Emby获取数据失败 (Endpoint: {endpoint}, Status: {response.status}): {error_text}"
-                    print(f"[PROXY-ADMIN-ERROR] {logger_msg}")
-                    raise HTTPException(status_code=response.status, detail=logger_msg)
-                
-                json_response = await response.json()
-                if isinstance(json_response, dict):
-                    return json_response.get("Items", json_response)
-                elif isinstance(json_response, list):
-                    return json_response
-                else:
-                    return []
+        session = upstream_pool.get_session()
+        async with session.get(url, headers=headers, params=params, timeout=15) as response:
+            if response.status != 200:
+                error_text = await response.text()
+                logger_msg = f"从Emby获取数据失败 (Endpoint: {endpoint}, Status: {response.status}): {error_text}"
+                print(f"[PROXY-ADMIN-ERROR] {logger_msg}")
+                raise HTTPException(status_code=response.status, detail=logger_msg)
+            
+            json_response = await response.json()
+            if isinstance(json_response, dict):
+                return json_response.get("Items", json_response)
+            elif isinstance(json_response, list):
+                return json_response
+            else:
+                return []
     except aiohttp.ClientError as e:
         logger_msg = f"连接到Emby时发生网络错误 (Endpoint: {endpoint}): {e}"
         print(f"[PROXY-ADMIN-ERROR] {logger_msg}")
@@ -266,14 +292,61 @@ async def get_real_libraries_hybrid_mode() -> List:
 async def get_config():
     return config_manager.load_config()
 
+async def _invalidate_proxy_cache(**scope) -> Optional[int]:
+    """
+    通知 proxy-core 精确淘汰内存缓存，使配置修改立即生效。
+    scope 可包含 user_id / library_id / path_prefix / route，或 all=True。
+    失败时只记录警告：proxy-core 也会在检测到配置文件变化后自行淘汰受影响的缓存。
+    """
+    proxy_core_url = os.getenv("PROXY_CORE_URL")
+    if not proxy_core_url:
+        return None
+    target_url = f"{proxy_core_url.rstrip('/')}/api/internal/cache/invalidate"
+    try:
+        session = upstream_pool.get_session()
+        async with session.post(target_url, json=scope, timeout=5) as response:
+            if response.status == 200:
+                removed = (await response.json()).get("removed", 0)
+                logger.info(f"已通知代理淘汰缓存 {scope}，共淘汰 {removed} 条。")
+                return removed
+            logger.warning(f"通知代理淘汰缓存失败 (Status: {response.status}): {await response.text()}")
+    except Exception as e:
+        logger.warning(f"通知代理淘汰缓存时出错: {e}")
+    return None
+
 # 修改 update_config
 @api_router.post("/config", response_model=AppConfig, response_model_by_alias=True, tags=["Configuration"])
 async def update_config(config: AppConfig):
     config_manager.save_config(config)
     # 更新定时任务
     update_rss_refresh_job(config)
+    await _invalidate_proxy_cache(all=True)
     return config
 
+@api_router.post("/proxy/cache/clear", tags=["System Management"])
+async def clear_proxy_cache():
+    """清空代理服务器的内存缓存，无需重启容器。"""
+    removed = await _invalidate_proxy_cache(all=True)
+    if removed is None:
+        raise HTTPException(status_code=502, detail="无法连接到代理服务以清除缓存。")
+    return {"removed": removed}
+
+@api_router.get("/proxy/slow-requests", tags=["System Management"])
+async def get_proxy_slow_requests():
+    """读取代理服务记录的慢请求及其分阶段耗时 (多 worker 时为应答该请求的 worker 的记录)。"""
+    proxy_core_url = os.getenv("PROXY_CORE_URL")
+    if not proxy_core_url:
+        raise HTTPException(status_code=500, detail="环境变量 PROXY_CORE_URL 未设置。")
+    target_url = f"{proxy_core_url.rstrip('/')}/api/internal/slow-requests"
+    try:
+        session = upstream_pool.get_session()
+        async with session.get(target_url, timeout=5) as response:
+            if response.status != 200:
+                raise HTTPException(status_code=response.status, detail=await response.text())
+            return await response.json()
+    except aiohttp.ClientError as e:
+        raise HTTPException(status_code=502, detail=f"无法连接到内部代理服务: {e}")
+
 # 将 /cache/clear 路径改为 /proxy/restart，功能也彻底改变
 @api_router.post("/proxy/restart", status_code=204, tags=["System Management"])
 async def restart_proxy_container():
@@ -321,8 +394,16 @@ async def restart_proxy_container():
             detail=f"重启容器时发生未知内部错误: {e}"
         )
 
+@metrics.timed_job("rss_refresh")
 async def refresh_rss_library_internal(vlib: VirtualLibrary):
     """内部刷新逻辑，供手动和定时任务调用"""
+    config = config_manager.load_config()
+    if config.provider_index_enabled and config.emby_url and config.emby_api_key:
+        # RSS 处理器用外部 ID 索引判断项目是否已在 Emby 中，先把索引刷新到最新
+        try:
+            await provider_index.ensure_fresh(upstream_pool.get_session(), config, max_age=0, wait_full=True)
+        except Exception as e:
+            logger.warning(f"刷新外部 ID 索引失败，RSS 匹配将逐个查询 Emby: {e}")
     try:
         if vlib.rss_type == "douban":
             from rss_processor.douban import DoubanProcessor
@@ -369,6 +450,7 @@ async def generate_cover(body: CoverRequest):
                     break
             if vlib_found:
                 config_manager.save_config(config)
+                await _invalidate_proxy_cache(library_id=body.library_id)
                 return {"success": True, "image_tag": image_tag}
             else:
                 raise HTTPException(status_code=404, detail="未找到要更新封面的虚拟库。")
@@ -396,6 +478,7 @@ async def clear_all_covers():
         for vlib in config.virtual_libraries:
             vlib.image_tag = None
         config_manager.save_config(config)
+        await _invalidate_proxy_cache(all=True)
         
         logger.info("所有封面及配置已成功清除。")
         return Response(status_code=204)
@@ -404,6 +487,7 @@ async def clear_all_covers():
         raise HTTPException(status_code=500, detail=f"清空封面时发生内部错误: {e}")
 
 # 封面生成的核心逻辑
+@metrics.timed_job("cover_generate")
 async def _generate_library_cover(library_id: str, title_zh: str, title_en: Optional[str], style_name: str, temp_image_paths: Optional[List[str]] = None) -> Optional[str]:
     config = config_manager.load_config()
     # --- 1. 定义路径 ---
@@ -546,6 +630,7 @@ async def save_display_order(ordered_ids: List[str]):
     config = config_manager.load_config()
     config.display_order = ordered_ids
     config_manager.save_config(config)
+    await _invalidate_proxy_cache(route="views")
     return Response(status_code=204)
 
 @api_router.post("/libraries", response_model=VirtualLibrary, tags=["Libraries"])
@@ -560,6 +645,7 @@ async def create_library(library: VirtualLibrary):
         config.display_order.append(library.id)
         
     config_manager.save_config(config)
+    await _invalidate_proxy_cache(route="views")
     return library
 
 @api_router.put("/libraries/{library_id}", response_model=VirtualLibrary, tags=["Libraries"])
@@ -594,6 +680,7 @@ async def update_library(library_id: str, updated_library_data: VirtualLibrary):
             break
             
     config_manager.save_config(config)
+    await _invalidate_proxy_cache(library_id=library_id)
     return updated_lib
 
 @api_router.delete("/libraries/{library_id}", status_code=204, tags=["Libraries"])
@@ -637,6 +724,7 @@ async def delete_library(library_id: str):
         config.display_order.remove(library_id)
         
     config_manager.save_config(config)
+    await _invalidate_proxy_cache(library_id=library_id)
     return Response(status_code=204)
 
 @api_router.get("/emby/classifications", tags=["Emby Helper"])
@@ -747,5 +835,11 @@ async def startup_event():
 async def shutdown_event():
     # 关闭调度器
     scheduler.shutdown()
+    await upstream_pool.close_session()
+
+@admin_app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    """Prometheus 抓取端点：后台任务耗时与上游调用统计。"""
+    return Response(content=metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
 
 admin_app.mount("/", StaticFiles(directory=str(static_dir), html=True), name="static")
@@ -1,13 +1,39 @@
 # src/config_manager.py (最终导入修正版)
 
+import os
 import json
+import time
+import logging
+import threading
+from dataclasses import dataclass, replace
 from pathlib import Path
+from typing import Callable, List, Optional, Tuple
 from models import AppConfig # <--- 修正这里
 
-# 定义配置文件的路径
-CONFIG_DIR = Path(__file__).parent.parent / "config"
+# 定义配置文件的路径 (可通过环境变量 CONFIG_DIR 覆盖，例如基准测试使用临时目录)
+CONFIG_DIR = Path(os.getenv("CONFIG_DIR", Path(__file__).parent.parent / "config"))
 CONFIG_FILE_PATH = CONFIG_DIR / "config.json"
 
+# 内存快照的变更检查间隔（毫秒）。在此间隔内，get_config() 直接返回内存中的快照。
+CONFIG_CHECK_INTERVAL_MS = int(os.getenv("CONFIG_CHECK_INTERVAL_MS", "1000"))
+
+logger = logging.getLogger(__name__)
+
+@dataclass(frozen=True)
+class ConfigSnapshot:
+    """
+    进程内的配置快照。快照本身不可变，更新时整体替换，
+    因此正在处理中的请求始终看到一份一致的配置。
+    """
+    config: AppConfig
+    version: int
+    file_key: Optional[Tuple[int, int, int]]  # (inode, mtime_ns, size)
+    checked_at: float
+
+_snapshot: Optional[ConfigSnapshot] = None
+_snapshot_lock = threading.RLock()
+_listeners: List[Callable[[AppConfig], None]] = []
+
 def load_config() -> AppConfig:
     """
     加载配置文件。如果目录或文件不存在，则使用默认值自动创建。
@@ -21,32 +47,109 @@ def load_config() -> AppConfig:
             save_config(default_config)
             return default_config
 
-        with open(CONFIG_FILE_PATH, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            # --- 核心修复：确保新字段存在以兼容旧配置文件 ---
-            if 'advanced_filters' not in data:
-                data['advanced_filters'] = []
-            if 'show_missing_episodes' not in data:
-                data['show_missing_episodes'] = False
-            if 'tmdb_api_key' not in data:
-                data['tmdb_api_key'] = ""
-            if 'tmdb_proxy' not in data:
-                data['tmdb_proxy'] = ""
-            return AppConfig.model_validate(data)
+        return _read_config_file()
             
     except (json.JSONDecodeError, Exception) as e:
         print(f"Error loading or parsing config file: {e}. Returning a temporary default config.")
         return AppConfig()
 
+def _read_config_file() -> AppConfig:
+    """读取并校验配置文件；文件不完整或无效时抛出异常 (由调用方决定如何回退)。"""
+    with open(CONFIG_FILE_PATH, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    # --- 核心修复：确保新字段存在以兼容旧配置文件 ---
+    if 'advanced_filters' not in data:
+        data['advanced_filters'] = []
+    if 'show_missing_episodes' not in data:
+        data['show_missing_episodes'] = False
+    if 'tmdb_api_key' not in data:
+        data['tmdb_api_key'] = ""
+    if 'tmdb_proxy' not in data:
+        data['tmdb_proxy'] = ""
+    return AppConfig.model_validate(data)
+
 def save_config(config: AppConfig):
     """
     将配置对象安全地保存到文件。
+    先写入临时文件再原子替换：其他进程 (代理的各个 worker) 随时可能读取配置文件，不能让它们读到写了一半的内容。
     """
     try:
         CONFIG_DIR.mkdir(exist_ok=True)
 
-        with open(CONFIG_FILE_PATH, 'w', encoding='utf-8') as f:
+        tmp_path = CONFIG_FILE_PATH.with_name(f"{CONFIG_FILE_PATH.name}.{os.getpid()}.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
             f.write(config.model_dump_json(by_alias=True, indent=4))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, CONFIG_FILE_PATH)
         print(f"Configuration successfully saved to {CONFIG_FILE_PATH}")
     except Exception as e:
         print(f"Error saving config file: {e}")
+    # 本进程内立即生效，无需等待下一次变更检查
+    _refresh_snapshot(force=True)
+
+def _stat_config_file() -> Optional[Tuple[int, int, int]]:
+    try:
+        st = os.stat(CONFIG_FILE_PATH)
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+    except OSError:
+        return None
+
+def _refresh_snapshot(force: bool = False) -> ConfigSnapshot:
+    global _snapshot
+    with _snapshot_lock:
+        now = time.monotonic()
+        current = _snapshot
+        file_key = _stat_config_file()
+        if current is not None and not force and file_key is not None and file_key == current.file_key:
+            # 文件未变化，只刷新检查时间
+            _snapshot = replace(current, checked_at=now)
+            return _snapshot
+
+        if file_key is None:
+            # 配置文件不存在：load_config 会创建默认配置文件，之后再获取文件状态
+            config = load_config()
+            file_key = _stat_config_file()
+        else:
+            # 使用读取之前的文件状态作为键：读取期间文件又被替换时，下一次检查会发现变化并重新读取
+            try:
+                config = _read_config_file()
+            except Exception as e:
+                if current is not None:
+                    # 保留上一份有效配置，不记录新的文件状态，下一次检查时重试
+                    logger.error(f"配置文件解析失败，继续使用上一份配置: {e}")
+                    _snapshot = replace(current, checked_at=now)
+                    return _snapshot
+                logger.error(f"配置文件解析失败，暂时使用默认配置: {e}")
+                config, file_key = AppConfig(), None
+        version = current.version + 1 if current is not None else 1
+        _snapshot = ConfigSnapshot(config=config, version=version, file_key=file_key, checked_at=now)
+        listeners = list(_listeners) if current is not None else []
+
+    for listener in listeners:
+        try:
+            listener(config)
+        except Exception:
+            logger.exception(f"配置变更回调 {listener} 执行失败")
+    return _snapshot
+
+def get_snapshot() -> ConfigSnapshot:
+    """
+    返回当前的配置快照。仅当距离上次检查超过 CONFIG_CHECK_INTERVAL_MS，
+    且配置文件的 inode / mtime / size 发生变化时，才会重新读取并校验配置文件。
+    """
+    snapshot = _snapshot
+    if snapshot is not None and (time.monotonic() - snapshot.checked_at) * 1000 < CONFIG_CHECK_INTERVAL_MS:
+        return snapshot
+    return _refresh_snapshot()
+
+def get_config() -> AppConfig:
+    """
+    热路径使用的只读配置。返回的对象在多个请求之间共享，调用方不得修改它；
+    需要修改并保存配置时，请使用 load_config() 获取一份独立的副本。
+    """
+    return get_snapshot().config
+
+def add_config_listener(listener: Callable[[AppConfig], None]):
+    """注册一个回调，在配置快照被替换后以新配置调用。"""
+    _listeners.append(listener)
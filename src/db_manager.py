@@ -12,6 +12,7 @@ RSS_CACHE_DB = DB_DIR / "rss_cache.db"
 DOUBAN_CACHE_DB = DB_DIR / "douban_cache.db"
 BANGUMI_CACHE_DB = DB_DIR / "bangumi_cache.db"
 TMDB_CACHE_DB = DB_DIR / "tmdb_cache.db"
+PROVIDER_INDEX_DB = DB_DIR / "provider_index.db"
 
 class DBManager:
     _instances = {}
@@ -44,6 +45,15 @@ class DBManager:
                 conn.commit()
             return cursor
 
+    def executemany(self, query, seq_of_params, commit=False):
+        with self._locks[self.db_path]:
+            conn = self.get_conn()
+            cursor = conn.cursor()
+            cursor.executemany(query, seq_of_params)
+            if commit:
+                conn.commit()
+            return cursor
+
     def fetchall(self, query, params=()):
         cursor = self.execute(query, params)
         return cursor.fetchall()
@@ -166,5 +176,24 @@ def init_databases():
     except Exception as e:
         print(f"Error updating rss_library_items table schema: {e}")
 
+    # 初始化外部 ID 索引数据库 (TMDB/IMDB/TVDB ID -> Emby 项目)
+    provider_index_db = DBManager(PROVIDER_INDEX_DB)
+    provider_index_db.execute("""
+    CREATE TABLE IF NOT EXISTS provider_index (
+        provider TEXT,
+        provider_id TEXT,
+        item_id TEXT,
+        item_type TEXT,
+        PRIMARY KEY (provider, provider_id, item_id)
+    )
+    """, commit=True)
+    provider_index_db.execute("CREATE INDEX IF NOT EXISTS idx_provider_index_item ON provider_index (item_id)", commit=True)
+    provider_index_db.execute("""
+    CREATE TABLE IF NOT EXISTS provider_index_meta (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    )
+    """, commit=True)
+
 # 在模块加载时执行初始化
 init_databases()
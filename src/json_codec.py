@@ -0,0 +1,63 @@
+# src/json_codec.py
+
+import json
+from typing import Any, Union
+
+from starlette.responses import JSONResponse as _StarletteJSONResponse
+
+# orjson 是可选依赖：直接输出 UTF-8 字节，解析和序列化都比标准库快数倍；未安装时退回标准库
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BACKEND = "orjson" if orjson else "json"
+
+# orjson.JSONDecodeError 是它的子类，捕获这一个即可覆盖两种后端
+JSONDecodeError = json.JSONDecodeError
+
+if orjson:
+    _OPTIONS = orjson.OPT_NON_STR_KEYS
+    _PRETTY_OPTIONS = _OPTIONS | orjson.OPT_INDENT_2
+
+    def loads(data: Union[bytes, bytearray, memoryview, str]) -> Any:
+        return orjson.loads(data)
+
+    def dumps(obj: Any, pretty: bool = False) -> bytes:
+        try:
+            return orjson.dumps(obj, option=_PRETTY_OPTIONS if pretty else _OPTIONS)
+        except TypeError:
+            # 超出 64 位的整数等 orjson 不支持的值，交给标准库处理
+            return _std_dumps(obj, pretty)
+else:
+    def loads(data: Union[bytes, bytearray, memoryview, str]) -> Any:
+        return json.loads(data)
+
+    def dumps(obj: Any, pretty: bool = False) -> bytes:
+        return _std_dumps(obj, pretty)
+
+
+def _std_dumps(obj: Any, pretty: bool = False) -> bytes:
+    if pretty:
+        return json.dumps(obj, ensure_ascii=False, indent=2).encode("utf-8")
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def dumps_str(obj: Any, pretty: bool = False) -> str:
+    """需要 str 的场合 (日志、SQLite 文本列)。"""
+    return dumps(obj, pretty).decode("utf-8")
+
+
+async def read_json(resp) -> Any:
+    """
+    代替 aiohttp 的 resp.json()：直接解析原始字节，省去先解码成 str 的一步。
+    与 resp.json() 不同，不校验 Content-Type。
+    """
+    return loads(await resp.read())
+
+
+class JSONResponse(_StarletteJSONResponse):
+    """使用上面编解码器的 JSONResponse，可直接替换 fastapi.responses.JSONResponse。"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
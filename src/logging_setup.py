@@ -0,0 +1,96 @@
+# src/logging_setup.py
+
+import sys
+import queue
+import atexit
+import logging
+from collections import Counter
+from logging.handlers import QueueHandler, QueueListener
+from types import SimpleNamespace
+from typing import Dict, Optional
+
+DEFAULT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+LOG_LEVELS = {"debug": logging.DEBUG, "info": logging.INFO, "warn": logging.WARNING, "error": logging.ERROR}
+
+# uvicorn 自带的日志器不向 root 传播，需要单独接入队列
+UVICORN_LOGGERS = ("uvicorn", "uvicorn.error", "uvicorn.access")
+
+
+class SamplingFilter(logging.Filter):
+    """
+    对高频日志按键采样：带有 sample_key 属性的 INFO 及以下日志，每个键每 N 条只保留 1 条。
+    WARNING 及以上的日志、以及开启 debug 级别时的所有日志都不采样。
+    """
+
+    def __init__(self, every: int = 1):
+        super().__init__()
+        self.every = every
+        self.counts: Counter = Counter()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = getattr(record, "sample_key", None)
+        if key is None or self.every <= 1 or record.levelno >= logging.WARNING:
+            return True
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            return True
+        seen = self.counts[key]
+        self.counts[key] = seen + 1
+        if seen % self.every:
+            return False
+        record.msg = f"{record.msg} [采样: 每 {self.every} 条输出 1 条]"
+        return True
+
+
+def sample(key: str) -> Dict[str, str]:
+    """用法: logger.info("...%s", arg, extra=sample(route_name))"""
+    return {"sample_key": key}
+
+
+_state = SimpleNamespace(listener=None, handler=None, sampler=SamplingFilter())
+
+
+def setup_logging(log_level: str = "info", fmt: str = DEFAULT_FORMAT, sample_every: Optional[int] = None):
+    """
+    将 root 与 uvicorn 的日志改为经由队列输出：
+    调用方 (事件循环) 只负责把日志记录放入队列，真正写 stdout 的是 QueueListener 的后台线程。
+    重复调用只会调整级别和采样率。
+    """
+    if _state.listener is None:
+        log_queue = queue.SimpleQueue()
+        stream_handler = logging.StreamHandler(sys.stdout)
+        stream_handler.setFormatter(logging.Formatter(fmt))
+
+        handler = QueueHandler(log_queue)
+        handler.addFilter(_state.sampler)
+
+        root = logging.getLogger()
+        for existing in root.handlers[:]:
+            root.removeHandler(existing)
+        root.addHandler(handler)
+        for name in UVICORN_LOGGERS:
+            uvicorn_logger = logging.getLogger(name)
+            for existing in uvicorn_logger.handlers[:]:
+                uvicorn_logger.removeHandler(existing)
+            uvicorn_logger.propagate = True
+
+        listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+        listener.start()
+        atexit.register(listener.stop)
+        _state.listener, _state.handler = listener, handler
+
+    apply_log_level(log_level, sample_every)
+
+
+def apply_log_level(log_level: str, sample_every: Optional[int] = None):
+    """按配置调整日志级别，可作为配置监听器在运行时调用。"""
+    level = LOG_LEVELS.get(log_level, logging.INFO)
+    logging.getLogger().setLevel(level)
+    for name in UVICORN_LOGGERS:
+        logging.getLogger(name).setLevel(level)
+    if sample_every is not None:
+        _state.sampler.every = max(1, sample_every)
+
+
+def apply_config(config):
+    apply_log_level(config.log_level, config.log_sample_every)
@@ -1,30 +1,64 @@
 # src/main.py
-import uvicorn
+import os
 import sys
+import importlib.util
+import uvicorn
+
+import config_manager
 
-def start_admin():
+def _server_options(reload: bool) -> dict:
+    """
+    生产环境与开发环境共用的 uvicorn 参数。
+    - 安装了 uvloop / httptools 时使用它们，否则退回标准库的 asyncio / h11；
+    - reload 只用于开发 (--reload)，生产环境不启动文件监视器。
+    """
+    loop = "uvloop" if importlib.util.find_spec("uvloop") else "asyncio"
+    http = "httptools" if importlib.util.find_spec("httptools") else "h11"
+    print(f"Event loop: {loop}, HTTP parser: {http}, reload: {reload}")
+    return {"loop": loop, "http": http, "reload": reload}
+
+def start_admin(reload: bool = False):
     """启动管理服务器"""
     print("--- Starting Admin Server ---")
     print("Access the Web UI at http://127.0.0.1:8011 (or your host IP)")
     print("API documentation at http://127.0.0.1:8011/docs")
-    uvicorn.run("admin_server:admin_app", host="0.0.0.0", port=8001, reload=True)
+    # 管理服务内置 RSS 定时任务，只能以单进程运行
+    uvicorn.run("admin_server:admin_app", host="0.0.0.0", port=8001, **_server_options(reload))
 
-def start_proxy():
+def start_proxy(reload: bool = False):
     """启动代理服务器"""
+    config = config_manager.load_config()
+    workers = int(os.getenv("PROXY_WORKERS", config.proxy_workers)) or os.cpu_count() or 1
+    if reload and workers > 1:
+        print("--reload 与多 worker 不兼容，开发模式下使用单个 worker。")
+        workers = 1
+    # 各 worker 通过该环境变量得知自己处于多进程部署中 (缓存按进程独立，需要同步淘汰)
+    os.environ["PROXY_WORKERS"] = str(workers)
+
     print("--- Starting Proxy Server ---")
-    print("Proxy is listening on http://0.0.0.0:8999")
-    uvicorn.run("proxy_server:proxy_app", host="0.0.0.0", port=8999, reload=True)
+    print(f"Proxy is listening on http://0.0.0.0:8999 with {workers} worker(s)")
+    uvicorn.run(
+        "proxy_server:proxy_app", host="0.0.0.0", port=8999,
+        workers=workers,
+        backlog=config.listen_backlog,
+        timeout_keep_alive=config.keepalive_timeout,
+        # 收到 SIGTERM 后停止接受新连接，最多等待这么久让进行中的请求 (包括串流) 结束
+        timeout_graceful_shutdown=config.graceful_shutdown_timeout,
+        **_server_options(reload)
+    )
 
 
 if __name__ == "__main__":
-    if len(sys.argv) > 1:
-        if sys.argv[1] == "admin":
-            start_admin()
-        elif sys.argv[1] == "proxy":
-            start_proxy()
+    args = [arg for arg in sys.argv[1:] if arg != "--reload"]
+    reload = "--reload" in sys.argv[1:]
+    if args:
+        if args[0] == "admin":
+            start_admin(reload)
+        elif args[0] == "proxy":
+            start_proxy(reload)
         else:
-            print(f"Unknown command: {sys.argv[1]}")
-            print("Available commands: admin, proxy")
+            print(f"Unknown command: {args[0]}")
+            print("Available commands: admin, proxy [--reload]")
     else:
         print("Please specify a service to start.")
-        print("Available commands: admin, proxy")
\ No newline at end of file
+        print("Available commands: admin, proxy [--reload]")
@@ -0,0 +1,197 @@
+# src/metrics.py
+
+import math
+import time
+import functools
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# 默认的延迟分桶 (秒)：覆盖缓存命中 (毫秒级) 到全量爬取 (数十秒)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# 后台任务 (封面生成、RSS 刷新) 的耗时分桶 (秒)
+JOB_BUCKETS = (0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set_total(self, value: float, **labels):
+        """用于在抓取时镜像其他模块已有的累计计数 (如缓存命中数)。"""
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        self.set_total(value, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._series: Dict[LabelValues, List[float]] = {}  # 各分桶计数 + [sum]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-1] += value
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._series.items())
+        lines = self.header()
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = ("le", _format_value(bound) if bound == math.inf else repr(float(bound)))
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {series[-1]!r}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    """
+    进程内的指标注册表，按 Prometheus 文本格式 (0.0.4) 输出。
+    collectors 在每次抓取时调用，用于导出缓存大小等只需在抓取时读取的数值。
+    多 worker 部署时每个 worker 各自计数。
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], None]] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def add_collector(self, collector: Callable[[], None]):
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        for collector in self._collectors:
+            collector()
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+registry = Registry()
+
+# --- 代理请求 ---
+HANDLER_LATENCY = registry.histogram("evp_handler_latency_seconds", "Time spent in each proxy handler (time to response headers for streams).", ("handler",))
+REQUESTS = registry.counter("evp_requests_total", "Proxy requests by route and cache outcome.", ("route", "cache"))
+
+# --- 上游调用 ---
+UPSTREAM_LATENCY = registry.histogram("evp_upstream_latency_seconds", "Latency of upstream HTTP calls until response headers.", ("upstream",))
+UPSTREAM_REQUESTS = registry.counter("evp_upstream_requests_total", "Upstream HTTP calls by upstream and outcome.", ("upstream", "outcome"))
+
+# --- 串流与 WebSocket ---
+STREAMED_BYTES = registry.counter("evp_streamed_bytes_total", "Bytes streamed to clients by the pass-through handler.")
+ACTIVE_WEBSOCKETS = registry.gauge("evp_active_websockets", "WebSocket connections currently being proxied.")
+
+# --- 缓存 ---
+CACHE_ENTRIES = registry.gauge("evp_api_cache_entries", "Entries in the API response cache.", ("route",))
+CACHE_BYTES = registry.gauge("evp_api_cache_bytes", "Bytes used by the API response cache.", ("route",))
+CACHE_HITS = registry.counter("evp_api_cache_hits_total", "API response cache hits.", ("route",))
+CACHE_MISSES = registry.counter("evp_api_cache_misses_total", "API response cache misses.", ("route",))
+CACHE_HIT_RATIO = registry.gauge("evp_api_cache_hit_ratio", "API response cache hit ratio since start.", ("route",))
+VLIB_ITEMS_CACHE_ENTRIES = registry.gauge("evp_vlib_items_cache_entries", "Virtual libraries with a cached item list for cover generation.")
+VLIB_ITEMS_CACHE_LOOKUPS = registry.counter("evp_vlib_items_cache_lookups_total", "Lookups of the virtual library item list cache.", ("result",))
+
+# --- 后台任务 ---
+JOB_DURATION = registry.histogram("evp_job_duration_seconds", "Duration of background jobs.", ("job", "outcome"), buckets=JOB_BUCKETS)
+
+
+def timed_job(job: str):
+    """装饰异步的后台任务函数，记录其耗时；抛出异常时 outcome 为 error。"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            outcome = "error"
+            try:
+                result = await func(*args, **kwargs)
+                outcome = "ok"
+                return result
+            finally:
+                JOB_DURATION.observe(time.perf_counter() - start, job=job, outcome=outcome)
+        return wrapper
+    return decorator
@@ -1,7 +1,7 @@
 # src/models.py (Final Corrected Version)
 
 from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Literal, Optional
+from typing import Dict, List, Literal, Optional
 import uuid
 
 class AdvancedFilterRule(BaseModel):
@@ -15,11 +15,19 @@ class AdvancedFilterRule(BaseModel):
     value: Optional[str] = None
     relative_days: Optional[int] = None # 新增：用于存储相对日期（例如 30 天）
 
+class AdvancedFilterGroup(BaseModel):
+    # 新增：规则组，可嵌套。组内的规则与子组按 match_all 组合 (AND / OR)
+    match_all: bool = Field(default=True)
+    rules: List[AdvancedFilterRule] = Field(default_factory=list)
+    groups: List["AdvancedFilterGroup"] = Field(default_factory=list)
+
 class AdvancedFilter(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     name: str
     match_all: bool = Field(default=True)
     rules: List[AdvancedFilterRule] = Field(default_factory=list)
+    # 新增：嵌套的规则组，与顶层 rules 一起按顶层 match_all 组合；旧配置中没有此字段，行为不变
+    groups: List[AdvancedFilterGroup] = Field(default_factory=list)
 
 class VirtualLibrary(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -48,6 +56,13 @@ class AppConfig(BaseModel):
     emby_api_key: Optional[str] = Field(default="")
     emby_server_id: Optional[str] = Field(default=None) # 新增：用于TMDB缓存占位符的备用服务器ID
     log_level: Literal["debug", "info", "warn", "error"] = Field(default="info")
+    # 新增：高频日志 (如每个请求的拦截日志) 按路由每 N 条输出 1 条，1 为不采样；debug 级别下不采样
+    log_sample_every: int = Field(default=20)
+
+    # 新增：请求耗时分析。server_timing 为 true 时所有响应都带 Server-Timing 头
+    # (否则仅在请求带有 X-Server-Timing 头时输出)；超过 slow_request_ms 的请求记入慢请求列表，0 为不记录
+    server_timing: bool = Field(default=False)
+    slow_request_ms: int = Field(default=2000)
     display_order: List[str] = Field(default_factory=list)
     hide: List[str] = Field(default_factory=list)
     
@@ -63,6 +78,63 @@ class AppConfig(BaseModel):
 
     # 新增：缓存开关
     enable_cache: bool = Field(default=True)
+
+    # 新增：API 响应缓存的内存预算 (MB) 与按路由覆盖的缓存时间 (秒)
+    # 路由名称: views, latest, vlib_items, virtual_item, item_detail, seasons, episodes, system_info
+    cache_max_mb: int = Field(default=128)
+    cache_route_ttls: Dict[str, int] = Field(default_factory=dict)
+
+    # 新增：代理服务的生产启动参数 (修改后需重启服务生效)
+    # proxy_workers 为 0 时按 CPU 核心数启动 worker
+    proxy_workers: int = Field(default=1)
+    keepalive_timeout: int = Field(default=75)
+    listen_backlog: int = Field(default=2048)
+    graceful_shutdown_timeout: int = Field(default=30)
+
+    # 新增：上游 (Emby) 连接池参数 (修改后需重启服务生效)
+    # 超时单位为秒，0 表示不限制；total 默认不限制，以免中断长时间的串流
+    upstream_pool_limit: int = Field(default=256)
+    upstream_pool_limit_per_host: int = Field(default=128)
+    upstream_keepalive_timeout: float = Field(default=30)
+    upstream_connect_timeout: float = Field(default=10)
+    upstream_read_timeout: float = Field(default=60)
+    upstream_total_timeout: float = Field(default=0)
+    upstream_dns_ttl: int = Field(default=300)
+
+    # 新增：TMDB 合并虚拟库的全量获取。第一页之后的页按 merge_crawl_concurrency 并发获取，
+    # 页大小从 merge_crawl_page_size 开始按上游响应时间自动调整，每页失败时最多重试 merge_crawl_retries 次
+    merge_crawl_concurrency: int = Field(default=4)
+    merge_crawl_page_size: int = Field(default=200)
+    merge_crawl_retries: int = Field(default=2)
+    # 新增：合并虚拟库的增量分页。开启时只获取到满足当前页为止，TotalRecordCount 先按去重比例估算，
+    # 并在后台 (merge_background_total) 计算精确值。关闭时退回全量获取后再分页
+    merge_incremental_pagination: bool = Field(default=True)
+    merge_background_total: bool = Field(default=True)
+    # 新增：含后筛选规则的虚拟库持续向上游取数，直到凑满客户端请求的一页；
+    # 每批的过取量按筛选器的选择率估算，单次请求最多扫描 post_filter_max_scan 个上游项目
+    post_filter_fill_pages: bool = Field(default=True)
+    post_filter_max_scan: int = Field(default=5000)
+    # 新增：“或”筛选器的每个分支都能翻译为原生参数时，作为多个并发的原生查询执行后取并集，
+    # 代替拉取全部项目后在代理端筛选 (页末超过 post_filter_max_scan 的深分页仍走后筛选)
+    filter_or_pushdown: bool = Field(default=True)
+    # 新增：类型/标签/工作室的“不等于/不包含”规则先执行正向原生查询 (只取 Id) 得到 ID 集合，
+    # 集合不超过 negative_filter_native_max_ids 时通过 ExcludeItemIds 交给 Emby 排除，否则在代理端按 ID 减去；
+    # ID 集合缓存 negative_filter_id_ttl 秒
+    filter_negative_pushdown: bool = Field(default=True)
+    negative_filter_native_max_ids: int = Field(default=150)
+    negative_filter_id_ttl: int = Field(default=120)
+    # 新增：外部 ID (TMDB/IMDB/TVDB) -> Emby 项目的本地索引，供合并季/集查找同 TMDB ID 的剧集与 RSS 匹配使用。
+    # 超过 provider_index_refresh_seconds 未刷新时按 MinDateLastSaved 增量刷新，每 provider_index_rebuild_hours 全量重建一次
+    # 索引用 emby_api_key 建立并在所有用户之间共享，未配置 API Key 时不使用索引
+    provider_index_enabled: bool = Field(default=True)
+    provider_index_refresh_seconds: int = Field(default=300)
+    provider_index_rebuild_hours: int = Field(default=24)
+    # 新增：“项目是否属于启用合并的虚拟库”的判断结果缓存的秒数 (浏览合并虚拟库时也会预先写入)
+    merge_eligibility_ttl: int = Field(default=600)
+    # “不属于”的结果只短暂缓存：项目被加入合集/标签/类型后，Emby 中的变化不会通知代理
+    merge_eligibility_negative_ttl: int = Field(default=30)
+    # 每个查询的分页检查点 (合并去重、后筛选) 保留的秒数
+    query_cursor_ttl: int = Field(default=600)
     
     # 新增：自动生成封面的默认样式
     default_cover_style: str = Field(default='style_multi_1')
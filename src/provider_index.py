@@ -0,0 +1,259 @@
+# src/provider_index.py
+
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Mapping, Optional, Tuple
+
+import aiohttp
+
+import json_codec
+from db_manager import DBManager, PROVIDER_INDEX_DB
+from models import AppConfig
+
+logger = logging.getLogger(__name__)
+
+# 建立索引的外部 ID 类型 (Emby ProviderIds 中的键)
+PROVIDERS = ("Tmdb", "Imdb", "Tvdb")
+INDEXED_ITEM_TYPES = "Movie,Series"
+PAGE_SIZE = 1000
+# 增量刷新的时间窗口向前多取一段，避免上游时钟偏差或保存延迟漏掉项目
+REFRESH_OVERLAP = timedelta(minutes=2)
+# 查询未命中触发的补充刷新，两次之间至少间隔的秒数
+MISS_REFRESH_INTERVAL = 30
+
+
+def _emby_time(moment: datetime) -> str:
+    return moment.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+
+class ProviderIndex:
+    """
+    外部 ID (TMDB/IMDB/TVDB) -> Emby 项目的本地索引。
+    SQLite 中持久保存一份，供代理与管理服务共享；每个进程在内存中保留一份用于 O(1) 查询。
+    首次使用时在后台全量建立，之后按 MinDateLastSaved 增量刷新；超过 provider_index_rebuild_hours 时在后台全量重建，
+    以清除已在 Emby 中删除的项目。只在配置了 emby_api_key 时使用。
+    """
+
+    def __init__(self, db_path=PROVIDER_INDEX_DB):
+        self.db = DBManager(db_path)
+        # (provider, provider_id) -> {item_id: item_type}
+        self._by_key: Dict[Tuple[str, str], Dict[str, str]] = {}
+        # item_id -> 该项目当前的 (provider, provider_id) 列表，用于项目更新时移除旧的键
+        self._by_item: Dict[str, List[Tuple[str, str]]] = {}
+        self.loaded = False
+        self.watermark: Optional[str] = None   # 上次刷新覆盖到的 DateLastSaved (Emby 时间格式)
+        self.built_at: Optional[float] = None  # 上次全量建立的时间戳
+        self.refreshed_at = 0.0                 # 上次刷新 (任何类型) 的 monotonic 时间
+        self._lock = asyncio.Lock()
+        self._full_task: Optional[asyncio.Task] = None
+
+    # --- 读取 ---
+
+    def load(self):
+        """从 SQLite 载入索引 (每个进程一次)。"""
+        if self.loaded:
+            return
+        rows = self.db.fetchall("SELECT provider, provider_id, item_id, item_type FROM provider_index")
+        self._by_key, self._by_item = self._build((row["provider"], row["provider_id"], row["item_id"], row["item_type"]) for row in rows)
+        meta = {row["key"]: row["value"] for row in self.db.fetchall("SELECT key, value FROM provider_index_meta")}
+        self.watermark = meta.get("watermark")
+        self.built_at = float(meta["built_at"]) if meta.get("built_at") else None
+        self.loaded = True
+        logger.info(f"外部 ID 索引已载入: {len(self._by_item)} 个项目。")
+
+    def _disk_is_newer(self) -> bool:
+        meta = {row["key"]: row["value"] for row in self.db.fetchall("SELECT key, value FROM provider_index_meta")}
+        built_at = float(meta["built_at"]) if meta.get("built_at") else 0.0
+        # watermark 是 Emby 时间格式 (固定宽度的 UTC 时间)，可以直接按字符串比较
+        return built_at > (self.built_at or 0.0) or (meta.get("watermark") or "") > (self.watermark or "")
+
+    def sync_from_disk(self) -> bool:
+        """
+        每个进程 (各个代理 worker 与 admin) 都维护自己的内存索引并各自刷新，但共用同一个 SQLite。
+        刷新之前先检查：其他进程写入了更新的索引 (更晚的 built_at 或 watermark) 时从 SQLite 重新载入，
+        本进程接着它的 watermark 增量刷新，而不是用自己较旧的 watermark 覆盖它。返回是否重新载入。
+        """
+        if not self.loaded:
+            self.load()
+            return True
+        if not self._disk_is_newer():
+            return False
+        self.loaded = False
+        self.load()
+        return True
+
+    @property
+    def ready(self) -> bool:
+        return self.loaded and self.built_at is not None
+
+    def lookup(self, provider: str, provider_id: str, item_type: Optional[str] = None) -> List[str]:
+        """返回带有该外部 ID 的 Emby 项目 ID，可按类型 (Movie/Series) 过滤。"""
+        entries = self._by_key.get((provider, str(provider_id)), {})
+        return [item_id for item_id, kind in entries.items() if item_type is None or kind == item_type]
+
+    def __len__(self) -> int:
+        return len(self._by_item)
+
+    # --- 更新 ---
+
+    @staticmethod
+    def _build(rows: Iterable[Tuple[str, str, str, str]]):
+        by_key: Dict[Tuple[str, str], Dict[str, str]] = {}
+        by_item: Dict[str, List[Tuple[str, str]]] = {}
+        for provider, provider_id, item_id, item_type in rows:
+            by_key.setdefault((provider, provider_id), {})[item_id] = item_type
+            by_item.setdefault(item_id, []).append((provider, provider_id))
+        return by_key, by_item
+
+    def _remove_item(self, item_id: str):
+        for key in self._by_item.pop(item_id, ()):
+            entries = self._by_key.get(key)
+            if entries is not None:
+                entries.pop(item_id, None)
+                if not entries:
+                    del self._by_key[key]
+
+    @staticmethod
+    def _rows(items: Iterable[Mapping]) -> List[Tuple[str, str, str, str]]:
+        rows = []
+        for item in items:
+            item_id, item_type = item.get("Id"), item.get("Type")
+            if not item_id or not item_type:
+                continue
+            for provider in PROVIDERS:
+                value = (item.get("ProviderIds") or {}).get(provider)
+                if value:
+                    rows.append((provider, str(value), item_id, item_type))
+        return rows
+
+    def _apply_memory(self, items: List[Mapping], rows: List[Tuple[str, str, str, str]], full: bool):
+        """更新内存中的索引。全量时整体替换，查询不会看到建立到一半的索引。"""
+        if full:
+            self._by_key, self._by_item = self._build(rows)
+            return
+        for item in items:
+            if item.get("Id"):
+                self._remove_item(item["Id"])
+        for provider, provider_id, item_id, item_type in rows:
+            self._by_key.setdefault((provider, provider_id), {})[item_id] = item_type
+            self._by_item.setdefault(item_id, []).append((provider, provider_id))
+
+    def _persist(self, items: List[Mapping], rows: List[Tuple[str, str, str, str]], full: bool, watermark: str, built_at: Optional[float]):
+        """把同一批变化写入 SQLite (在线程中执行)。"""
+        if full:
+            self.db.execute("DELETE FROM provider_index", commit=True)
+        else:
+            self.db.executemany("DELETE FROM provider_index WHERE item_id = ?", [(item["Id"],) for item in items if item.get("Id")], commit=True)
+        self.db.executemany("INSERT OR REPLACE INTO provider_index (provider, provider_id, item_id, item_type) VALUES (?, ?, ?, ?)", rows, commit=True)
+        meta = [("watermark", watermark)] + ([("built_at", str(built_at))] if built_at else [])
+        self.db.executemany("INSERT OR REPLACE INTO provider_index_meta (key, value) VALUES (?, ?)", meta, commit=True)
+
+    async def _fetch(self, session: aiohttp.ClientSession, emby_url: str, headers: Mapping[str, str],
+                     auth_params: Mapping[str, str], min_date_last_saved: Optional[str]) -> List[Dict]:
+        url = f"{emby_url.rstrip('/')}/emby/Items"
+        params = {
+            "Recursive": "true", "IncludeItemTypes": INDEXED_ITEM_TYPES, "Fields": "ProviderIds",
+            "EnableImages": "false", "EnableUserData": "false", **auth_params,
+        }
+        if min_date_last_saved:
+            params["MinDateLastSaved"] = min_date_last_saved
+        items: List[Dict] = []
+        while True:
+            page_params = {**params, "StartIndex": str(len(items)), "Limit": str(PAGE_SIZE)}
+            async with session.get(url, params=page_params, headers=headers, timeout=aiohttp.ClientTimeout(total=120)) as resp:
+                if resp.status != 200:
+                    raise aiohttp.ClientResponseError(resp.request_info, resp.history, status=resp.status, message=await resp.text())
+                page = (await json_codec.read_json(resp)).get("Items") or []
+            items.extend(page)
+            if len(page) < PAGE_SIZE:
+                return items
+
+    async def refresh(self, session: aiohttp.ClientSession, config: AppConfig, full: Optional[bool] = None) -> int:
+        """
+        刷新索引，返回本次写入的项目数。full 为 None 时按索引状态决定：尚未建立或超过 provider_index_rebuild_hours 时全量建立。
+        索引在所有用户之间共享，只用 emby_api_key 建立 (覆盖整个服务器)；用户令牌看到的项目因人而异，不能用来建立。
+        """
+        if not config.emby_api_key:
+            raise ValueError("外部 ID 索引需要配置 emby_api_key")
+        async with self._lock:
+            await asyncio.to_thread(self.sync_from_disk)
+            if full is None:
+                full = self._needs_full(config)
+            elif not full and not self.ready:
+                return 0
+            started = datetime.now(timezone.utc)
+            since = None if full else self.watermark
+            items = await self._fetch(session, config.emby_url, {"X-Emby-Token": config.emby_api_key}, {}, since)
+            rows = self._rows(items)
+            watermark = _emby_time(started - REFRESH_OVERLAP)
+            self._apply_memory(items, rows, full)
+            if full:
+                self.built_at = time.time()
+            self.watermark = watermark
+            await asyncio.to_thread(self._persist, items, rows, full, watermark, self.built_at if full else None)
+            self.refreshed_at = time.monotonic()
+            logger.info(f"外部 ID 索引{'全量建立' if full else '增量刷新'}完成: 写入 {len(items)} 个项目，索引共 {len(self)} 个项目。")
+            return len(items)
+
+    def _needs_full(self, config: AppConfig) -> bool:
+        return not self.ready or (time.time() - self.built_at) > config.provider_index_rebuild_hours * 3600
+
+    async def _full_build(self, session: aiohttp.ClientSession, config: AppConfig):
+        try:
+            await self.refresh(session, config, full=True)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning(f"全量建立外部 ID 索引失败: {e}")
+        except Exception as e:
+            logger.error(f"全量建立外部 ID 索引时发生意外错误: {e}", exc_info=True)
+
+    def _start_full_build(self, session: aiohttp.ClientSession, config: AppConfig):
+        if self._full_task is None or self._full_task.done():
+            logger.info("外部 ID 索引需要全量建立，已转入后台执行。")
+            self._full_task = asyncio.create_task(self._full_build(session, config))
+
+    async def ensure_fresh(self, session: aiohttp.ClientSession, config: AppConfig,
+                           max_age: Optional[float] = None, wait_full: bool = False) -> bool:
+        """
+        索引超过 max_age 秒 (默认 provider_index_refresh_seconds) 未刷新时增量刷新；返回索引是否可用。
+        需要全量建立或重建时默认转入后台，期间沿用现有索引 (尚未建立时返回 False，调用方直接查询 Emby)；
+        wait_full 为 True 时在当前调用中完成全量建立 (供后台任务使用)。
+        """
+        if not config.emby_api_key:
+            return False
+        max_age = config.provider_index_refresh_seconds if max_age is None else max_age
+        stale = time.monotonic() - self.refreshed_at >= max_age
+        if not self.loaded or (not self._lock.locked() and (stale or self._needs_full(config))):
+            # 其他进程可能已经完成了全量建立或刷新
+            await asyncio.to_thread(self.sync_from_disk)
+        try:
+            if self._needs_full(config):
+                if wait_full:
+                    await self.refresh(session, config, full=True)
+                    return self.ready
+                self._start_full_build(session, config)
+                return self.ready
+            if self._lock.locked() or time.monotonic() - self.refreshed_at < max_age:
+                return True
+            await self.refresh(session, config, full=False)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning(f"刷新外部 ID 索引失败: {e}")
+        return self.ready
+
+    async def lookup_fresh(self, session: aiohttp.ClientSession, config: AppConfig, provider: str, provider_id: str,
+                           item_type: Optional[str] = None, expected_id: Optional[str] = None) -> Optional[List[str]]:
+        """
+        查询前按需刷新；已知应当存在的项目 (expected_id) 不在结果中时说明索引落后，补充一次增量刷新后重查。
+        索引不可用 (未配置 emby_api_key 或尚未建立) 时返回 None，调用方应退回直接查询 Emby。
+        """
+        if not await self.ensure_fresh(session, config):
+            return None
+        found = self.lookup(provider, provider_id, item_type)
+        if expected_id and expected_id not in found:
+            await self.ensure_fresh(session, config, max_age=MISS_REFRESH_INTERVAL)
+            found = self.lookup(provider, provider_id, item_type)
+        return found
+
+
+provider_index = ProviderIndex()
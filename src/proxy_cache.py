@@ -1,14 +1,541 @@
 # src/proxy_cache.py
 
-from cachetools import TTLCache, Cache
+import os
+import re
+import json
+import time
+import asyncio
+from collections import Counter, OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Mapping, Optional
 
-# 创建一个全局的、线程安全的缓存实例
-# - maxsize=500: 最多缓存 500 个不同的 API 响应
-# - ttl=300:     每个缓存项的存活时间为 300 秒 (5 分钟)
-api_cache = TTLCache(maxsize=500, ttl=300)
+from cachetools import Cache
+
+import json_codec
+from config_manager import CONFIG_DIR, CONFIG_CHECK_INTERVAL_MS
+
+# 每个路由的默认缓存时间 (秒)。可通过 AppConfig.cache_route_ttls 覆盖。
+DEFAULT_ROUTE_TTLS: Dict[str, int] = {
+    "views": 60,          # 主页视图：变化频繁，短缓存
+    "latest": 120,        # 最新项目
+    "vlib_items": 600,    # 虚拟库分页：生成代价最高，缓存最久
+    "virtual_item": 300,  # 虚拟库自身的详情
+    "item_detail": 120,   # 单个项目详情
+    "seasons": 300,
+    "episodes": 300,
+    "system_info": 300,
+}
+# 没有单独配置的策略使用的缓存时间
+DEFAULT_TTL = 300
+DEFAULT_MAX_BYTES = 128 * 1024 * 1024
+
+# 每个条目在键和响应体之外的大致固定开销 (字节)
+ENTRY_OVERHEAD = 256
+
+# 项目 ID 只含十六进制字符，据此排除 Items/Resume、Items/Filters 等同样形状的列表接口
+ITEM_DETAIL_REGEX = re.compile(r"(?:^|/)(Users/[^/]+/)?Items/[0-9a-fA-F-]+$")
+
+
+def cache_policy_for(route_name: str, full_path: str, query_params: Optional[Mapping[str, str]] = None) -> str:
+    """
+    将路由名称细化为缓存策略名称。单项目详情走的是透传路由，但有自己的 TTL；
+    只有带用户的详情请求 (/Users/{id}/Items/{id} 或带 UserId 参数) 才归入 item_detail，
+    不带用户的响应无法按用户区分缓存。
+    """
+    if route_name == "passthrough":
+        match = ITEM_DETAIL_REGEX.search(full_path)
+        if match and (match.group(1) or (query_params or {}).get("UserId")):
+            return "item_detail"
+    return route_name
+
+
+class _Entry:
+    __slots__ = ("value", "size", "expires_at", "policy", "user_id", "path", "library_id")
+
+    def __init__(self, value: Any, size: int, expires_at: float, policy: str,
+                 user_id: Optional[str] = None, path: str = "", library_id: Optional[str] = None):
+        self.value = value
+        self.size = size
+        self.expires_at = expires_at
+        self.policy = policy
+        self.user_id = user_id
+        self.path = path
+        self.library_id = library_id
+
+
+class ResponseCache:
+    """
+    按字节计量的 LRU + TTL 响应缓存。
+    - 总内存占用不超过 max_bytes，超出时从最久未使用的条目开始淘汰；
+    - 每个条目按其路由策略使用不同的 TTL；
+    - 按策略统计命中、未命中和淘汰次数。
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES, route_ttls: Optional[Dict[str, int]] = None):
+        self._data: "OrderedDict[str, _Entry]" = OrderedDict()
+        self.max_bytes = max_bytes
+        self.route_ttls = dict(DEFAULT_ROUTE_TTLS)
+        if route_ttls:
+            self.route_ttls.update(route_ttls)
+        self.current_bytes = 0
+        self.hits: Counter = Counter()
+        self.misses: Counter = Counter()
+        self.evictions: Counter = Counter()
+        self.expirations: Counter = Counter()
+
+    def configure(self, max_bytes: int, route_ttls: Optional[Dict[str, int]] = None):
+        self.max_bytes = max_bytes
+        self.route_ttls = dict(DEFAULT_ROUTE_TTLS)
+        if route_ttls:
+            self.route_ttls.update(route_ttls)
+        self._shrink(0)
+
+    def ttl_for(self, policy: str) -> int:
+        return self.route_ttls.get(policy, DEFAULT_TTL)
+
+    @staticmethod
+    def _sizeof(key: str, value: Any) -> int:
+        size = len(key) + ENTRY_OVERHEAD
+        if isinstance(value, tuple):
+            for part in value:
+                if isinstance(part, (bytes, str)):
+                    size += len(part)
+                elif isinstance(part, dict):
+                    # 响应头 (str -> str) 或压缩变体 (编码 -> bytes)，压缩变体同样计入预算
+                    size += sum(len(k) + (len(v) if isinstance(v, (bytes, str)) else len(str(v))) for k, v in part.items())
+        elif isinstance(value, (bytes, str)):
+            size += len(value)
+        return size
+
+    def _remove(self, key: str) -> Optional[_Entry]:
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self.current_bytes -= entry.size
+        return entry
+
+    def _shrink(self, incoming: int):
+        while self._data and self.current_bytes + incoming > self.max_bytes:
+            key, entry = self._data.popitem(last=False)
+            self.current_bytes -= entry.size
+            self.evictions[entry.policy] += 1
+
+    def get(self, key: str, policy: str = "passthrough") -> Any:
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses[policy] += 1
+            return None
+        if entry.expires_at <= time.monotonic():
+            self._remove(key)
+            self.expirations[entry.policy] += 1
+            self.misses[policy] += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits[entry.policy] += 1
+        return entry.value
+
+    def set(self, key: str, value: Any, policy: str = "passthrough", ttl: Optional[int] = None,
+            user_id: Optional[str] = None, path: str = "", library_id: Optional[str] = None):
+        size = self._sizeof(key, value)
+        self._remove(key)
+        if size > self.max_bytes:
+            # 单个响应超过整个预算，不缓存
+            return
+        self._shrink(size)
+        expires_at = time.monotonic() + (ttl if ttl is not None else self.ttl_for(policy))
+        self._data[key] = _Entry(value, size, expires_at, policy, user_id, path, library_id)
+        self.current_bytes += size
+
+    def invalidate(self, user_id: Optional[str] = None, library_id: Optional[str] = None,
+                   path_prefix: Optional[str] = None, policy: Optional[str] = None) -> int:
+        """
+        按条件淘汰缓存条目，条件之间为“与”关系；不传任何条件时清空全部。
+        按虚拟库淘汰时，主页视图和虚拟库详情也会一并淘汰，因为它们包含所有虚拟库的名称和封面。
+        """
+        if user_id is None and library_id is None and path_prefix is None and policy is None:
+            removed = len(self._data)
+            self.clear()
+            return removed
+
+        def matches(entry: _Entry) -> bool:
+            if user_id is not None and entry.user_id != user_id:
+                return False
+            if path_prefix is not None and not entry.path.startswith(path_prefix.lstrip('/')):
+                return False
+            if policy is not None and entry.policy != policy:
+                return False
+            if library_id is not None:
+                return (entry.library_id == library_id or library_id in entry.path
+                        or entry.policy in ("views", "virtual_item"))
+            return True
+
+        keys = [key for key, entry in self._data.items() if matches(entry)]
+        for key in keys:
+            self._remove(key)
+        return len(keys)
+
+    def pop(self, key: str, default: Any = None) -> Any:
+        entry = self._remove(key)
+        return entry.value if entry is not None else default
+
+    def clear(self):
+        self._data.clear()
+        self.current_bytes = 0
+
+    def __contains__(self, key: str) -> bool:
+        entry = self._data.get(key)
+        return entry is not None and entry.expires_at > time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        policies = set(self.hits) | set(self.misses) | set(self.evictions) | set(self.expirations)
+        entries_by_policy: Counter = Counter()
+        bytes_by_policy: Counter = Counter()
+        for entry in self._data.values():
+            entries_by_policy[entry.policy] += 1
+            bytes_by_policy[entry.policy] += entry.size
+        return {
+            "entries": len(self._data),
+            "bytes": self.current_bytes,
+            "max_bytes": self.max_bytes,
+            "routes": {
+                policy: {
+                    "hits": self.hits[policy],
+                    "misses": self.misses[policy],
+                    "evictions": self.evictions[policy],
+                    "expirations": self.expirations[policy],
+                    "entries": entries_by_policy[policy],
+                    "bytes": bytes_by_policy[policy],
+                    "ttl": self.ttl_for(policy),
+                }
+                for policy in sorted(policies | set(entries_by_policy))
+            },
+        }
+
+
+class SingleFlight:
+    """
+    合并相同的并发上游请求。对同一个缓存键，只有第一个请求（leader）真正执行处理器，
+    其余并发到达的请求等待 leader 的结果。
+    leader 的结果不可共享时（例如流式响应或处理失败），等待者会收到 None，需自行处理。
+    """
+
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    def join(self, key: str) -> Optional[asyncio.Future]:
+        """如果该键已有请求在处理中，返回其 Future；否则将调用方登记为 leader 并返回 None。"""
+        future = self._inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            return future
+        self._inflight[key] = asyncio.get_running_loop().create_future()
+        self.leaders += 1
+        return None
+
+    def finish(self, key: str, result: Any):
+        """leader 完成后调用（无论成功与否），唤醒所有等待者。"""
+        future = self._inflight.pop(key, None)
+        if future is not None and not future.done():
+            future.set_result(result)
+
+    def stats(self) -> Dict[str, int]:
+        return {"in_flight": len(self._inflight), "leaders": self.leaders, "coalesced": self.coalesced}
+
+
+class QueryCursorStore:
+    """
+    按查询保存分页游标 (合并分页的去重检查点、后筛选的偏移检查点等)。
+    条目带 TTL 与数量上限，按最久未使用淘汰；虚拟库或配置变化时随其他缓存一起淘汰。
+    """
+
+    def __init__(self, maxsize: int = 256):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (library_id, expires_at, value)
+
+    def get(self, key: str) -> Any:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry[1] <= time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return entry[2]
+
+    def set(self, key: str, value: Any, ttl: float, library_id: Optional[str] = None):
+        self._data[key] = (library_id, time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, library_id: Optional[str] = None) -> int:
+        if library_id is None:
+            removed = len(self._data)
+            self._data.clear()
+            return removed
+        keys = [key for key, entry in self._data.items() if entry[0] == library_id]
+        for key in keys:
+            del self._data[key]
+        return len(keys)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class InvalidationBroadcast:
+    """
+    多 worker 部署时，每个 worker 进程都有自己的缓存，而 admin 的淘汰请求只会落到其中一个 worker。
+    收到请求的 worker 把淘汰条件追加到共享目录下的日志文件中，其余 worker 定期读取新增的部分并照做。
+    配置变化不需要经过这里：每个 worker 都会自己发现配置文件的变化并做差异淘汰。
+    """
+
+    MAX_LOG_BYTES = 1024 * 1024
+
+    def __init__(self, path: Path, check_interval: float = 1.0):
+        self.path = path
+        self.check_interval = check_interval
+        self.enabled = False
+        self._offset = 0
+        self._checked_at = 0.0
+
+    def enable(self):
+        """从日志当前末尾开始监听，启动前的历史记录不会被重放。"""
+        try:
+            self._offset = self.path.stat().st_size
+        except FileNotFoundError:
+            self._offset = 0
+        self.enabled = True
+
+    def publish(self, scope: Dict[str, Any]):
+        if not self.enabled:
+            return
+        line = json.dumps({"pid": os.getpid(), "scope": scope}, ensure_ascii=False) + "\n"
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            # 日志过大时截断；其他 worker 发现文件变短后会从头读取
+            mode = "w" if self.path.is_file() and self.path.stat().st_size > self.MAX_LOG_BYTES else "a"
+            with open(self.path, mode, encoding="utf-8") as f:
+                f.write(line)
+        except OSError:
+            pass
+
+    def poll(self) -> List[Dict[str, Any]]:
+        """返回其他 worker 发布的新淘汰条件；两次检查之间的调用直接返回空列表。"""
+        now = time.monotonic()
+        if not self.enabled or now - self._checked_at < self.check_interval:
+            return []
+        self._checked_at = now
+        try:
+            size = self.path.stat().st_size
+        except FileNotFoundError:
+            return []
+        if size == self._offset:
+            return []
+        if size < self._offset:
+            self._offset = 0
+        with open(self.path, "r", encoding="utf-8") as f:
+            f.seek(self._offset)
+            chunk = f.read()
+        # 只消费完整的行，写了一半的行留到下次
+        consumed = chunk.rfind("\n") + 1
+        self._offset += len(chunk[:consumed].encode("utf-8"))
+        scopes = []
+        for line in chunk[:consumed].splitlines():
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("pid") != os.getpid():
+                scopes.append(record.get("scope") or {})
+        return scopes
+
+
+def _dump(model) -> Any:
+    return model.model_dump() if model is not None else None
+
+
+def invalidate_for_config_change(old_config, new_config) -> int:
+    """
+    比较新旧配置，只淘汰受影响的缓存条目：
+    - 影响所有响应的全局设置变化时，清空全部缓存；
+    - 某个虚拟库（或其使用的高级筛选器）变化时，只淘汰该虚拟库相关的条目；
+    - 主页布局变化时，只淘汰主页视图。
+    """
+    if old_config is None:
+        return 0
+
+    global_fields = ("emby_url", "emby_api_key", "force_merge_by_tmdb_id", "show_missing_episodes", "tmdb_api_key", "enable_cache")
+    if any(getattr(old_config, f) != getattr(new_config, f) for f in global_fields):
+        vlib_items_cache.clear()
+        query_cursors.invalidate()
+        merge_eligibility.invalidate()
+        return api_cache.invalidate()
+
+    removed = 0
+    old_filters = {f.id: _dump(f) for f in old_config.advanced_filters}
+    new_filters = {f.id: _dump(f) for f in new_config.advanced_filters}
+    changed_filters = {fid for fid in old_filters.keys() | new_filters.keys() if old_filters.get(fid) != new_filters.get(fid)}
+
+    old_vlibs = {v.id: v for v in old_config.virtual_libraries}
+    new_vlibs = {v.id: v for v in new_config.virtual_libraries}
+    for vlib_id in old_vlibs.keys() | new_vlibs.keys():
+        old_vlib, new_vlib = old_vlibs.get(vlib_id), new_vlibs.get(vlib_id)
+        uses_changed_filter = any(v is not None and v.advanced_filter_id in changed_filters for v in (old_vlib, new_vlib))
+        if _dump(old_vlib) != _dump(new_vlib) or uses_changed_filter:
+            removed += api_cache.invalidate(library_id=vlib_id)
+            vlib_items_cache.pop(vlib_id, None)
+            query_cursors.invalidate(vlib_id)
+            merge_eligibility.invalidate()
+
+    if old_config.display_order != new_config.display_order or old_config.hide != new_config.hide:
+        removed += api_cache.invalidate(policy="views")
+    return removed
+
+
+# 创建一个全局的 API 响应缓存实例
+# 容量按字节计算，TTL 按路由区分；启动时及配置变化时由 proxy_server 根据配置调整
+api_cache = ResponseCache()
+
+# 缓存未命中时的并发请求合并器，按缓存键合并
+request_coalescer = SingleFlight()
+
+# 多 worker 部署时在 worker 之间同步显式淘汰请求；单进程时不启用
+cache_invalidation_broadcast = InvalidationBroadcast(CONFIG_DIR / "cache_invalidations.log", CONFIG_CHECK_INTERVAL_MS / 1000)
+
+# 每个虚拟库落盘的封面素材项目数上限，以及写入后合并落盘的延迟 (秒)
+COVER_SAMPLE_SIZE = 100
+COVER_SAMPLE_FLUSH_DELAY = 2.0
+
+
+class VlibItemsCache(Cache):
+    """
+    虚拟库项目列表缓存 (用于封面生成)。
+    多 worker 部署时每个 worker 只缓存自己处理过的虚拟库，admin 无法确定该问哪个 worker，
+    因此每次写入或删除都会把带主封面的项目 (最多 COVER_SAMPLE_SIZE 个) 写到共享目录下，admin 直接读取。
+    同一虚拟库的连续写入在 COVER_SAMPLE_FLUSH_DELAY 秒内合并为一次落盘，在线程中执行，不阻塞请求。
+    """
+
+    def __init__(self, maxsize: int, sample_dir: Path):
+        super().__init__(maxsize)
+        self.sample_dir = sample_dir
+        self._dirty: set = set()
+        self._flush_scheduled = False
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._mark(key)
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._mark(key)
+
+    def _mark(self, key):
+        self._dirty.add(key)
+        if self._flush_scheduled:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return  # 不在事件循环中 (如脚本调用)，不落盘
+        self._flush_scheduled = True
+        loop.call_later(COVER_SAMPLE_FLUSH_DELAY, self._flush)
+
+    def _flush(self):
+        self._flush_scheduled = False
+        snapshot = {key: self.get(key) for key in self._dirty}
+        self._dirty.clear()
+        asyncio.get_running_loop().run_in_executor(None, self._write_samples, snapshot)
+
+    def sample_path(self, library_id: str) -> Path:
+        return cover_sample_path(self.sample_dir, library_id)
+
+    def _write_samples(self, snapshot: Dict[str, Any]):
+        for library_id, cached in snapshot.items():
+            path = self.sample_path(library_id)
+            if path is None:
+                continue
+            try:
+                items = cached.decode() if isinstance(cached, RawItemsPage) else (cached or [])
+                samples = [
+                    {"Id": item["Id"], "ImageTags": {"Primary": item["ImageTags"]["Primary"]}}
+                    for item in items
+                    if isinstance(item, dict) and item.get("Id") and (item.get("ImageTags") or {}).get("Primary")
+                ][:COVER_SAMPLE_SIZE]
+                if not samples:
+                    if cached is None:
+                        path.unlink(missing_ok=True)
+                    continue
+                path.parent.mkdir(parents=True, exist_ok=True)
+                tmp = path.with_suffix(f".{os.getpid()}.tmp")
+                tmp.write_bytes(json_codec.dumps({"Items": samples}))
+                os.replace(tmp, path)
+            except OSError:
+                pass
+
+
+_SAFE_LIBRARY_ID = re.compile(r"^[A-Za-z0-9_-]+$")
+
+
+def cover_sample_path(sample_dir: Path, library_id: str) -> Optional[Path]:
+    """虚拟库封面素材文件的路径；ID 含有路径字符时返回 None。"""
+    if not _SAFE_LIBRARY_ID.match(library_id or ""):
+        return None
+    return sample_dir / f"{library_id}.json"
+
+
+COVER_SAMPLE_DIR = CONFIG_DIR / "cover_samples"
 
 # 【【【 新增 】】】
 # 虚拟库项目列表缓存 (用于封面生成)
 # - maxsize=100: 最多缓存100个虚拟库的项目列表
 # 这个缓存不需要时间过期，因为它只在用户浏览时更新
-vlib_items_cache = Cache(maxsize=100)
\ No newline at end of file
+vlib_items_cache = VlibItemsCache(maxsize=100, sample_dir=COVER_SAMPLE_DIR)
+
+# 分页游标：同一查询的后续翻页从检查点继续，而不是从头获取
+query_cursors = QueryCursorStore()
+
+# 项目 ID -> 是否属于某个启用了 TMDB 合并的虚拟库 (决定季/集是否合并)。
+# 任何虚拟库配置或媒体库内容变化都可能改变结果，因此只整体清空
+merge_eligibility = QueryCursorStore(maxsize=20000)
+
+
+class RawItemsPage:
+    """
+    原样转发的上游分页响应体。只在有人读取 (封面生成) 时才解析出 Items，
+    这样直通分页的请求路径上不需要为了填充 vlib_items_cache 而解析和重新序列化整页 JSON。
+    """
+    __slots__ = ("raw",)
+
+    def __init__(self, raw: bytes):
+        self.raw = raw
+
+    @staticmethod
+    def has_items(raw: bytes) -> bool:
+        """不解析整页，只查看 "Items" 数组是否为空 (空页不覆盖已有的缓存)。"""
+        start = raw.find(b'"Items":')
+        if start < 0:
+            return False
+        head = raw[start + 8:start + 72].lstrip()
+        return head.startswith(b"[") and not head[1:].lstrip().startswith(b"]")
+
+    def decode(self) -> List[Dict[str, Any]]:
+        try:
+            return json_codec.loads(self.raw).get("Items") or []
+        except (json_codec.JSONDecodeError, AttributeError):
+            return []
+
+
+def get_vlib_items(library_id: str) -> Optional[List[Dict[str, Any]]]:
+    """读取虚拟库的项目列表缓存；原始字节在首次读取时解析，并用解析结果替换缓存条目。"""
+    cached = vlib_items_cache.get(library_id)
+    if isinstance(cached, RawItemsPage):
+        cached = cached.decode()
+        if cached:
+            vlib_items_cache[library_id] = cached
+        else:
+            vlib_items_cache.pop(library_id, None)
+    return cached or None
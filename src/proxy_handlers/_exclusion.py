@@ -0,0 +1,114 @@
+# src/proxy_handlers/_exclusion.py
+
+import asyncio
+import hashlib
+import logging
+from typing import Any, Callable, Dict, FrozenSet, List, Mapping, Optional, Tuple
+
+from aiohttp import ClientSession
+
+from models import AppConfig
+from request_timing import span
+from proxy_cache import query_cursors
+from ._page_fetcher import PageFetchError, fetch_all_items
+from ._merge_paginator import query_key
+
+logger = logging.getLogger(__name__)
+
+# 取 ID 集合时不需要的客户端参数 (分页、排序、字段与图片)
+_DROPPED_PARAMS = ("StartIndex", "Limit", "SortBy", "SortOrder", "Fields", "EnableImageTypes", "ImageTypeLimit")
+
+# 正在加载的 ID 集合：同一集合的并发请求共享一次加载
+_loading: Dict[str, asyncio.Future] = {}
+
+
+def _fingerprint(values) -> str:
+    return hashlib.blake2b("\n".join(sorted(values)).encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _id_params(params: Mapping[str, str], positive: Dict[str, Any]) -> Dict[str, str]:
+    """正向查询的参数：沿用主查询的范围与原生条件，只请求 Id，不要图片和用户数据。"""
+    id_params = {k: v for k, v in params.items() if k not in _DROPPED_PARAMS}
+    id_params.update(positive)
+    id_params.update({"SortBy": "SortName", "Fields": "", "EnableImages": "false", "EnableUserData": "false"})
+    return id_params
+
+
+async def _load_id_set(
+    session: ClientSession, url: str, id_params: Dict[str, str], headers: Mapping[str, str],
+    config: AppConfig, key: str, library_id: str
+) -> Tuple[FrozenSet[str], str]:
+    items = await fetch_all_items(session, "GET", url, id_params, headers, config, key=f"ids:{library_id}")
+    ids = frozenset(item["Id"] for item in items if isinstance(item, dict) and item.get("Id"))
+    # 指纹在加载时算一次，与集合一起缓存：集合重新加载后内容变化，依赖它的后筛选检查点随之换键
+    entry = (ids, _fingerprint(ids))
+    query_cursors.set(key, entry, config.negative_filter_id_ttl, library_id=library_id)
+    logger.debug("否定规则: 正向查询 %s 共 %d 个 ID", {k: id_params[k] for k in id_params if k in ("Genres", "Tags", "Studios")}, len(ids))
+    return entry
+
+
+async def _id_set(
+    session: ClientSession, url: str, params: Mapping[str, str], headers: Mapping[str, str],
+    config: AppConfig, positive: Dict[str, Any], library_id: str, user_id: str
+) -> Tuple[FrozenSet[str], str]:
+    id_params = _id_params(params, positive)
+    key = query_key("ids", library_id, user_id, id_params)
+    entry = query_cursors.get(key)
+    if entry is not None:
+        return entry
+    future = _loading.get(key)
+    if future is None:
+        future = _loading[key] = asyncio.ensure_future(_load_id_set(session, url, id_params, headers, config, key, library_id))
+        future.add_done_callback(lambda _: _loading.pop(key, None))
+    # 某个等待者被取消时不取消共享的加载
+    return await asyncio.shield(future)
+
+
+async def excluded_ids(
+    session: ClientSession, url: str, params: Mapping[str, str], headers: Mapping[str, str],
+    config: AppConfig, exclusions: Tuple[Dict[str, Any], ...], library_id: str, user_id: str
+) -> Tuple[FrozenSet[str], str]:
+    """
+    并发取得每条否定规则的正向 ID 集合 (带短 TTL 缓存)，返回它们的并集与指纹。
+    任何一个集合重新加载后内容有变化，指纹就会改变。
+    """
+    entries = await asyncio.gather(*(
+        _id_set(session, url, params, headers, config, positive, library_id, user_id) for positive in exclusions
+    ))
+    ids = frozenset().union(*(entry[0] for entry in entries))
+    return ids, _fingerprint(entry[1] for entry in entries)
+
+
+def exclusion_filter(
+    ids: FrozenSet[str], then: Optional[Callable[[List[Dict[str, Any]]], List[Dict[str, Any]]]]
+) -> Callable[[List[Dict[str, Any]]], List[Dict[str, Any]]]:
+    """从项目列表中减去 ID 集合，再应用其余的后筛选条件。"""
+    def apply(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        kept = [item for item in items if item.get("Id") not in ids]
+        return then(kept) if then else kept
+    return apply
+
+
+async def apply_exclusions(
+    session: ClientSession, url: str, params: Dict[str, str], headers: Mapping[str, str],
+    config: AppConfig, plan, library_id: str, user_id: str
+) -> Tuple[Optional[Callable[[List[Dict[str, Any]]], List[Dict[str, Any]]]], Optional[str], Optional[str]]:
+    """
+    按查询计划处理否定规则，返回 (post_filter, 排除方式, 检查点代次)。
+    ID 集合较小时写入 params 的 ExcludeItemIds 交给 Emby 原生排除 ("exclude_native")，
+    否则在代理端按 ID 减去 ("exclude_local")，此时代次为集合的指纹，供后筛选检查点换键使用。
+    没有可排除的规则、未启用或取 ID 失败时返回计划原本的 post_filter。
+    """
+    if not plan.exclusions or not config.filter_negative_pushdown:
+        return plan.post_filter, None, None
+    try:
+        with span("exclusion_ids"):
+            ids, fingerprint = await excluded_ids(session, url, params, headers, config, plan.exclusions, library_id, user_id)
+    except PageFetchError as e:
+        logger.warning(f"获取否定规则的 ID 集合失败，退回后筛选: {e}")
+        return plan.post_filter, None, None
+    if len(ids) <= config.negative_filter_native_max_ids:
+        if ids:
+            params["ExcludeItemIds"] = ",".join(sorted(ids))
+        return plan.residual_filter, "exclude_native", None
+    return exclusion_filter(ids, plan.residual_filter), "exclude_local", fingerprint
@@ -0,0 +1,91 @@
+# src/proxy_handlers/_filter_explain.py
+
+import math
+from typing import Any, Dict, List, Optional
+
+from models import AppConfig, AdvancedFilter
+from ._filter_translator import plan_filter, iter_rules
+from ._page_fetcher import MAX_PAGE_SIZE
+from ._page_filler import DEFAULT_SELECTIVITY, MIN_SELECTIVITY
+
+# 估算时假定的客户端页大小 (大多数 Emby 客户端的默认值)
+EXPLAIN_PAGE_LIMIT = 50
+# 低于此选择率的后筛选视为低效：每页需要扫描 10 倍以上的上游项目
+LOW_SELECTIVITY = 0.1
+
+
+def _strategy(plan, config: AppConfig) -> str:
+    """与 handler_items 的选择顺序一致：原生 > “或”并发查询 > ID 排除 > 后筛选。"""
+    if plan.post_filter is None:
+        return "native"
+    if plan.or_branches and config.filter_or_pushdown:
+        return "or_union"
+    if plan.exclusions and config.filter_negative_pushdown:
+        return "exclusion+post_filter" if plan.residual_filter else "exclusion"
+    return "post_filter"
+
+
+def explain_filter(adv_filter: AdvancedFilter, config: AppConfig, stats: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    说明一个高级筛选器的执行计划：哪些条件下推给 Emby、哪些在代理端后筛选、
+    使用它的虚拟库是否需要 TMDB 合并，以及每页预计向上游发出的请求数。
+    stats 为代理端记录的运行统计 (见 _page_filler.FilterStats.to_dict)，没有时按默认选择率估算。
+    """
+    plan = plan_filter(adv_filter)
+    strategy = _strategy(plan, config)
+    libraries = [
+        {"id": v.id, "name": v.name, "merge": v.merge_by_tmdb_id or config.force_merge_by_tmdb_id}
+        for v in config.virtual_libraries if v.advanced_filter_id == adv_filter.id
+    ]
+    warnings: List[str] = []
+
+    measured = (stats or {}).get("selectivity")
+    selectivity = measured if measured is not None else DEFAULT_SELECTIVITY
+    limit = EXPLAIN_PAGE_LIMIT
+    if strategy == "native":
+        requests_per_page, items_per_page = 1, limit
+    elif strategy == "or_union":
+        requests_per_page, items_per_page = len(plan.or_branches), limit * len(plan.or_branches)
+    elif strategy == "exclusion":
+        requests_per_page, items_per_page = 1, limit
+    else:
+        items_per_page = math.ceil(limit / max(selectivity, MIN_SELECTIVITY))
+        requests_per_page = math.ceil(items_per_page / MAX_PAGE_SIZE) if config.post_filter_fill_pages else 1
+        if items_per_page > config.post_filter_max_scan:
+            warnings.append(f"每页预计扫描 {items_per_page} 个上游项目，超过 post_filter_max_scan ({config.post_filter_max_scan})，返回的页面可能不满。")
+        if measured is not None and measured < LOW_SELECTIVITY:
+            warnings.append(f"后筛选选择率为 {measured:.1%}，每页需要扫描约 {items_per_page} 个上游项目；考虑把条件改写为可下推的规则。")
+        if not adv_filter.match_all and not plan.or_branches:
+            warnings.append("“匹配任意”中有无法翻译的规则 (或分支过多)，整个筛选器都在代理端后筛选。")
+    note = f"另有 {len(plan.exclusions)} 个只取 Id 的正向查询，结果缓存 {config.negative_filter_id_ttl} 秒" if plan.exclusions else None
+
+    if plan.post_filter_rules and any(lib["merge"] for lib in libraries) and strategy != "exclusion":
+        warnings.append("使用此筛选器的虚拟库启用了 TMDB 合并，但存在后筛选条件：合并只在当前页内进行，结果可能不完整。")
+    recent_ms = (stats or {}).get("recent_request_ms")
+    if recent_ms is not None and recent_ms > config.slow_request_ms:
+        warnings.append(f"最近的请求耗时约 {recent_ms} ms，超过慢请求阈值 ({config.slow_request_ms} ms)。")
+
+    return {
+        "id": adv_filter.id,
+        "name": adv_filter.name,
+        "match_all": adv_filter.match_all,
+        "rule_count": sum(1 for _ in iter_rules(adv_filter)),
+        "strategy": strategy,
+        "slow_path": strategy in ("post_filter", "exclusion+post_filter"),
+        "native_params": plan.native_params,
+        "post_filter_rules": [rule.model_dump() for rule in plan.post_filter_rules],
+        "or_branches": list(plan.or_branches),
+        "exclusions": list(plan.exclusions),
+        "libraries": libraries,
+        "requires_merge": any(lib["merge"] for lib in libraries),
+        "expected_upstream": {
+            "page_limit": limit,
+            "requests_per_page": requests_per_page,
+            "items_per_page": items_per_page,
+            "selectivity": round(selectivity, 4) if strategy in ("post_filter", "exclusion+post_filter") else measured,
+            "selectivity_source": "measured" if measured is not None else "assumed",
+            "note": note,
+        },
+        "stats": stats,
+        "warnings": warnings,
+    }
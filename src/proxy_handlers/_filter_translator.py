@@ -1,8 +1,11 @@
 # src/proxy_handlers/_filter_translator.py (新文件)
 
 import logging
-from typing import List, Dict, Any, Tuple
-from models import AdvancedFilterRule
+import re
+from dataclasses import dataclass
+from typing import List, Dict, Any, Optional, Tuple, Callable
+from models import AdvancedFilter, AdvancedFilterGroup, AdvancedFilterRule
+from request_timing import span
 from datetime import datetime, timedelta
 
 logger = logging.getLogger(__name__)
@@ -126,8 +129,8 @@ def translate_rules(rules: List[AdvancedFilterRule]) -> Tuple[Dict[str, Any], Li
                         emby_native_params[param_name] = value
                     translated = True
             
-            # 处理直接映射的字段
-            elif isinstance(param_template, str):
+            # 处理直接映射的字段：这些参数都是“等于/包含该值”的语义，只能表达 equals
+            elif isinstance(param_template, str) and operator == "equals":
                 emby_native_params[param_template] = value
                 translated = True
 
@@ -138,3 +141,330 @@ def translate_rules(rules: List[AdvancedFilterRule]) -> Tuple[Dict[str, Any], Li
             logger.info(f"高级筛选规则已成功翻译为原生参数: {rule.field} -> {emby_native_params}")
 
     return emby_native_params, post_filter_rules
+
+
+# 一个“或”组最多拆成多少个并发的原生查询；超过时退回代理端后筛选
+MAX_OR_BRANCHES = 8
+
+
+@dataclass(frozen=True)
+class FilterPlan:
+    """
+    一个高级筛选器的执行计划。
+    - native_params: 下推给 Emby 的“与”条件；
+    - post_filter: 除 native_params 之外的全部条件，在代理端求值；
+    - or_branches: 当剩余条件恰好是一个“或”组、且每个分支都能完整翻译时，每个分支的原生参数。
+      支持的处理器把每个分支作为一个并发的原生查询执行后取并集；不支持的处理器照常使用 post_filter。
+    - exclusions: 顶层否定规则 (列表字段的不等于/不包含) 的正向原生参数。
+      处理器取得正向查询的 ID 集合并从结果中排除后，只需再应用 residual_filter (其余的后筛选条件，可能为 None)。
+    """
+    native_params: Dict[str, Any]
+    post_filter_rules: Tuple[AdvancedFilterRule, ...]
+    post_filter: Optional[Callable[[List[Dict[str, Any]]], List[Dict[str, Any]]]]
+    or_branches: Tuple[Dict[str, Any], ...] = ()
+    exclusions: Tuple[Dict[str, Any], ...] = ()
+    residual_filter: Optional[Callable[[List[Dict[str, Any]]], List[Dict[str, Any]]]] = None
+
+
+# 列表字段的“不等于/不包含”没有对应的 Emby 否定参数，但它们的正向形式可以原生执行：
+# 先取满足正向条件的项目 ID，再从结果中减去
+NEGATABLE_FIELDS = ("Genres", "Tags", "Studios")
+NEGATIVE_OPERATORS = ("not_equals", "not_contains")
+
+
+def exclusion_params(rule: AdvancedFilterRule) -> Optional[Dict[str, Any]]:
+    """否定规则对应的正向原生参数；不能这样处理的规则返回 None。"""
+    if rule.field in NEGATABLE_FIELDS and rule.operator in NEGATIVE_OPERATORS and rule.value:
+        return {FIELD_MAP[rule.field]: rule.value}
+    return None
+
+
+def normalize_group(group: AdvancedFilterGroup) -> AdvancedFilterGroup:
+    """
+    规范化规则树：去掉空组，把与父组逻辑相同的子组展开到父组，
+    只剩一个子组且没有规则的组用该子组代替。
+    """
+    rules = list(group.rules)
+    groups: List[AdvancedFilterGroup] = []
+    for child in group.groups:
+        child = normalize_group(child)
+        if not child.rules and not child.groups:
+            continue
+        if child.match_all == group.match_all or len(child.rules) + len(child.groups) == 1:
+            rules.extend(child.rules)
+            groups.extend(child.groups)
+        else:
+            groups.append(child)
+    if not rules and len(groups) == 1:
+        return groups[0]
+    return AdvancedFilterGroup(match_all=group.match_all, rules=rules, groups=groups)
+
+
+def iter_rules(group):
+    """按深度优先遍历规则树 (AdvancedFilter 或 AdvancedFilterGroup) 中的全部规则。"""
+    yield from group.rules
+    for child in group.groups:
+        yield from iter_rules(child)
+
+
+def _translate_conjunction(rules: List[AdvancedFilterRule]) -> Optional[Dict[str, Any]]:
+    """把一组“与”规则完整翻译为原生参数；有规则无法翻译或两条规则落到同一个参数上时返回 None。"""
+    params: Dict[str, Any] = {}
+    for rule in rules:
+        rule_params, post_rules = translate_rules([rule])
+        if post_rules or params.keys() & rule_params.keys():
+            return None
+        params.update(rule_params)
+    return params
+
+
+def _or_branches(group: AdvancedFilterGroup) -> Optional[Tuple[Dict[str, Any], ...]]:
+    """一个规范化后的“或”组能否拆成若干个原生查询：每条规则、每个 (只含规则的“与”) 子组各为一个分支。"""
+    if len(group.rules) + len(group.groups) > MAX_OR_BRANCHES:
+        return None
+    branches = []
+    for rule in group.rules:
+        branches.append(_translate_conjunction([rule]))
+    for child in group.groups:
+        branches.append(None if child.groups else _translate_conjunction(child.rules))
+    if any(branch is None for branch in branches):
+        return None
+    return tuple(branches)
+
+
+def plan_filter(adv_filter: AdvancedFilter) -> FilterPlan:
+    """
+    按规则树生成执行计划。
+    原生参数之间在 Emby 中是“与”的关系：顶层为“与”时下推能翻译的顶层规则，其余 (含子组) 后筛选；
+    “或”组不能下推到同一个查询里 (否则会把结果缩小为满足其中一条规则的项目)，
+    但如果每个分支都能完整翻译，就作为多个并发查询的 or_branches。
+    """
+    root = normalize_group(AdvancedFilterGroup(match_all=adv_filter.match_all, rules=adv_filter.rules, groups=adv_filter.groups))
+    if len(root.rules) + len(root.groups) <= 1:
+        root = AdvancedFilterGroup(match_all=True, rules=root.rules, groups=root.groups)
+
+    exclusions: List[Dict[str, Any]] = []
+    residual_filter = None
+    if root.match_all:
+        native_params, post_rules = translate_rules(root.rules)
+        residual = AdvancedFilterGroup(match_all=True, rules=post_rules, groups=root.groups)
+        # 顶层“与”中的否定规则：记录正向参数，其余条件另外编译为 residual_filter
+        negative_rules = [rule for rule in post_rules if exclusion_params(rule)]
+        if negative_rules:
+            exclusions = [exclusion_params(rule) for rule in negative_rules]
+            rest = AdvancedFilterGroup(match_all=True, rules=[r for r in post_rules if r not in negative_rules], groups=root.groups)
+            residual_filter = compile_group_filter(rest) if rest.rules or rest.groups else None
+            logger.info(f"高级筛选器 '{adv_filter.name}' 有 {len(exclusions)} 条否定规则可通过排除正向查询的 ID 执行。")
+    else:
+        native_params = {}
+        residual = root
+        logger.info(f"高级筛选器 '{adv_filter.name}' 为“匹配任意”，不能下推到单个原生查询。")
+
+    if not residual.rules and not residual.groups:
+        return FilterPlan(native_params, (), None)
+
+    # 剩余条件是单个“或”组时，尝试拆成并发的原生查询
+    or_group = residual if not residual.match_all else (residual.groups[0] if not residual.rules and len(residual.groups) == 1 else None)
+    or_branches = _or_branches(or_group) if or_group is not None else None
+    if or_branches and any(native_params.keys() & branch.keys() for branch in or_branches):
+        or_branches = None
+    if or_branches:
+        logger.info(f"高级筛选器 '{adv_filter.name}' 的“或”条件将拆分为 {len(or_branches)} 个并发的原生查询。")
+
+    return FilterPlan(
+        native_params=native_params,
+        post_filter_rules=tuple(iter_rules(residual)),
+        post_filter=compile_group_filter(residual),
+        or_branches=or_branches or (),
+        exclusions=tuple(exclusions),
+        residual_filter=residual_filter,
+    )
+
+
+# --- 后筛选逻辑 (用于处理无法翻译的规则) ---
+# 每条规则在编译时拆成两部分：取值函数 (字段路径预先拆分) 与判定函数 (规则值预先规范化/解析)，
+# 筛选时每个项目每条规则只做一次取值和一次判定。
+
+# 超过此数量的项目列表按列求值：逐条规则筛选候选集合，而不是逐个项目求值所有规则
+COLUMNAR_THRESHOLD = 5000
+
+_DATE_RE = re.compile(r"^\d{4}-\d{2}-\d{2}")
+
+# Emby 查询参数形式的字段在项目数据中并不存在，后筛选时由以下取值函数模拟
+_VIRTUAL_FIELDS: Dict[str, Callable[[Dict[str, Any]], Any]] = {
+    "IsMovie": lambda item: item.get("Type") == "Movie",
+    "IsSeries": lambda item: item.get("Type") == "Series",
+    "IsPlayed": lambda item: bool((item.get("UserData") or {}).get("Played")),
+    "IsUnplayed": lambda item: not (item.get("UserData") or {}).get("Played"),
+    "NameStartsWith": lambda item: item.get("Name"),
+}
+
+
+def _compile_getter(field_path: str) -> Callable[[Dict[str, Any]], Any]:
+    if field_path in _VIRTUAL_FIELDS:
+        return _VIRTUAL_FIELDS[field_path]
+    keys = tuple(field_path.split('.'))
+    if len(keys) == 1:
+        key = keys[0]
+        return lambda item: item.get(key) if isinstance(item, dict) else None
+
+    def get_nested(item: Dict[str, Any]) -> Any:
+        value = item
+        for key in keys:
+            if isinstance(value, dict): value = value.get(key)
+            else: return None
+        return value
+    return get_nested
+
+
+def _relative_date(rule: AdvancedFilterRule) -> str:
+    return (datetime.utcnow() - timedelta(days=rule.relative_days)).strftime('%Y-%m-%d')
+
+
+def _compile_test(rule: AdvancedFilterRule) -> Callable[[Any], bool]:
+    """把一条规则编译为 test(item_value) -> bool，语义与原先逐项比较的实现一致。"""
+    operator = rule.operator
+    rule_value = rule.value
+    if rule.relative_days and rule.field in ("PremiereDate", "DateCreated"):
+        operator, rule_value = "greater_than", _relative_date(rule)
+
+    if operator == "is_empty":
+        return lambda v: v is None or v == '' or v == []
+    if operator == "is_not_empty":
+        return lambda v: v is not None and v != '' and v != []
+
+    if operator in ("greater_than", "less_than"):
+        greater = operator == "greater_than"
+        try:
+            threshold = float(rule_value)
+        except (TypeError, ValueError):
+            threshold = None
+        if threshold is None and rule_value and _DATE_RE.match(rule_value):
+            # 日期阈值：项目中的日期是 ISO 8601 字符串，直接比较日期部分
+            day = rule_value[:10]
+            def test_date(v):
+                if not isinstance(v, str) or not _DATE_RE.match(v): return False
+                return v[:10] > day if greater else v[:10] < day
+            return test_date
+        if threshold is None:
+            return lambda v: False
+        def test_number(v):
+            if v is None or isinstance(v, list): return False
+            try:
+                number = float(v)
+            except (TypeError, ValueError):
+                return False
+            return number > threshold if greater else number < threshold
+        return test_number
+
+    if rule_value is None:
+        return lambda v: False
+    raw = rule_value
+    needle = str(rule_value).lower()
+    if rule.field == "NameStartsWith":
+        return lambda v: isinstance(v, str) and v.lower().startswith(needle)
+    if rule.field in NEGATABLE_FIELDS:
+        return _compile_list_test(operator, needle)
+    if operator == "equals":
+        return lambda v: v is not None and not isinstance(v, list) and str(v).lower() == needle
+    if operator == "not_equals":
+        return lambda v: v is not None and not isinstance(v, list) and str(v).lower() != needle
+    if operator == "contains":
+        return lambda v: v is not None and (raw in v if isinstance(v, list) else needle in str(v).lower())
+    if operator == "not_contains":
+        return lambda v: v is not None and (raw not in v if isinstance(v, list) else needle not in str(v).lower())
+    return lambda v: False
+
+
+def _compile_list_test(operator: str, needle: str) -> Callable[[Any], bool]:
+    """
+    Genres/Tags/Studios 是名称列表 (Studios 的元素是 {"Name", "Id"})，按元素整体比较，不区分大小写，与 Emby 原生参数一致。
+    否定运算符表示“没有任何元素匹配”(没有该字段的项目也满足)，与按 ID 排除正向查询结果的执行路径一致。
+    """
+    def has(v) -> bool:
+        if not isinstance(v, list):
+            return v is not None and str(v).lower() == needle
+        for element in v:
+            name = element.get("Name") if isinstance(element, dict) else element
+            if name is not None and str(name).lower() == needle:
+                return True
+        return False
+    if operator in ("equals", "contains"):
+        return has
+    if operator in NEGATIVE_OPERATORS:
+        return lambda v: not has(v)
+    return lambda v: False
+
+
+def compile_rule(rule: AdvancedFilterRule) -> Callable[[Dict[str, Any]], bool]:
+    """把单条规则编译为 predicate(item) -> bool。"""
+    get, test = _compile_getter(rule.field), _compile_test(rule)
+    return lambda item: test(get(item))
+
+
+def compile_post_filter(post_filter_rules: List[AdvancedFilterRule], match_all: bool = True) -> Callable[[List[Dict[str, Any]]], List[Dict[str, Any]]]:
+    """
+    将后筛选规则编译为一个可重复调用的筛选函数：filter(items) -> items。
+    match_all 为 False 时，项目满足任意一条规则即保留。
+    """
+    rules = list(post_filter_rules)
+    compiled = [(_compile_getter(rule.field), _compile_test(rule)) for rule in rules]
+    combine = all if match_all else any
+
+    def row_wise(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        if len(compiled) == 1:
+            get, test = compiled[0]
+            return [item for item in items if test(get(item))]
+        return [item for item in items if combine(test(get(item)) for get, test in compiled)]
+
+    def column_wise(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        if match_all:
+            # 与：每条规则只在仍然满足之前所有规则的候选项上求值
+            candidates = items
+            for get, test in compiled:
+                candidates = [item for item in candidates if test(get(item))]
+                if not candidates: break
+            return candidates
+        # 或：每条规则只在尚未命中的项目上求值，最后按原顺序输出
+        matched = [False] * len(items)
+        remaining = range(len(items))
+        for get, test in compiled:
+            still_remaining = []
+            for i in remaining:
+                if test(get(items[i])): matched[i] = True
+                else: still_remaining.append(i)
+            remaining = still_remaining
+            if not remaining: break
+        return [item for item, hit in zip(items, matched) if hit]
+
+    def apply(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        if not compiled: return items
+        logger.debug("在 %d 个项目上应用 %d 条后筛选规则 (%s)。", len(items), len(compiled), "全部满足" if match_all else "任意满足")
+        with span("post_filter"):
+            if len(items) >= COLUMNAR_THRESHOLD and len(compiled) > 1:
+                return column_wise(items)
+            return row_wise(items)
+
+    return apply
+
+
+def _compile_group_predicate(group: AdvancedFilterGroup) -> Callable[[Dict[str, Any]], bool]:
+    predicates = [compile_rule(rule) for rule in group.rules] + [_compile_group_predicate(child) for child in group.groups]
+    combine = all if group.match_all else any
+    if len(predicates) == 1:
+        return predicates[0]
+    return lambda item: combine(predicate(item) for predicate in predicates)
+
+
+def compile_group_filter(group: AdvancedFilterGroup) -> Callable[[List[Dict[str, Any]]], List[Dict[str, Any]]]:
+    """将规则树编译为筛选函数。没有子组时等同于 compile_post_filter (包括按列求值)。"""
+    if not group.groups:
+        return compile_post_filter(group.rules, match_all=group.match_all)
+    predicate = _compile_group_predicate(group)
+
+    def apply(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        logger.debug("在 %d 个项目上应用规则树后筛选。", len(items))
+        with span("post_filter"):
+            return [item for item in items if predicate(item)]
+
+    return apply
@@ -1,13 +1,28 @@
 # src/proxy_handlers/_find_helper.py (终极加固版)
 
-import json
+import json_codec
 import logging
-from typing import List, Dict
+from typing import List, Dict, Optional
 from aiohttp import ClientSession
 import config_manager
+from provider_index import provider_index
+from proxy_cache import merge_eligibility
+from models import AppConfig, VirtualLibrary
 
 logger = logging.getLogger(__name__)
 
+# is_item_in_a_merge_enabled_vlib 能够识别的资源类型；其他类型的虚拟库 (如 all) 不参与判断
+MEMBERSHIP_RESOURCE_TYPES = ("collection", "tag", "genre", "studio", "person")
+
+
+def remember_merge_members(vlib: VirtualLibrary, items: List[Dict], config: AppConfig):
+    """合并虚拟库返回的一页项目必然属于该虚拟库：预先写入合并资格缓存，点开季/集时不必再查询项目详情。"""
+    if not vlib.merge_by_tmdb_id or vlib.resource_type not in MEMBERSHIP_RESOURCE_TYPES:
+        return
+    for item in items:
+        if isinstance(item, dict) and item.get("Type") == "Series" and item.get("Id"):
+            merge_eligibility.set(str(item["Id"]), True, config.merge_eligibility_ttl)
+
 async def is_item_in_a_merge_enabled_vlib(
     session: ClientSession, real_emby_url: str, user_id: str, item_id: str, headers: Dict, auth_token_param: Dict
 ) -> bool:
@@ -16,19 +31,24 @@ async def is_item_in_a_merge_enabled_vlib(
     这是决定是否合并其子项目（季/集）的关键。
     此版本为终极加固版，强制进行字符串比较，以避免任何类型不匹配问题，并依赖DEBUG日志进行诊断。
     """
-    config = config_manager.load_config()
+    config = config_manager.get_config()
 
     # 检查全局强制合并开关
     if config.force_merge_by_tmdb_id:
-        logger.info(f"MERGE_CHECK: ✅ 全局开关已启用。允许对项目 {item_id} 进行合并。")
+        logger.debug("MERGE_CHECK: ✅ 全局开关已启用。允许对项目 %s 进行合并。", item_id)
         return True
 
     merge_vlibs = [vlib for vlib in config.virtual_libraries if vlib.merge_by_tmdb_id]
 
     if not merge_vlibs:
-        logger.debug(f"MERGE_CHECK: 没有任何虚拟库启用合并功能。跳过对项目 {item_id} 的合并检查。")
+        logger.debug("MERGE_CHECK: 没有任何虚拟库启用合并功能。跳过对项目 %s 的合并检查。", item_id)
         return False
 
+    cached = merge_eligibility.get(str(item_id))
+    if cached is not None:
+        logger.debug("MERGE_CHECK: 命中缓存，项目 %s 的合并资格为 %s。", item_id, cached)
+        return cached
+
     item_details_url = f"{real_emby_url}/emby/Users/{user_id}/Items/{item_id}"
     item_params = {
         'Fields': 'CollectionIds,TagItems,GenreItems,Studios,People,ProviderIds',
@@ -42,9 +62,11 @@ async def is_item_in_a_merge_enabled_vlib(
                 logger.warning(f"MERGE_CHECK: 无法获取项目 {item_id} 的详情。状态码: {resp.status}, 响应: {await resp.text()}")
                 return False
             
-            item = await resp.json()
+            item = await json_codec.read_json(resp)
             # 【【【 这是本次最关键的日志，请务必在 DEBUG 模式下查看 】】】
-            logger.debug(f"MERGE_CHECK: 已获取项目 {item_id} ('{item.get('Name')}') 的详情用于匹配。收到的数据: \n{json.dumps(item, indent=2, ensure_ascii=False)}")
+            # 序列化整个项目的代价不小，只在 debug 级别真正开启时才做
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("MERGE_CHECK: 已获取项目 %s ('%s') 的详情用于匹配。收到的数据: \n%s", item_id, item.get('Name'), json_codec.dumps_str(item, pretty=True))
 
     except Exception as e:
         logger.error(f"MERGE_CHECK: 获取项目 {item_id} 详情时发生严重错误: {e}")
@@ -95,16 +117,33 @@ async def is_item_in_a_merge_enabled_vlib(
             continue
         
         if match_found:
-            logger.info(f"MERGE_CHECK: ✅ 成功! 项目 {item_id} ('{item.get('Name')}') 确认位于已启用合并的虚拟库 '{vlib.name}' (类型: {resource_type}) 中。允许合并。")
+            logger.debug("MERGE_CHECK: ✅ 成功! 项目 %s ('%s') 确认位于已启用合并的虚拟库 '%s' (类型: %s) 中。允许合并。", item_id, item.get('Name'), vlib.name, resource_type)
+            merge_eligibility.set(str(item_id), True, config.merge_eligibility_ttl)
             return True
 
-    logger.info(f"MERGE_CHECK: ❌ 拒绝。项目 {item_id} ('{item.get('Name')}') 未在 {len(merge_vlibs)} 个已启用合并的虚拟库中找到。")
+    logger.debug("MERGE_CHECK: ❌ 拒绝。项目 %s ('%s') 未在 %d 个已启用合并的虚拟库中找到。", item_id, item.get('Name'), len(merge_vlibs))
+    merge_eligibility.set(str(item_id), False, config.merge_eligibility_negative_ttl)
     return False
 
 
 async def find_all_series_by_tmdb_id(
-    session: ClientSession, real_emby_url: str, user_id: str, tmdb_id: str, headers: Dict, auth_token_param: Dict
+    session: ClientSession, real_emby_url: str, user_id: str, tmdb_id: str, headers: Dict, auth_token_param: Dict,
+    expected_id: Optional[str] = None
 ) -> List[str]:
+    """
+    查找所有 TMDB ID 相同的剧集。配置了 emby_api_key 时优先查本地的外部 ID 索引；
+    expected_id 为发起请求的剧集本身，它不在结果中时索引会先补充刷新一次。
+    索引覆盖整个服务器，没有 API Key 时无法建立，使用当前用户的权限直接查询 Emby。
+    """
+    config = config_manager.get_config()
+    if config.provider_index_enabled and config.emby_api_key:
+        found = await provider_index.lookup_fresh(
+            session, config, "Tmdb", str(tmdb_id), item_type="Series", expected_id=expected_id
+        )
+        if found is not None:
+            logger.debug("外部 ID 索引: TMDB ID %s 对应 %d 个剧集", tmdb_id, len(found))
+            return found
+
     search_url = f"{real_emby_url}/emby/Items"
     search_params = {
         'Recursive': 'true',
@@ -114,11 +153,11 @@ async def find_all_series_by_tmdb_id(
         'UserId': user_id,
         **auth_token_param
     }
-    logger.debug(f"正在执行全局剧集遍历搜索 (TMDB ID: {tmdb_id})")
+    logger.debug("正在执行全局剧集遍历搜索 (TMDB ID: %s)", tmdb_id)
     try:
         async with session.get(search_url, params=search_params, headers=headers, timeout=120) as resp:
             if resp.status == 200:
-                data = await resp.json()
+                data = await json_codec.read_json(resp)
                 all_series = data.get("Items", [])
                 found_ids = [
                     item.get("Id") for item in all_series 
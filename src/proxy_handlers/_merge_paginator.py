@@ -0,0 +1,196 @@
+# src/proxy_handlers/_merge_paginator.py
+
+import asyncio
+import bisect
+import hashlib
+import logging
+import math
+import time
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+from aiohttp import ClientSession
+
+import request_timing
+from models import AppConfig
+from proxy_cache import query_cursors
+from ._page_fetcher import fetch_page, page_sizes
+
+logger = logging.getLogger(__name__)
+
+
+def merge_key(item: Any) -> Optional[str]:
+    """与 handler_merger.merge_items_by_tmdb 相同的规则：只有带 TMDB ID 的电影/剧集参与合并。"""
+    if not isinstance(item, dict) or item.get("Type") not in ("Movie", "Series"):
+        return None
+    return (item.get("ProviderIds") or {}).get("Tmdb") or None
+
+
+class MergeCursor:
+    """
+    一个查询 (虚拟库 + 用户 + 排序/筛选参数) 的增量去重状态。
+
+    - checkpoints: 升序的 (去重后偏移, 上游偏移) 对，记录在每个上游页的边界上；
+      翻到第 N 页时从不超过 StartIndex 的最近检查点继续，而不是从头获取；
+    - first_seen: TMDB ID -> 它第一次出现时的去重后偏移。
+      从某个检查点继续时，first_seen 小于当前偏移的 TMDB ID 即为重复项，因此不需要保存项目本身。
+    """
+
+    def __init__(self, query_key: str, library_id: str):
+        self.query_key = query_key
+        self.library_id = library_id
+        self.checkpoints: List[Tuple[int, int]] = [(0, 0)]
+        self.first_seen: Dict[str, int] = {}
+        self.upstream_total: Optional[int] = None
+        self.exhausted = False
+        self.lock = asyncio.Lock()
+        self.total_task: Optional[asyncio.Task] = None
+
+    @property
+    def frontier(self) -> Tuple[int, int]:
+        return self.checkpoints[-1]
+
+    def checkpoint_before(self, unique_offset: int) -> Tuple[int, int]:
+        index = bisect.bisect_right(self.checkpoints, (unique_offset, math.inf)) - 1
+        return self.checkpoints[max(index, 0)]
+
+    def dedup_ratio(self) -> float:
+        unique, upstream = self.frontier
+        return unique / upstream if upstream else 1.0
+
+    def total(self) -> Tuple[int, bool]:
+        """返回 (TotalRecordCount, 是否精确)。未走到末尾时按已观察到的去重比例估算。"""
+        unique, upstream = self.frontier
+        if self.exhausted or not self.upstream_total:
+            return unique, self.exhausted
+        estimate = round(self.upstream_total * self.dedup_ratio())
+        return max(estimate, unique), False
+
+
+class MergeWalker:
+    """在一个 MergeCursor 上按顺序拉取上游页并去重。调用方须持有 cursor.lock。"""
+
+    def __init__(self, cursor: MergeCursor, session: ClientSession, method: str, url: str,
+                 params: Mapping[str, str], headers: Mapping[str, str], config: AppConfig):
+        self.cursor = cursor
+        self.session = session
+        self.method = method
+        self.url = url
+        self.params = params
+        self.headers = headers
+        self.config = config
+        self.sizes = page_sizes(config)
+
+    async def _fetch_window(self, upstream_offset: int, pages_wanted: int) -> Tuple[List[List[Dict]], int]:
+        page_size = self.sizes.get(self.cursor.library_id)
+        offsets = [upstream_offset + i * page_size for i in range(max(1, pages_wanted))]
+        if self.cursor.upstream_total is not None:
+            offsets = [o for o in offsets if o < self.cursor.upstream_total] or offsets[:1]
+        started = time.perf_counter()
+        pages = await asyncio.gather(*(
+            fetch_page(self.session, self.method, self.url, self.params, self.headers, offset, page_size, self.config.merge_crawl_retries)
+            for offset in offsets
+        ))
+        self.sizes.observe(self.cursor.library_id, page_size, time.perf_counter() - started)
+        total = pages[0].get("TotalRecordCount")
+        if isinstance(total, int):
+            self.cursor.upstream_total = total
+        return [page.get("Items") or [] for page in pages], page_size
+
+    async def walk(self, start: int, end: Optional[int]) -> List[Dict[str, Any]]:
+        """
+        返回去重后偏移在 [start, end) 内的项目；end 为 None 时一直走到末尾 (用于计算精确总数)。
+        每处理完一个上游页，如果超出了已知的最远位置，就记录一个新检查点。
+        """
+        cursor = self.cursor
+        unique, upstream = cursor.checkpoint_before(start)
+        collected: List[Dict[str, Any]] = []
+        while end is None or unique < end:
+            if cursor.exhausted and upstream >= cursor.frontier[1]:
+                break
+            if end is None:
+                pages_wanted = self.config.merge_crawl_concurrency
+            else:
+                # 按已观察到的去重比例估算还需要多少上游项目，据此决定这一轮并发拉取几页
+                needed = (end - unique) / max(cursor.dedup_ratio(), 0.05)
+                pages_wanted = min(self.config.merge_crawl_concurrency, math.ceil(needed / self.sizes.get(cursor.library_id)))
+            pages, page_size = await self._fetch_window(upstream, pages_wanted)
+
+            for page in pages:
+                for item in page:
+                    key = merge_key(item)
+                    if key is not None:
+                        seen_at = cursor.first_seen.get(key)
+                        if seen_at is not None and seen_at < unique:
+                            upstream += 1
+                            continue
+                        cursor.first_seen[key] = unique
+                    if unique >= start and (end is None or unique < end):
+                        collected.append(item)
+                    unique += 1
+                    upstream += 1
+                if upstream > cursor.frontier[1]:
+                    cursor.checkpoints.append((unique, upstream))
+                if len(page) < page_size:
+                    cursor.exhausted = True
+                    break
+                if end is not None and unique >= end:
+                    break
+        return collected
+
+
+def query_key(kind: str, library_id: str, user_id: str, params: Mapping[str, str]) -> str:
+    """游标的键：游标类型 + 虚拟库 + 用户 + 除分页以外的全部上游参数。"""
+    stable = sorted((k, str(v)) for k, v in params.items() if k not in ("StartIndex", "Limit"))
+    digest = hashlib.blake2b(repr((library_id, user_id, stable)).encode("utf-8"), digest_size=16).hexdigest()
+    return f"{kind}:{digest}"
+
+
+def _get_cursor(key: str, library_id: str, config: AppConfig) -> MergeCursor:
+    cursor = query_cursors.get(key)
+    if cursor is None:
+        cursor = MergeCursor(key, library_id)
+    # 每次使用都续期，持续翻页的查询不会在中途失去检查点
+    query_cursors.set(key, cursor, config.query_cursor_ttl, library_id=library_id)
+    return cursor
+
+
+async def _complete_total(walker: MergeWalker):
+    """后台把游标走到末尾，得到精确的 TotalRecordCount；每一轮之间释放锁，不阻塞前台翻页。"""
+    request_timing.detach_trace()
+    cursor = walker.cursor
+    try:
+        while not cursor.exhausted:
+            async with cursor.lock:
+                if cursor.exhausted:
+                    break
+                unique, _ = cursor.frontier
+                # 从最远检查点开始走一轮 (最多 merge_crawl_concurrency 页)
+                await walker.walk(unique, unique + walker.sizes.get(cursor.library_id) * walker.config.merge_crawl_concurrency)
+        logger.debug("合并分页: 查询 %s 的精确总数为 %d", cursor.query_key, cursor.frontier[0])
+    except Exception as e:
+        logger.warning(f"合并分页: 后台计算总数失败: {e}")
+    finally:
+        cursor.total_task = None
+
+
+async def paginate_merged(
+    session: ClientSession, method: str, url: str, params: Mapping[str, str], headers: Mapping[str, str],
+    config: AppConfig, library_id: str, user_id: str, start_index: int, limit: int
+) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    返回合并去重后的一页项目与 TotalRecordCount。
+    只拉取到满足 StartIndex+Limit 为止；总数在走到末尾之前是估算值，同时在后台计算精确值。
+    """
+    key = query_key("merge", library_id, user_id, params)
+    cursor = _get_cursor(key, library_id, config)
+    walker = MergeWalker(cursor, session, method, url, params, headers, config)
+
+    async with cursor.lock:
+        items = await walker.walk(start_index, start_index + limit)
+    total, exact = cursor.total()
+    logger.debug("合并分页: StartIndex=%d, 返回 %d 项, 总数=%d (%s), 检查点 %d 个",
+                 start_index, len(items), total, "精确" if exact else "估算", len(cursor.checkpoints))
+
+    if not exact and config.merge_background_total and cursor.total_task is None:
+        cursor.total_task = asyncio.create_task(_complete_total(walker))
+    return items, total
@@ -0,0 +1,103 @@
+# src/proxy_handlers/_or_union.py
+
+import asyncio
+import logging
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple
+
+from aiohttp import ClientSession
+
+from models import AppConfig
+from ._page_fetcher import fetch_page
+
+logger = logging.getLogger(__name__)
+
+# Emby 的 SortBy 名称 -> 项目中对应值的取法，以及需要额外请求的 Fields。
+# 不在表中的排序 (如 Random) 无法在代理端重现，并集保持各分支的原始顺序
+_SORT_KEYS: Dict[str, Tuple[Callable[[Dict[str, Any]], Any], Optional[str]]] = {
+    "SortName": (lambda item: item.get("SortName") or item.get("Name"), "SortName"),
+    "Name": (lambda item: item.get("Name"), None),
+    "DateCreated": (lambda item: item.get("DateCreated"), "DateCreated"),
+    "PremiereDate": (lambda item: item.get("PremiereDate"), "PremiereDate"),
+    "ProductionYear": (lambda item: item.get("ProductionYear"), None),
+    "CommunityRating": (lambda item: item.get("CommunityRating"), None),
+    "CriticRating": (lambda item: item.get("CriticRating"), "CriticRating"),
+    "OfficialRating": (lambda item: item.get("OfficialRating"), "OfficialRating"),
+    "Runtime": (lambda item: item.get("RunTimeTicks"), None),
+    "DatePlayed": (lambda item: (item.get("UserData") or {}).get("LastPlayedDate"), None),
+    "PlayCount": (lambda item: (item.get("UserData") or {}).get("PlayCount"), None),
+}
+
+
+def sort_fields(params: Mapping[str, str]) -> Tuple[str, ...]:
+    """重排并集所需、但 Emby 默认不返回的字段。"""
+    fields = []
+    for name in (params.get("SortBy") or "").split(","):
+        entry = _SORT_KEYS.get(name.strip())
+        if entry and entry[1]:
+            fields.append(entry[1])
+    return tuple(fields)
+
+
+def _sort_union(items: List[Dict[str, Any]], params: Mapping[str, str]) -> List[Dict[str, Any]]:
+    names = [name.strip() for name in (params.get("SortBy") or "").split(",") if name.strip()]
+    orders = [order.strip() for order in (params.get("SortOrder") or "").split(",")]
+    if not names or any(name not in _SORT_KEYS for name in names):
+        return items
+    # Python 的排序是稳定的：从最后一个排序键开始依次排序，等价于多键排序。空值排在最前 (与 Emby 升序一致)
+    for index in range(len(names) - 1, -1, -1):
+        getter = _SORT_KEYS[names[index]][0]
+        order = orders[index] if index < len(orders) and orders[index] else (orders[0] or "Ascending")
+        keyed = [(getter(item), item) for item in items]
+        present = [pair for pair in keyed if pair[0] is not None]
+        missing = [item for value, item in keyed if value is None]
+        try:
+            present.sort(key=lambda pair: pair[0], reverse=order == "Descending")
+        except TypeError:
+            # 同一字段出现了不可比较的类型，放弃重排
+            return items
+        ordered = [item for _, item in present]
+        items = ordered + missing if order == "Descending" else missing + ordered
+    return items
+
+
+async def fetch_or_union(
+    session: ClientSession, method: str, url: str, params: Mapping[str, str], headers: Mapping[str, str],
+    config: AppConfig, branches: Tuple[Dict[str, Any], ...], start_index: int, limit: int
+) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    把“或”筛选器作为多个原生查询并发执行，返回并集中的一页与 TotalRecordCount。
+    每个分支都取前 StartIndex+Limit 项：并集的前 N 项一定落在各分支的前 N 项之内。
+    """
+    end = start_index + limit
+    pages = await asyncio.gather(*(
+        fetch_page(session, method, url, {**params, **branch}, headers, 0, end, config.merge_crawl_retries)
+        for branch in branches
+    ))
+
+    seen = set()
+    union: List[Dict[str, Any]] = []
+    fetched = 0
+    complete = True
+    branch_totals = 0
+    for page in pages:
+        items = page.get("Items") or []
+        fetched += len(items)
+        total = page.get("TotalRecordCount")
+        branch_totals += total if isinstance(total, int) else len(items)
+        if len(items) >= end and not (isinstance(total, int) and total <= len(items)):
+            complete = False
+        for item in items:
+            item_id = item.get("Id")
+            if item_id is None or item_id not in seen:
+                seen.add(item_id)
+                union.append(item)
+
+    union = _sort_union(union, params)
+    if complete:
+        total_record_count = len(union)
+    else:
+        # 有分支没取完：按已取部分的去重比例估算并集大小
+        total_record_count = max(round(branch_totals * len(union) / fetched) if fetched else 0, len(union))
+    logger.debug("“或”并集: %d 个分支共取 %d 项, 去重后 %d 项, 总数=%d (%s)",
+                 len(branches), fetched, len(union), total_record_count, "精确" if complete else "估算")
+    return union[start_index:end], total_record_count
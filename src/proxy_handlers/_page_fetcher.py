@@ -0,0 +1,134 @@
+# src/proxy_handlers/_page_fetcher.py
+
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List, Mapping, Optional
+
+import aiohttp
+from aiohttp import ClientSession
+
+import json_codec
+from models import AppConfig
+
+logger = logging.getLogger(__name__)
+
+# 自适应页大小的上下限，以及单页的目标耗时 (秒)
+MIN_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 2000
+TARGET_PAGE_SECONDS = 0.5
+
+# 每次重试前的等待时间 (秒)，按重试次数翻倍
+RETRY_BACKOFF = 0.2
+
+
+class PageFetchError(Exception):
+    """某一页在重试后仍然失败。"""
+
+
+class AdaptivePageSize:
+    """
+    按查询 (通常是虚拟库 ID) 记住合适的页大小：
+    单页耗时明显低于目标时放大，高于目标时缩小，使每页耗时接近 TARGET_PAGE_SECONDS。
+    """
+
+    def __init__(self, initial: int):
+        self.initial = initial
+        self._sizes: Dict[str, int] = {}
+
+    def get(self, key: str) -> int:
+        return self._sizes.get(key, self.initial)
+
+    def observe(self, key: str, page_size: int, seconds: float) -> int:
+        # 限制单次调整幅度，避免一次异常的慢/快响应让页大小剧烈波动
+        ratio = min(2.0, max(0.5, TARGET_PAGE_SECONDS / max(seconds, 1e-3)))
+        size = int(min(MAX_PAGE_SIZE, max(MIN_PAGE_SIZE, page_size * ratio)))
+        self._sizes[key] = size
+        return size
+
+
+_page_sizes: Optional[AdaptivePageSize] = None
+
+
+def page_sizes(config: AppConfig) -> AdaptivePageSize:
+    global _page_sizes
+    if _page_sizes is None or _page_sizes.initial != config.merge_crawl_page_size:
+        _page_sizes = AdaptivePageSize(config.merge_crawl_page_size)
+    return _page_sizes
+
+
+async def fetch_page(
+    session: ClientSession, method: str, url: str, params: Mapping[str, str], headers: Mapping[str, str],
+    start_index: int, limit: int, retries: int
+) -> Dict[str, Any]:
+    """获取一页 (StartIndex/Limit)，5xx 与网络错误按指数退避重试。"""
+    page_params = {**params, "StartIndex": str(start_index), "Limit": str(limit)}
+    for attempt in range(retries + 1):
+        try:
+            async with session.request(method, url, params=page_params, headers=headers) as resp:
+                if resp.status == 200:
+                    return await json_codec.read_json(resp)
+                if resp.status < 500:
+                    raise PageFetchError(f"StartIndex={start_index} 返回状态码 {resp.status}")
+                error = f"状态码 {resp.status}"
+        except (aiohttp.ClientError, asyncio.TimeoutError, json_codec.JSONDecodeError) as e:
+            error = repr(e)
+        if attempt < retries:
+            logger.debug("获取批次 StartIndex=%d 失败 (%s)，第 %d 次重试", start_index, error, attempt + 1)
+            await asyncio.sleep(RETRY_BACKOFF * (2 ** attempt))
+    raise PageFetchError(f"StartIndex={start_index} 在 {retries} 次重试后仍然失败: {error}")
+
+
+async def fetch_all_items(
+    session: ClientSession, method: str, url: str, params: Mapping[str, str], headers: Mapping[str, str],
+    config: AppConfig, key: str
+) -> List[Dict[str, Any]]:
+    """
+    获取查询的全部项目。
+    第一页顺序获取，从中读取 TotalRecordCount 并测量耗时来决定其余页的大小；
+    其余页在 merge_crawl_concurrency 的并发限制内同时获取，最后按原顺序拼接。
+    """
+    sizes = page_sizes(config)
+    retries = config.merge_crawl_retries
+    first_size = sizes.get(key)
+
+    started = time.perf_counter()
+    first = await fetch_page(session, method, url, params, headers, 0, first_size, retries)
+    items: List[Dict[str, Any]] = first.get("Items") or []
+    total = first.get("TotalRecordCount")
+    page_size = sizes.observe(key, first_size, time.perf_counter() - started)
+
+    if len(items) < first_size:
+        return items
+    if not isinstance(total, int):
+        # 上游没有给出总数：退回逐页获取，直到某一页不满
+        start = len(items)
+        while True:
+            page = (await fetch_page(session, method, url, params, headers, start, page_size, retries)).get("Items") or []
+            items.extend(page)
+            start += len(page)
+            if len(page) < page_size:
+                return items
+
+    offsets = range(len(items), total, page_size)
+    logger.debug("并发获取剩余 %d 页: 总数=%d, 页大小=%d, 并发=%d", len(offsets), total, page_size, config.merge_crawl_concurrency)
+    semaphore = asyncio.Semaphore(max(1, config.merge_crawl_concurrency))
+
+    async def fetch(start: int):
+        async with semaphore:
+            page_started = time.perf_counter()
+            page = await fetch_page(session, method, url, params, headers, start, page_size, retries)
+            sizes.observe(key, page_size, time.perf_counter() - page_started)
+            return page.get("Items") or []
+
+    tasks = [asyncio.ensure_future(fetch(start)) for start in offsets]
+    try:
+        pages = await asyncio.gather(*tasks)
+    except BaseException:
+        # 有一页最终失败时，取消其余仍在进行的请求
+        for task in tasks:
+            task.cancel()
+        raise
+    for page in pages:
+        items.extend(page)
+    return items
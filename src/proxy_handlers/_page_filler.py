@@ -0,0 +1,182 @@
+# src/proxy_handlers/_page_filler.py
+
+import asyncio
+import bisect
+import logging
+import math
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple
+
+from aiohttp import ClientSession
+
+from models import AppConfig
+from proxy_cache import query_cursors
+from ._page_fetcher import MAX_PAGE_SIZE, fetch_page
+from ._merge_paginator import query_key
+
+logger = logging.getLogger(__name__)
+
+# 选择率 EWMA 的平滑系数，以及没有观测数据时的初始值
+SELECTIVITY_ALPHA = 0.3
+DEFAULT_SELECTIVITY = 0.5
+# 估算过取量时选择率的下限，避免极端选择率导致一次请求过大的批次
+MIN_SELECTIVITY = 0.02
+
+
+class FilterStats:
+    """
+    一个高级筛选器的运行统计：
+    - 后筛选的选择率 (匹配数 / 扫描数) 的 EWMA、累计计数与耗时；
+    - 使用该筛选器的虚拟库请求的端到端耗时 (EWMA 与累计) 及实际走过的执行路径。
+    """
+    __slots__ = ("selectivity", "scanned", "matched", "batches", "filter_seconds",
+                 "requests", "request_seconds", "recent_request_seconds", "paths")
+
+    def __init__(self):
+        self.selectivity: Optional[float] = None
+        self.scanned = 0
+        self.matched = 0
+        self.batches = 0
+        self.filter_seconds = 0.0
+        self.requests = 0
+        self.request_seconds = 0.0
+        self.recent_request_seconds: Optional[float] = None
+        self.paths: Counter = Counter()
+
+    def observe(self, scanned: int, matched: int, seconds: float):
+        if scanned <= 0:
+            return
+        ratio = matched / scanned
+        self.selectivity = ratio if self.selectivity is None else SELECTIVITY_ALPHA * ratio + (1 - SELECTIVITY_ALPHA) * self.selectivity
+        self.scanned += scanned
+        self.matched += matched
+        self.batches += 1
+        self.filter_seconds += seconds
+
+    def observe_request(self, path: str, seconds: float):
+        self.requests += 1
+        self.request_seconds += seconds
+        self.recent_request_seconds = seconds if self.recent_request_seconds is None else \
+            SELECTIVITY_ALPHA * seconds + (1 - SELECTIVITY_ALPHA) * self.recent_request_seconds
+        self.paths[path] += 1
+
+    def estimate(self) -> float:
+        return self.selectivity if self.selectivity is not None else DEFAULT_SELECTIVITY
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "selectivity": round(self.selectivity, 4) if self.selectivity is not None else None,
+            "scanned": self.scanned,
+            "matched": self.matched,
+            "batches": self.batches,
+            "avg_filter_ms_per_1k": round(self.filter_seconds / self.scanned * 1_000_000, 3) if self.scanned else None,
+            "requests": self.requests,
+            "avg_request_ms": round(self.request_seconds / self.requests * 1000, 1) if self.requests else None,
+            "recent_request_ms": round(self.recent_request_seconds * 1000, 1) if self.recent_request_seconds is not None else None,
+            "paths": dict(self.paths),
+        }
+
+
+_filter_stats: Dict[str, FilterStats] = {}
+
+
+def filter_stats(filter_id: str) -> FilterStats:
+    stats = _filter_stats.get(filter_id)
+    if stats is None:
+        stats = _filter_stats[filter_id] = FilterStats()
+    return stats
+
+
+def all_filter_stats() -> Dict[str, Dict[str, Any]]:
+    return {filter_id: stats.to_dict() for filter_id, stats in _filter_stats.items()}
+
+
+class FilterCursor:
+    """
+    一个查询的后筛选检查点：升序的 (筛选后偏移, 上游偏移) 对，记录在每个上游批次的边界上。
+    深分页从不超过 StartIndex 的最近检查点继续扫描。
+    """
+
+    def __init__(self):
+        self.checkpoints: List[Tuple[int, int]] = [(0, 0)]
+        self.upstream_total: Optional[int] = None
+        self.exhausted = False
+        self.lock = asyncio.Lock()
+
+    @property
+    def frontier(self) -> Tuple[int, int]:
+        return self.checkpoints[-1]
+
+    def checkpoint_before(self, filtered_offset: int) -> Tuple[int, int]:
+        index = bisect.bisect_right(self.checkpoints, (filtered_offset, math.inf)) - 1
+        return self.checkpoints[max(index, 0)]
+
+    def total(self, selectivity: float) -> Tuple[int, bool]:
+        """
+        返回 (TotalRecordCount, 是否精确)。未扫描到末尾时按选择率估算剩余部分：
+        优先使用本查询已扫描部分的实际比例，还没有扫描数据时使用筛选器的 EWMA 选择率。
+        """
+        filtered, upstream = self.frontier
+        if self.exhausted or self.upstream_total is None:
+            return filtered, self.exhausted
+        if upstream:
+            selectivity = filtered / upstream
+        return filtered + round(max(self.upstream_total - upstream, 0) * selectivity), False
+
+
+async def fill_filtered_page(
+    session: ClientSession, method: str, url: str, params: Mapping[str, str], headers: Mapping[str, str],
+    config: AppConfig, library_id: str, filter_id: str, post_filter: Callable[[List[Dict[str, Any]]], List[Dict[str, Any]]],
+    user_id: str, start_index: int, limit: int, generation: Optional[str] = None
+) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    返回后筛选之后的一页 (最多 limit 项) 与 TotalRecordCount。
+    按筛选器的选择率决定每批向上游多取多少项，持续获取直到凑满一页、扫描到末尾，
+    或本次扫描量达到 post_filter_max_scan (此时返回不满的一页，下一次请求从检查点继续)。
+    post_filter 依赖于 params 以外的状态 (如代理端减去的 ID 集合) 时，generation 传入该状态的指纹，
+    状态变化后使用新的检查点。
+    """
+    key = query_key("filter", library_id, user_id, {**params, "_generation": generation} if generation else params)
+    cursor = query_cursors.get(key)
+    if cursor is None:
+        # 命中时不续期：检查点最多存活 query_cursor_ttl 秒，之后重新计数，上游的变化不会被无限期沿用
+        cursor = FilterCursor()
+        query_cursors.set(key, cursor, config.query_cursor_ttl, library_id=library_id)
+    stats = filter_stats(filter_id)
+    end = start_index + limit
+
+    async with cursor.lock:
+        filtered, upstream = cursor.checkpoint_before(start_index)
+        collected: List[Dict[str, Any]] = []
+        scanned = 0
+        while filtered < end and scanned < config.post_filter_max_scan:
+            if cursor.exhausted and upstream >= cursor.frontier[1]:
+                break
+            # 跳到 StartIndex 还需要的项目也算在内：需要 (end - filtered) 个匹配项，按选择率换算成上游项目数
+            wanted = math.ceil((end - filtered) / max(stats.estimate(), MIN_SELECTIVITY))
+            batch_size = int(min(MAX_PAGE_SIZE, max(limit, wanted)))
+            page = await fetch_page(session, method, url, params, headers, upstream, batch_size, config.merge_crawl_retries)
+            if isinstance(page.get("TotalRecordCount"), int):
+                cursor.upstream_total = page["TotalRecordCount"]
+            items = page.get("Items") or []
+
+            started = time.perf_counter()
+            matched = post_filter(items)
+            stats.observe(len(items), len(matched), time.perf_counter() - started)
+
+            if filtered + len(matched) > start_index:
+                collected.extend(matched[max(start_index - filtered, 0):end - filtered])
+            filtered += len(matched)
+            upstream += len(items)
+            scanned += len(items)
+            if upstream > cursor.frontier[1]:
+                cursor.checkpoints.append((filtered, upstream))
+            if len(items) < batch_size:
+                cursor.exhausted = True
+                break
+
+        total, exact = cursor.total(stats.estimate())
+    logger.debug("后筛选填充: StartIndex=%d, 返回 %d 项, 扫描 %d 项, 选择率=%.3f, 总数=%d (%s)",
+                 start_index, len(collected), scanned, stats.estimate(), total, "精确" if exact else "估算")
+    return collected, total if exact else max(total, start_index + len(collected))
@@ -0,0 +1,152 @@
+# src/proxy_handlers/_query_plan.py
+
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from models import AppConfig, AdvancedFilter, AdvancedFilterRule, VirtualLibrary
+from request_timing import span
+from ._filter_translator import plan_filter, iter_rules
+
+logger = logging.getLogger(__name__)
+
+# 虚拟库资源类型 -> Emby 查询参数
+RESOURCE_PARAM_MAP = {"collection": "CollectionIds", "tag": "TagIds", "person": "PersonIds", "genre": "GenreIds", "studio": "StudioIds"}
+
+# 虚拟库列表请求中代理端始终需要的字段（合并、后筛选、封面生成都依赖它们）
+ITEMS_REQUIRED_FIELDS = ("ProviderIds", "Genres", "Tags", "Studios", "People", "OfficialRatings", "CommunityRating", "ProductionYear", "VideoRange", "Container")
+
+DEFAULT_INCLUDE_ITEM_TYPES = "Movie,Series,Video"
+
+
+@dataclass(frozen=True)
+class VirtualLibraryPlan:
+    """
+    一个虚拟库的预编译查询计划。配置变化时整体重建，
+    包含相对日期规则的计划会在日期变化时单独重建。
+    """
+    vlib: VirtualLibrary
+    advanced_filter: Optional[AdvancedFilter]
+    native_params: Dict[str, Any]
+    post_filter_rules: Tuple[AdvancedFilterRule, ...]
+    post_filter: Optional[Callable[[List[Dict[str, Any]]], List[Dict[str, Any]]]]
+    or_branches: Tuple[Dict[str, Any], ...]  # 可拆成并发原生查询的“或”分支，见 FilterPlan
+    exclusions: Tuple[Dict[str, Any], ...]  # 否定规则的正向原生参数，见 FilterPlan
+    residual_filter: Optional[Callable[[List[Dict[str, Any]]], List[Dict[str, Any]]]]
+    items_fields: Tuple[str, ...]
+    latest_fields: Tuple[str, ...]
+    is_merge_enabled: bool
+    resource_param: Optional[Tuple[str, str]]
+    include_item_types: str
+    compiled_day: Optional[str] = None  # 仅当包含相对日期规则时记录编译日期 (UTC)
+
+    @property
+    def id(self) -> str:
+        return self.vlib.id
+
+
+def _utc_day() -> str:
+    return datetime.utcnow().strftime('%Y-%m-%d')
+
+
+def compile_plan(vlib: VirtualLibrary, config: AppConfig) -> VirtualLibraryPlan:
+    native_params: Dict[str, Any] = {}
+    post_filter_rules: List[AdvancedFilterRule] = []
+    post_filter = None
+    or_branches: Tuple[Dict[str, Any], ...] = ()
+    filter_plan = None
+    adv_filter = None
+    has_relative_dates = False
+
+    if vlib.advanced_filter_id:
+        adv_filter = next((f for f in config.advanced_filters if f.id == vlib.advanced_filter_id), None)
+        if adv_filter:
+            logger.info(f"正在为虚拟库 '{vlib.name}' 编译高级筛选器 '{adv_filter.name}'...")
+            filter_plan = plan_filter(adv_filter)
+            native_params, post_filter_rules = filter_plan.native_params, list(filter_plan.post_filter_rules)
+            post_filter, or_branches = filter_plan.post_filter, filter_plan.or_branches
+            has_relative_dates = any(rule.relative_days for rule in iter_rules(adv_filter))
+            if post_filter_rules: logger.info(f"有 {len(post_filter_rules)} 条规则需要在代理端后筛选。")
+        else:
+            logger.warning(f"虚拟库配置了高级筛选器ID '{vlib.advanced_filter_id}'，但未找到。")
+
+    # 修复：如果 IsMovie 为 true，则强制 IncludeItemTypes 为 Movie
+    include_item_types = DEFAULT_INCLUDE_ITEM_TYPES
+    if native_params.get("IsMovie") == "true":
+        include_item_types = "Movie"
+    elif native_params.get("IsSeries") == "true":
+        include_item_types = "Series"
+
+    post_filter_root_fields = [rule.field.split('.')[0] for rule in post_filter_rules]
+    items_fields = ITEMS_REQUIRED_FIELDS + tuple(f for f in dict.fromkeys(post_filter_root_fields) if f not in ITEMS_REQUIRED_FIELDS)
+    latest_fields = tuple(sorted({"ProviderIds", *post_filter_root_fields}))
+
+    resource_param = None
+    if vlib.resource_type in RESOURCE_PARAM_MAP:
+        resource_param = (RESOURCE_PARAM_MAP[vlib.resource_type], vlib.resource_id)
+
+    return VirtualLibraryPlan(
+        vlib=vlib,
+        advanced_filter=adv_filter,
+        native_params=native_params,
+        post_filter_rules=tuple(post_filter_rules),
+        post_filter=post_filter,
+        or_branches=or_branches,
+        exclusions=filter_plan.exclusions if filter_plan else (),
+        residual_filter=filter_plan.residual_filter if filter_plan else None,
+        items_fields=items_fields,
+        latest_fields=latest_fields,
+        is_merge_enabled=vlib.merge_by_tmdb_id or config.force_merge_by_tmdb_id,
+        resource_param=resource_param,
+        include_item_types=include_item_types,
+        compiled_day=_utc_day() if has_relative_dates else None,
+    )
+
+
+@dataclass
+class _PlanRegistry:
+    config: Optional[AppConfig] = None
+    plans: Dict[str, VirtualLibraryPlan] = field(default_factory=dict)
+
+_registry = _PlanRegistry()
+
+
+def get_plans(config: AppConfig) -> Dict[str, VirtualLibraryPlan]:
+    """
+    返回 vlib_id -> 计划 的映射。计划与配置快照对象绑定：
+    只有传入的配置对象发生变化（即配置文件被修改）时才会整体重新编译。
+    """
+    if _registry.config is not config:
+        with span("plan_compile"):
+            plans = {vlib.id: compile_plan(vlib, config) for vlib in config.virtual_libraries}
+        _registry.plans = plans
+        _registry.config = config
+    return _registry.plans
+
+
+def get_plan(config: AppConfig, vlib_id: Optional[str]) -> Optional[VirtualLibraryPlan]:
+    if not vlib_id:
+        return None
+    plans = get_plans(config)
+    plan = plans.get(vlib_id)
+    if plan is not None and plan.compiled_day is not None and plan.compiled_day != _utc_day():
+        # 相对日期规则只需在日期变化后重新解析
+        with span("plan_compile"):
+            plan = compile_plan(plan.vlib, config)
+        plans[vlib_id] = plan
+    return plan
+
+
+@lru_cache(maxsize=256)
+def merge_fields(client_fields: Optional[str], required_fields: Tuple[str, ...]) -> str:
+    """将客户端请求的 Fields 与代理端必需的字段合并，保持客户端字段在前。"""
+    if not client_fields:
+        return ",".join(required_fields)
+    existing_fields = client_fields.split(',')
+    existing_set = set(existing_fields)
+    missing_fields = [f for f in required_fields if f not in existing_set]
+    if not missing_fields:
+        return client_fields
+    return client_fields + "," + ",".join(missing_fields)
@@ -11,23 +11,68 @@ import time
 from pathlib import Path
 from io import BytesIO
 from PIL import Image
-import aiohttp
 import importlib
 
 import config_manager
+import json_codec
+import upstream_pool
+from metrics import timed_job
 # from cover_generator import style_multi_1 # 改为动态导入
 
 logger = logging.getLogger(__name__)
 
+# 本进程内正在生成封面的虚拟库 (调用方据此避免重复创建任务)
 GENERATION_IN_PROGRESS = set()
 
+# 跨进程的生成锁：多 worker 部署时每个 worker 都可能同时触发同一个虚拟库的封面生成，
+# 用 CONFIG_DIR 下以 O_EXCL 创建的锁文件保证同一时间只有一个 worker 在生成。
+# 持有锁的进程异常退出时锁文件会残留，超过 LOCK_STALE_SECONDS 的锁视为失效
+LOCK_DIR = config_manager.CONFIG_DIR / "locks"
+LOCK_STALE_SECONDS = 600
+
+
+def _lock_path(library_id: str) -> Path:
+    return LOCK_DIR / f"autogen_{library_id}.lock"
+
+
+def _acquire_generation_lock(library_id: str) -> bool:
+    path = _lock_path(library_id)
+    LOCK_DIR.mkdir(parents=True, exist_ok=True)
+    for _ in range(2):
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            try:
+                if time.time() - path.stat().st_mtime < LOCK_STALE_SECONDS:
+                    return False
+                logger.warning(f"库 {library_id} 的封面生成锁已超过 {LOCK_STALE_SECONDS} 秒，视为失效并移除。")
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            continue
+        with os.fdopen(fd, "w") as f:
+            f.write(str(os.getpid()))
+        return True
+    return False
+
+
+def _release_generation_lock(library_id: str):
+    try:
+        _lock_path(library_id).unlink()
+    except FileNotFoundError:
+        pass
+
 # 【【【 核心修正1：函数签名改变，接收用户ID和Token 】】】
+@timed_job("cover_autogen")
 async def generate_poster_in_background(library_id: str, user_id: str, api_key: str):
     """
     在后台异步生成海报。此版本使用触发时传入的身份信息来确保权限正确。
     """
     if library_id in GENERATION_IN_PROGRESS:
         return
+    if not _acquire_generation_lock(library_id):
+        logger.info(f"库 {library_id} 的封面正在由其他进程生成，跳过。")
+        return
 
     GENERATION_IN_PROGRESS.add(library_id)
     logger.info(f"✅ 已启动库 {library_id} (用户: {user_id}) 的封面自动生成后台任务。")
@@ -36,7 +81,10 @@ async def generate_poster_in_background(library_id: str, user_id: str, api_key:
     temp_dir = None
     
     try:
-        config = config_manager.load_config()
+        if Path(f"/app/config/images/{library_id}.jpg").is_file():
+            # 其他 worker 刚刚生成完毕 (它释放锁之后本进程才拿到锁)
+            return
+        config = config_manager.get_config()
         vlib = next((v for v in config.virtual_libraries if v.id == library_id), None)
         if not vlib:
             logger.error(f"后台任务：配置中未找到 vlib {library_id}。")
@@ -69,13 +117,13 @@ async def generate_poster_in_background(library_id: str, user_id: str, api_key:
         items = []
         logger.info(f"后台任务：正在向内部代理 {internal_proxy_url} 请求项目...")
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(internal_proxy_url, params=params, headers=internal_headers, timeout=60) as response:
-                    if response.status == 200:
-                        items_dict = await response.json()
-                        if isinstance(items_dict, dict): items = items_dict.get("Items", [])
-                    else:
-                        logger.error(f"后台任务：内部代理请求失败，状态码: {response.status}, 响应: {await response.text()}")
+            session = upstream_pool.get_session()
+            async with session.get(internal_proxy_url, params=params, headers=internal_headers, timeout=60) as response:
+                if response.status == 200:
+                    items_dict = await json_codec.read_json(response)
+                    if isinstance(items_dict, dict): items = items_dict.get("Items", [])
+                else:
+                    logger.error(f"后台任务：内部代理请求失败，状态码: {response.status}, 响应: {await response.text()}")
         except Exception as e:
             logger.error(f"后台任务连接内部代理时出错: {e}")
 
@@ -107,9 +155,9 @@ async def generate_poster_in_background(library_id: str, user_id: str, api_key:
             except Exception: return False
             return False
 
-        async with aiohttp.ClientSession() as session:
-            tasks = [download_image(session, item, i + 1) for i, item in enumerate(selected_items)]
-            results = await asyncio.gather(*tasks)
+        session = upstream_pool.get_session()
+        tasks = [download_image(session, item, i + 1) for i, item in enumerate(selected_items)]
+        results = await asyncio.gather(*tasks)
 
         if not any(results):
             logger.error(f"后台任务：为库 {library_id} 下载封面素材失败。")
@@ -178,4 +226,5 @@ async def generate_poster_in_background(library_id: str, user_id: str, api_key:
         if temp_dir and temp_dir.exists():
             shutil.rmtree(temp_dir)
         GENERATION_IN_PROGRESS.remove(library_id)
+        _release_generation_lock(library_id)
         logger.info(f"后台任务结束，已释放库 {library_id} 的生成锁。")
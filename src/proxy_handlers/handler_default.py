@@ -4,18 +4,25 @@ from fastapi import Request
 from fastapi.responses import StreamingResponse, Response
 from aiohttp import ClientSession, ClientError
 
+from metrics import STREAMED_BYTES
+
 logger = logging.getLogger(__name__)
 
+# buffer_json 时完整读取的 JSON 响应的上限，超过时改回流式转发
+MAX_BUFFERED_JSON_BYTES = 1024 * 1024
+
 async def forward_request(
     request: Request,
     full_path: str,
     method: str,
     real_emby_url: str,
     session: ClientSession,
+    buffer_json: bool = False,
 ) -> Response:
     """
     默认的请求转发器，使用流式传输将请求高效地转发到真实的 Emby 服务器。
     这对于视频播放、文件下载等大文件传输至关重要。
+    buffer_json 为 True 时，不超过 MAX_BUFFERED_JSON_BYTES 的 200 JSON 响应会被完整读取后返回，以便上层缓存。
     """
     target_url = f"{real_emby_url}/{full_path}"
     
@@ -37,13 +44,47 @@ async def forward_request(
             allow_redirects=False # 让客户端自己处理重定向，这是反向代理的标准行为
         )
 
+        # 过滤掉 hop-by-hop headers，这些头部是描述两个直接连接节点之间的信息，不应该被代理转发。
+        # 'content-length' 也应该被移除，因为在流式传输（Transfer-Encoding: chunked）中，长度是动态的。
+        response_headers = {
+            k: v for k, v in resp.headers.items()
+            if k.lower() not in ('transfer-encoding', 'connection', 'content-encoding', 'content-length')
+        }
+
+        # 小的 JSON 响应 (如单项目详情) 读完整后返回；读到一半发现超过上限时，已读部分作为流的开头继续转发
+        prefix = b""
+        if buffer_json and resp.status == 200 and "application/json" in resp.headers.get('Content-Type', '') \
+                and (resp.content_length is None or resp.content_length <= MAX_BUFFERED_JSON_BYTES):
+            body = bytearray()
+            try:
+                async for chunk in resp.content.iter_chunked(8192):
+                    body += chunk
+                    if len(body) > MAX_BUFFERED_JSON_BYTES:
+                        break
+            except BaseException:
+                resp.release()
+                raise
+            if len(body) <= MAX_BUFFERED_JSON_BYTES:
+                resp.release()
+                return Response(
+                    content=bytes(body),
+                    status_code=resp.status,
+                    headers=response_headers,
+                    media_type=resp.headers.get('Content-Type')
+                )
+            prefix = bytes(body)
+
         # 定义一个异步生成器，用于逐块读取来自 Emby 服务器的响应体并将其 yield 出去。
         async def stream_generator():
             try:
+                if prefix:
+                    STREAMED_BYTES.inc(len(prefix))
+                    yield prefix
                 # resp.content 是一个 aiohttp.StreamReader 对象。
                 # .iter_chunked(8192) 会以 8KB 的块大小读取数据。
                 # 这是一个合理的缓冲区大小，可以在网络效率和内存占用之间取得平衡。
                 async for chunk in resp.content.iter_chunked(8192):
+                    STREAMED_BYTES.inc(len(chunk))
                     yield chunk
             except ClientError as e:
                 logger.error(f"Error while streaming response from Emby for {full_path}: {e}")
@@ -51,13 +92,6 @@ async def forward_request(
                 # 无论成功还是失败，都确保上游响应被关闭，以释放连接回连接池。
                 resp.release()
 
-        # 过滤掉 hop-by-hop headers，这些头部是描述两个直接连接节点之间的信息，不应该被代理转发。
-        # 'content-length' 也应该被移除，因为在流式传输（Transfer-Encoding: chunked）中，长度是动态的。
-        response_headers = {
-            k: v for k, v in resp.headers.items()
-            if k.lower() not in ('transfer-encoding', 'connection', 'content-encoding', 'content-length')
-        }
-
         # 使用 FastAPI 的 StreamingResponse 将数据流式返回给客户端。
         # 客户端可以立即开始接收数据，而无需等待整个文件在代理服务器上下载完成。
         return StreamingResponse(
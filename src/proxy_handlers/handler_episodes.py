@@ -1,13 +1,14 @@
 # src/proxy_handlers/handler_episodes.py (修改后)
 
 import asyncio
-import json
+import json_codec
 import logging
 import re
 from fastapi import Request, Response
 from aiohttp import ClientSession
 from ._find_helper import find_all_series_by_tmdb_id, is_item_in_a_merge_enabled_vlib # <-- 导入新函数
-from config_manager import load_config
+from config_manager import get_config
+from logging_setup import sample
 
 logger = logging.getLogger(__name__)
 
@@ -21,7 +22,7 @@ async def handle_episodes_merge(request: Request, full_path: str, session: Clien
     if not match or not season_id: return None
 
     series_id_from_path = match.group(1)
-    logger.info(f"EPISODES_HANDLER: 拦截到对剧集 {series_id_from_path} 下，季 {season_id} 的“集”请求。")
+    logger.info("EPISODES_HANDLER: 拦截到对剧集 %s 下，季 %s 的“集”请求。", series_id_from_path, season_id, extra=sample("episodes"))
 
     params = request.query_params
     user_id = params.get("UserId")
@@ -42,37 +43,37 @@ async def handle_episodes_merge(request: Request, full_path: str, session: Clien
         item_url = f"{real_emby_url}/emby/Users/{user_id}/Items/{series_id_from_path}"
         item_params = {'Fields': 'ProviderIds', **auth_token_param}
         async with session.get(item_url, params=item_params, headers=headers) as resp:
-            tmdb_id = (await resp.json()).get("ProviderIds", {}).get("Tmdb")
+            tmdb_id = (await json_codec.read_json(resp)).get("ProviderIds", {}).get("Tmdb")
             
         season_url = f"{real_emby_url}/emby/Users/{user_id}/Items/{season_id}"
         season_params = {'Fields': 'IndexNumber', **auth_token_param}
         async with session.get(season_url, params=season_params, headers=headers) as resp:
-            target_season_number = (await resp.json()).get("IndexNumber")
+            target_season_number = (await json_codec.read_json(resp)).get("IndexNumber")
 
     except Exception as e:
         logger.error(f"EPISODES_HANDLER: 获取TMDB ID或季号失败: {e}"); return None
 
     if not tmdb_id or target_season_number is None: return None
-    logger.info(f"EPISODES_HANDLER: 找到TMDB ID: {tmdb_id}，目标季号: {target_season_number}。")
+    logger.debug("EPISODES_HANDLER: 找到TMDB ID: %s，目标季号: %s。", tmdb_id, target_season_number)
 
-    config = load_config()
+    config = get_config()
     show_missing = config.show_missing_episodes
     tmdb_api_key = config.tmdb_api_key
     tmdb_proxy = config.tmdb_proxy
 
-    original_series_ids = await find_all_series_by_tmdb_id(session, real_emby_url, user_id, tmdb_id, headers, auth_token_param)
+    original_series_ids = await find_all_series_by_tmdb_id(session, real_emby_url, user_id, tmdb_id, headers, auth_token_param, expected_id=series_id_from_path)
     
     # 如果不显示缺失剧集，并且只有一个库，那么就没必要继续执行了
     if not show_missing and len(original_series_ids) < 2:
         return None
         
-    logger.info(f"EPISODES_HANDLER: ✅ 找到 {len(original_series_ids)} 个关联剧集: {original_series_ids}。")
+    logger.debug("EPISODES_HANDLER: ✅ 找到 %d 个关联剧集: %s。", len(original_series_ids), original_series_ids)
 
     async def fetch_episodes(series_id: str):
         seasons_url = f"{real_emby_url}/emby/Shows/{series_id}/Seasons"
         try:
             async with session.get(seasons_url, params=auth_token_param, headers=headers) as resp:
-                seasons = (await resp.json()).get("Items", [])
+                seasons = (await json_codec.read_json(resp)).get("Items", [])
             
             # 找到这个剧集里，与我们目标季号相同的那个季的ID
             matching_season = next((s for s in seasons if s.get("IndexNumber") == target_season_number), None)
@@ -86,7 +87,7 @@ async def handle_episodes_merge(request: Request, full_path: str, session: Clien
             episode_params.pop("StartIndex", None)
             
             async with session.get(episodes_url, params=episode_params, headers=headers) as resp:
-                return (await resp.json()).get("Items", []) if resp.status == 200 else []
+                return (await json_codec.read_json(resp)).get("Items", []) if resp.status == 200 else []
         except Exception: return []
 
     tasks = [fetch_episodes(sid) for sid in original_series_ids]
@@ -102,7 +103,7 @@ async def handle_episodes_merge(request: Request, full_path: str, session: Clien
             merged_episodes[key] = episode
 
     if show_missing:
-        logger.info(f"EPISODES_HANDLER: '显示缺失剧集' 已开启，开始从 TMDB 获取信息。")
+        logger.debug("EPISODES_HANDLER: '显示缺失剧集' 已开启，开始从 TMDB 获取信息。")
         tmdb_episodes = await fetch_tmdb_episodes(session, tmdb_api_key, tmdb_id, target_season_number, tmdb_proxy)
         
         if tmdb_episodes:
@@ -110,7 +111,7 @@ async def handle_episodes_merge(request: Request, full_path: str, session: Clien
             series_info_url = f"{real_emby_url}/emby/Users/{user_id}/Items/{series_id_from_path}"
             series_info_params = {**auth_token_param}
             async with session.get(series_info_url, params=series_info_params, headers=headers) as resp:
-                series_info = await resp.json()
+                series_info = await json_codec.read_json(resp)
 
             for tmdb_episode in tmdb_episodes:
                 episode_number = tmdb_episode.get("episode_number")
@@ -138,9 +139,9 @@ async def handle_episodes_merge(request: Request, full_path: str, session: Clien
                     merged_episodes[episode_number] = missing_episode
 
     final_items = sorted(merged_episodes.values(), key=lambda x: x.get("IndexNumber", 0))
-    logger.info(f"EPISODES_HANDLER: 合并完成。合并前总数: {len(all_episodes)}, 合并后最终数量: {len(final_items)}")
+    logger.debug("EPISODES_HANDLER: 合并完成。合并前总数: %d, 合并后最终数量: %d", len(all_episodes), len(final_items))
 
-    return Response(content=json.dumps({"Items": final_items, "TotalRecordCount": len(final_items)}), status_code=200, media_type="application/json")
+    return Response(content=json_codec.dumps({"Items": final_items, "TotalRecordCount": len(final_items)}), status_code=200, media_type="application/json")
 
 async def fetch_tmdb_episodes(session: ClientSession, api_key: str, tmdb_id: str, season_number: int, proxy: str | None = None):
     """从TMDB获取指定季的所有集信息"""
@@ -152,7 +153,7 @@ async def fetch_tmdb_episodes(session: ClientSession, api_key: str, tmdb_id: str
     try:
         async with session.get(url, proxy=proxy) as response:
             if response.status == 200:
-                data = await response.json()
+                data = await json_codec.read_json(response)
                 return data.get("episodes", [])
             else:
                 logger.error(f"Error fetching TMDB season details: {response.status}")
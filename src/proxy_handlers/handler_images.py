@@ -44,15 +44,15 @@ async def handle_virtual_library_image(request: Request, full_path: str) -> Resp
     placeholder_to_serve = None
     
     if item_id.startswith("tmdb_"):  # 缺失剧集的 ID 以 "tmdb_" 开头
-        logger.debug(f"IMAGE_HANDLER: Serving MISSING EPISODE placeholder for item '{item_id}'.")
+        logger.debug("IMAGE_HANDLER: Serving MISSING EPISODE placeholder for item '%s'.", item_id)
         placeholder_to_serve = PLACEHOLDER_EPISODE_PATH
         
     elif item_id.startswith("tmdb-"):  # RSSHub 项目的 ID 以 "tmdb-" 开头
-        logger.debug(f"IMAGE_HANDLER: Serving RSSHUB placeholder for item '{item_id}'.")
+        logger.debug("IMAGE_HANDLER: Serving RSSHUB placeholder for item '%s'.", item_id)
         placeholder_to_serve = PLACEHOLDER_RSSHUB_PATH
         
     else:  # 其他情况（标准的 UUID）被认为是常规虚拟库
-        logger.debug(f"IMAGE_HANDLER: Serving 'GENERATING' placeholder for virtual library '{item_id}'.")
+        logger.debug("IMAGE_HANDLER: Serving 'GENERATING' placeholder for virtual library '%s'.", item_id)
         placeholder_to_serve = PLACEHOLDER_GENERATING_PATH
 
     if placeholder_to_serve and placeholder_to_serve.is_file():
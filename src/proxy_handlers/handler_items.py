@@ -1,59 +1,32 @@
 # src/proxy_handlers/handler_items.py (高性能重构版)
 
 import logging
-import json
+import time
+import json_codec
 from fastapi import Request, Response
 from aiohttp import ClientSession
 from models import AppConfig, AdvancedFilter
 from typing import List, Any, Dict
 
 from . import handler_merger, handler_views
-# 导入我们新的翻译器和旧的后筛选逻辑
-from ._filter_translator import translate_rules
+from ._query_plan import get_plan, merge_fields
+from ._page_fetcher import fetch_all_items, PageFetchError
+from ._merge_paginator import paginate_merged
+from ._page_filler import fill_filtered_page, filter_stats
+from ._or_union import fetch_or_union, sort_fields
+from ._exclusion import apply_exclusions
+from ._find_helper import remember_merge_members
 from .handler_rss import RssHandler
-from proxy_cache import vlib_items_cache
+from proxy_cache import vlib_items_cache, RawItemsPage
+from logging_setup import sample
+from request_timing import span
 logger = logging.getLogger(__name__)
 
-# --- 后筛选逻辑 (保留用于处理无法翻译的规则) ---
-def _get_nested_value(item: Dict[str, Any], field_path: str) -> Any:
-    keys = field_path.split('.')
-    value = item
-    for key in keys:
-        if isinstance(value, dict): value = value.get(key)
-        else: return None
-    return value
-
-def _check_condition(item_value: Any, operator: str, rule_value: str) -> bool:
-    if operator not in ["is_empty", "is_not_empty"]:
-        if item_value is None: return False
-        if isinstance(item_value, list):
-            if operator == "contains": return rule_value in item_value
-            if operator == "not_contains": return rule_value not in item_value
-            return False
-        if operator in ["greater_than", "less_than"]:
-            try:
-                if operator == "greater_than": return float(item_value) > float(rule_value)
-                if operator == "less_than": return float(item_value) < float(rule_value)
-            except (ValueError, TypeError): return False
-        item_value_str = str(item_value).lower()
-        rule_value_str = str(rule_value).lower()
-        if operator == "equals": return item_value_str == rule_value_str
-        if operator == "not_equals": return item_value_str != rule_value_str
-        if operator == "contains": return rule_value_str in item_value_str
-        if operator == "not_contains": return rule_value_str not in item_value_str
-    if operator == "is_empty": return item_value is None or item_value == '' or item_value == []
-    if operator == "is_not_empty": return item_value is not None and item_value != '' and item_value != []
-    return False
-
-def _apply_post_filter(items: List[Dict[str, Any]], post_filter_rules: List[Dict]) -> List[Dict[str, Any]]:
-    if not post_filter_rules: return items
-    logger.info(f"在 {len(items)} 个项目上应用 {len(post_filter_rules)} 条后筛选规则。")
-    filtered_items = []
-    for item in items:
-        if all(_check_condition(_get_nested_value(item, rule.field), rule.operator, rule.value) for rule in post_filter_rules):
-            filtered_items.append(item)
-    return filtered_items
-
+def _record_filter_request(plan, path: str, exclusion_mode: str | None, started: float):
+    """记录使用高级筛选器的请求实际走了哪条执行路径及其耗时，供管理端的筛选器计划说明使用。"""
+    if plan.advanced_filter:
+        label = f"{path}+{exclusion_mode}" if exclusion_mode else path
+        filter_stats(plan.advanced_filter.id).observe_request(label, time.perf_counter() - started)
 
 async def handle_virtual_library_items(
     request: Request,
@@ -67,35 +40,32 @@ async def handle_virtual_library_items(
         return None
 
     params = request.query_params
-    found_vlib = None
-    
-    parent_id_from_param = params.get("ParentId")
-    if parent_id_from_param:
-        found_vlib = next((vlib for vlib in config.virtual_libraries if vlib.id == parent_id_from_param), None)
+    plan = get_plan(config, params.get("ParentId"))
 
-    if not found_vlib and method == "GET" and 'Items' in full_path:
+    if not plan and method == "GET" and 'Items' in full_path:
         path_parts = full_path.split('/');
         try:
             items_index = path_parts.index('Items')
             if items_index + 1 < len(path_parts):
-                potential_path_vlib_id = path_parts[items_index + 1]
-                found_vlib = next((vlib for vlib in config.virtual_libraries if vlib.id == potential_path_vlib_id), None)
+                plan = get_plan(config, path_parts[items_index + 1])
         except ValueError: pass
     
-    if not found_vlib:
+    if not plan:
         # 兼容Go版本的后备方案：处理非标准客户端（如网易爆米花）的请求
         # 这些客户端通过 /Users/xxx/Items 获取根视图，且请求参数中不含任何 'Id'
         has_id_param = any(key.lower().endswith('id') for key in params.keys())
         
         if not has_id_param:
-            logger.info("检测到非标准客户端请求 (无 'Id' 后缀参数)，作为后备方案返回媒体库视图。")
+            logger.debug("检测到非标准客户端请求 (无 'Id' 后缀参数)，作为后备方案返回媒体库视图。")
             # 调用 handler_views 中的逻辑来返回一个伪造的根视图
             return await handler_views.handle_view_injection(request, full_path, method, real_emby_url, session, config)
         
         # 如果有 'Id' 参数但不是虚拟库，则为正常请求，放行
         return None
 
-    logger.info(f"拦截到虚拟库 '{found_vlib.name}'，开始高性能筛选流程。")
+    found_vlib = plan.vlib
+    started = time.perf_counter()
+    logger.info("拦截到虚拟库 '%s'，开始高性能筛选流程。", found_vlib.name, extra=sample("vlib_items"))
     
     user_id = params.get("UserId")
     if not user_id:
@@ -121,19 +91,14 @@ async def handle_virtual_library_items(
     for key in safe_params_to_inherit:
         if key in params: new_params[key] = params[key]
 
-    required_fields = ["ProviderIds", "Genres", "Tags", "Studios", "People", "OfficialRatings", "CommunityRating", "ProductionYear", "VideoRange", "Container"]
-    if "Fields" in new_params:
-        existing_fields = set(new_params["Fields"].split(','))
-        missing_fields = [f for f in required_fields if f not in existing_fields]
-        if missing_fields: new_params["Fields"] += "," + ",".join(missing_fields)
-    else: new_params["Fields"] = ",".join(required_fields)
+    new_params["Fields"] = merge_fields(new_params.get("Fields"), plan.items_fields)
 
     new_params["Recursive"] = "true"
-    new_params["IncludeItemTypes"] = "Movie,Series,Video"
+    new_params["IncludeItemTypes"] = plan.include_item_types
 
-    resource_map = {"collection": "CollectionIds", "tag": "TagIds", "person": "PersonIds", "genre": "GenreIds", "studio": "StudioIds"}
-    if found_vlib.resource_type in resource_map:
-        new_params[resource_map[found_vlib.resource_type]] = found_vlib.resource_id
+    if plan.resource_param:
+        resource_key, resource_value = plan.resource_param
+        new_params[resource_key] = resource_value
     # --- 【【【 新增：借鉴“缺失剧集”逻辑，重构 RSS 库的统一处理方案 】】】 ---
     elif found_vlib.resource_type == "rsshub":
         # 终极修复：将所有 RSS 逻辑委托给 RssHandler，并传入必要的上下文
@@ -165,33 +130,17 @@ async def handle_virtual_library_items(
             paginated_items = final_items[start_idx:]
             
         final_response = {"Items": paginated_items, "TotalRecordCount": len(final_items)}
-        return Response(content=json.dumps(final_response).encode('utf-8'), media_type="application/json")
+        return Response(content=json_codec.dumps(final_response), media_type="application/json")
     # --- 【【【 RSS 逻辑结束 】】】 ---
 
-    # 【【【核心优化点 2】】】: 应用高级筛选器翻译
-    post_filter_rules = []
-    if found_vlib.advanced_filter_id:
-        adv_filter = next((f for f in config.advanced_filters if f.id == found_vlib.advanced_filter_id), None)
-        if adv_filter:
-            logger.info(f"正在为高级筛选器 '{adv_filter.name}' 翻译规则...")
-            emby_native_params, post_filter_rules = translate_rules(adv_filter.rules)
-            new_params.update(emby_native_params)
-            if post_filter_rules: logger.info(f"有 {len(post_filter_rules)} 条规则需要在代理端后筛选。")
-        else:
-            logger.warning(f"虚拟库配置了高级筛选器ID '{found_vlib.advanced_filter_id}'，但未找到。")
-
-    # 修复：如果 IsMovie 为 true，则强制 IncludeItemTypes 为 Movie
-    if new_params.get("IsMovie") == "true":
-        new_params["IncludeItemTypes"] = "Movie"
-        logger.info("检测到 IsMovie: 'true'，强制设置 IncludeItemTypes 为 'Movie'。")
-    elif new_params.get("IsSeries") == "true":
-        new_params["IncludeItemTypes"] = "Series"
-        logger.info("检测到 IsSeries: 'true'，强制设置 IncludeItemTypes 为 'Series'。")
+    # 【【【核心优化点 2】】】: 应用预编译的高级筛选器翻译结果
+    post_filter_rules = plan.post_filter_rules
+    new_params.update(plan.native_params)
 
     # 【【【核心优化点 3】】】: 处理合并的特殊情况
     # 如果启用了TMDB合并，我们需要获取一个更大的数据集来进行有效的合并，然后再在代理端进行分页。
     # 这是一种混合模式，仍然远比获取所有项目要高效。
-    is_tmdb_merge_enabled = found_vlib.merge_by_tmdb_id or config.force_merge_by_tmdb_id
+    is_tmdb_merge_enabled = plan.is_merge_enabled
 
     target_emby_api_path = f"Users/{user_id}/Items"
     search_url = f"{real_emby_url}/emby/{target_emby_api_path}"
@@ -206,13 +155,59 @@ async def handle_virtual_library_items(
         ]
     }
     
-    logger.debug(f"向真实 Emby 发起优化后的最终请求: URL={search_url}, Params={new_params}")
+    # 否定规则：取正向查询的 ID 集合，较小时交给 Emby 原生排除，否则在代理端按 ID 减去。
+    # 代理端减去的 ID 集合不在上游参数中，它的指纹 (filter_generation) 并入后筛选检查点的键，集合变化后不再沿用旧的偏移
+    post_filter, exclusion_mode, filter_generation = await apply_exclusions(
+        session, search_url, new_params, headers_to_forward, config, plan,
+        library_id=found_vlib.id, user_id=user_id
+    )
+    if exclusion_mode and post_filter is None:
+        post_filter_rules = []
+
+    logger.debug("向真实 Emby 发起优化后的最终请求: URL=%s, Params=%s", search_url, new_params)
 
     # 如果不启用TMDB合并，或者有无法翻译的后筛选规则，则走常规分页逻辑
     if not is_tmdb_merge_enabled or post_filter_rules:
         if is_tmdb_merge_enabled and post_filter_rules:
             logger.warning("TMDB合并已启用，但存在无法翻译的后筛选规则，合并将在当前页进行，可能不完整。")
 
+        use_or_union = (
+            plan.or_branches and config.filter_or_pushdown
+            and int(client_start_index) + int(client_limit) <= config.post_filter_max_scan
+        )
+        if use_or_union or (post_filter and config.post_filter_fill_pages):
+            try:
+                if use_or_union:
+                    # “或”条件的每个分支各是一个原生查询：并发获取后按 Id 去重、按客户端排序合并
+                    union_params = {**new_params, "Fields": merge_fields(new_params.get("Fields"), sort_fields(new_params))}
+                    items_list, total_record_count = await fetch_or_union(
+                        session, method, search_url, union_params, headers_to_forward, config,
+                        branches=plan.or_branches, start_index=int(client_start_index), limit=int(client_limit)
+                    )
+                else:
+                    # 后筛选会丢掉一部分项目：持续向上游取数直到凑满一页，深分页从检查点继续
+                    items_list, total_record_count = await fill_filtered_page(
+                        session, method, search_url, new_params, headers_to_forward, config,
+                        library_id=found_vlib.id, filter_id=plan.advanced_filter.id, post_filter=post_filter,
+                        user_id=user_id, start_index=int(client_start_index), limit=int(client_limit),
+                        generation=filter_generation
+                    )
+            except PageFetchError as e:
+                logger.error(f"后筛选获取批次失败: {e}")
+                return Response(content=json_codec.dumps({"Items": [], "TotalRecordCount": 0}), status_code=200, media_type="application/json")
+
+            if is_tmdb_merge_enabled:
+                logger.debug("正在对当前页的数据集执行TMDB合并...")
+                with span("merge"):
+                    items_list = await handler_merger.merge_items_by_tmdb(items_list)
+                remember_merge_members(found_vlib, items_list, config)
+            if items_list:
+                vlib_items_cache[found_vlib.id] = items_list
+            with span("serialize"):
+                content = json_codec.dumps({"Items": items_list, "TotalRecordCount": total_record_count, "StartIndex": int(client_start_index)})
+            _record_filter_request(plan, "or_union" if use_or_union else "post_filter_fill", exclusion_mode, started)
+            return Response(content=content, status_code=200, media_type="application/json")
+
         async with session.request(method, search_url, params=new_params, headers=headers_to_forward) as resp:
             if resp.status != 200:
                 content = await resp.read()
@@ -221,81 +216,76 @@ async def handle_virtual_library_items(
             content = await resp.read()
             response_headers = {k: v for k, v in resp.headers.items() if k.lower() not in ('transfer-encoding', 'connection', 'content-encoding', 'content-length')}
             
-            if "application/json" in resp.headers.get("Content-Type", ""):
+            is_json = "application/json" in resp.headers.get("Content-Type", "")
+            if is_json and not post_filter and not is_tmdb_merge_enabled:
+                # 直通分页：原样转发上游字节，不解析也不重新序列化；
+                # 封面生成用的项目缓存保存原始字节，在被读取时才解析
+                if RawItemsPage.has_items(content):
+                    vlib_items_cache[found_vlib.id] = RawItemsPage(content)
+            elif is_json:
                 try:
-                    data = json.loads(content)
+                    data = json_codec.loads(content)
                     items_list = data.get("Items", [])
                     
-                    if post_filter_rules:
-                        items_list = _apply_post_filter(items_list, post_filter_rules)
+                    if post_filter:
+                        items_list = post_filter(items_list)
                     
                     if is_tmdb_merge_enabled:
-                        logger.info("正在对当前页的数据集执行TMDB合并...")
-                        items_list = await handler_merger.merge_items_by_tmdb(items_list)
+                        logger.debug("正在对当前页的数据集执行TMDB合并...")
+                        with span("merge"):
+                            items_list = await handler_merger.merge_items_by_tmdb(items_list)
+                        remember_merge_members(found_vlib, items_list, config)
                     
                     data["Items"] = items_list
-                    logger.info(f"原生筛选/合并完成。Emby返回总数: {data.get('TotalRecordCount')}, 当前页项目数: {len(items_list)}")
+                    logger.debug("原生筛选/合并完成。Emby返回总数: %s, 当前页项目数: %d", data.get('TotalRecordCount'), len(items_list))
                     
                     final_items_to_return = data.get("Items", [])
                     if final_items_to_return:
                         vlib_items_cache[found_vlib.id] = final_items_to_return
-                        logger.info(f"✅ 已为虚拟库 '{found_vlib.name}' 缓存 {len(final_items_to_return)} 个项目以供封面生成使用。")
+                        logger.debug("✅ 已为虚拟库 '%s' 缓存 %d 个项目以供封面生成使用。", found_vlib.name, len(final_items_to_return))
                     
-                    content = json.dumps(data).encode('utf-8')
-                except (json.JSONDecodeError, Exception) as e:
+                    with span("serialize"):
+                        content = json_codec.dumps(data)
+                except (json_codec.JSONDecodeError, Exception) as e:
                     logger.error(f"处理响应时发生错误: {e}")
 
+            _record_filter_request(plan, "post_filter_page" if post_filter else "merge_page" if is_tmdb_merge_enabled else "native", exclusion_mode, started)
             return Response(content=content, status_code=resp.status, headers=response_headers)
 
-    # --- TMDB合并的全量获取逻辑 ---
+    # --- TMDB合并的分页逻辑 ---
     else:
-        logger.info("TMDB合并已启用，开始获取全量数据...")
-        all_items = []
-        start_index = 0
-        limit = 200  # 每次请求200个
+        logger.debug("TMDB合并已启用，开始获取全量数据...")
         
         # 移除客户端的分页参数，因为我们要自己控制
         new_params.pop("StartIndex", None)
         new_params.pop("Limit", None)
         
-        while True:
-            fetch_params = new_params.copy()
-            fetch_params["StartIndex"] = str(start_index)
-            fetch_params["Limit"] = str(limit)
-            
-            logger.debug(f"正在获取批次: StartIndex={start_index}, Limit={limit}")
-            async with session.request(method, search_url, params=fetch_params, headers=headers_to_forward) as resp:
-                if resp.status != 200:
-                    logger.error(f"获取批次失败，状态码: {resp.status}")
-                    # 返回错误或一个空的成功响应
-                    return Response(content=json.dumps({"Items": [], "TotalRecordCount": 0}), status_code=200, media_type="application/json")
-
-                batch_data = await resp.json()
-                batch_items = batch_data.get("Items", [])
-                
-                if not batch_items:
-                    logger.info("已获取所有数据。")
-                    break
-                
-                all_items.extend(batch_items)
-                start_index += len(batch_items)
-                
-                # 如果返回的项目数小于请求的limit，说明是最后一页
-                if len(batch_items) < limit:
-                    logger.info("已到达最后一页。")
-                    break
-        
-        logger.info(f"全量数据获取完成，总共 {len(all_items)} 个项目。")
-
-        # 1. 应用TMDB合并
-        logger.info("正在对获取到的全量数据集执行TMDB合并...")
-        merged_items = await handler_merger.merge_items_by_tmdb(all_items)
-        
-        # 2. 对合并后的结果进行手动分页
-        total_record_count = len(merged_items)
         start_idx = int(client_start_index)
         limit_count = int(client_limit)
-        paginated_items = merged_items[start_idx : start_idx + limit_count]
+        try:
+            if config.merge_incremental_pagination:
+                # 增量去重分页：只拉取到满足当前页为止，总数先估算、后台再算出精确值
+                with span("merge"):
+                    paginated_items, total_record_count = await paginate_merged(
+                        session, method, search_url, new_params, headers_to_forward, config,
+                        library_id=found_vlib.id, user_id=user_id, start_index=start_idx, limit=limit_count
+                    )
+            else:
+                all_items = await fetch_all_items(session, method, search_url, new_params, headers_to_forward, config, key=found_vlib.id)
+                logger.debug("全量数据获取完成，总共 %d 个项目。", len(all_items))
+
+                # 1. 应用TMDB合并
+                logger.debug("正在对获取到的全量数据集执行TMDB合并...")
+                with span("merge"):
+                    merged_items = await handler_merger.merge_items_by_tmdb(all_items)
+
+                # 2. 对合并后的结果进行手动分页
+                total_record_count = len(merged_items)
+                paginated_items = merged_items[start_idx : start_idx + limit_count]
+        except PageFetchError as e:
+            logger.error(f"获取批次失败: {e}")
+            # 返回错误或一个空的成功响应
+            return Response(content=json_codec.dumps({"Items": [], "TotalRecordCount": 0}), status_code=200, media_type="application/json")
         
         # 3. 构建最终的响应
         final_data = {
@@ -303,13 +293,16 @@ async def handle_virtual_library_items(
             "TotalRecordCount": total_record_count,
             "StartIndex": start_idx
         }
-        logger.info(f"合并后手动分页完成。总数: {total_record_count}, 返回页面项目数: {len(paginated_items)}")
+        logger.debug("合并后手动分页完成。总数: %d, 返回页面项目数: %d", total_record_count, len(paginated_items))
 
+        remember_merge_members(found_vlib, paginated_items, config)
         if paginated_items:
             vlib_items_cache[found_vlib.id] = paginated_items
-            logger.info(f"✅ 已为虚拟库 '{found_vlib.name}' 缓存 {len(paginated_items)} 个项目以供封面生成使用。")
+            logger.debug("✅ 已为虚拟库 '%s' 缓存 %d 个项目以供封面生成使用。", found_vlib.name, len(paginated_items))
 
-        content = json.dumps(final_data).encode('utf-8')
+        with span("serialize"):
+            content = json_codec.dumps(final_data)
+        _record_filter_request(plan, "merge_incremental" if config.merge_incremental_pagination else "merge_full_crawl", exclusion_mode, started)
         # 伪造一个成功的响应头
         response_headers = {
             'Content-Type': 'application/json; charset=utf-8',
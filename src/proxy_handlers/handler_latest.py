@@ -1,19 +1,21 @@
 # src/proxy_handlers/handler_latest.py (最终修正版)
 
 import logging
-import json
+import json_codec
 from fastapi import Request, Response
 from aiohttp import ClientSession
 from models import AppConfig
 from typing import List, Dict
 import asyncio
 from pathlib import Path
+from logging_setup import sample
+from request_timing import span
 
 from . import handler_merger
 # 【新增】导入后台生成处理器
 from . import handler_autogen
-from ._filter_translator import translate_rules
-from .handler_items import _apply_post_filter
+from ._query_plan import get_plan
+from ._exclusion import apply_exclusions
 
 logger = logging.getLogger(__name__)
 
@@ -35,9 +37,10 @@ async def handle_home_latest_items(
     parent_id = params.get("ParentId")
     if not parent_id: return None
 
-    found_vlib = next((vlib for vlib in config.virtual_libraries if vlib.id == parent_id), None)
-    if not found_vlib:
+    plan = get_plan(config, parent_id)
+    if not plan:
         return None
+    found_vlib = plan.vlib
 
     # 终极修复：将 UserId 的提取逻辑提前，确保所有分支都能访问到它
     user_id = params.get("UserId")
@@ -52,7 +55,7 @@ async def handle_home_latest_items(
 
     # 如果是 RSS 库，则使用专门的逻辑处理
     if found_vlib.resource_type == 'rsshub':
-        logger.info(f"HOME_LATEST_HANDLER: Intercepting request for latest items in RSS vlib '{found_vlib.name}'.")
+        logger.info("HOME_LATEST_HANDLER: Intercepting request for latest items in RSS vlib '%s'.", found_vlib.name, extra=sample("latest"))
         
         from .handler_rss import RssHandler
         rss_handler = RssHandler()
@@ -64,7 +67,7 @@ async def handle_home_latest_items(
             (found_vlib.id, limit)
         )
         if not latest_items_from_db:
-            return Response(content=json.dumps([]).encode('utf-8'), status_code=200, headers={"Content-Type": "application/json"})
+            return Response(content=json_codec.dumps([]), status_code=200, headers={"Content-Type": "application/json"})
 
         existing_emby_ids = [str(item['emby_item_id']) for item in latest_items_from_db if item['emby_item_id']]
         missing_items_info = [{'tmdb_id': item['tmdb_id'], 'media_type': item['media_type']} for item in latest_items_from_db if not item['emby_item_id']]
@@ -94,10 +97,10 @@ async def handle_home_latest_items(
 
         final_items = existing_items_data + missing_items_placeholders
         
-        content = json.dumps(final_items).encode('utf-8')
+        content = json_codec.dumps(final_items)
         return Response(content=content, status_code=200, headers={"Content-Type": "application/json"})
 
-    logger.info(f"HOME_LATEST_HANDLER: Intercepting request for latest items in vlib '{found_vlib.name}'.")
+    logger.info("HOME_LATEST_HANDLER: Intercepting request for latest items in vlib '%s'.", found_vlib.name, extra=sample("latest"))
 
     # --- 【【【 核心修正：在这里也添加封面自动生成触发器 】】】 ---
     image_file = COVERS_DIR / f"{found_vlib.id}.jpg"
@@ -124,35 +127,20 @@ async def handle_home_latest_items(
     new_params["Recursive"] = "true"
     new_params["IncludeItemTypes"] = "Movie,Series,Video"
     
-    post_filter_rules = []
-    if found_vlib.advanced_filter_id:
-        adv_filter = next((f for f in config.advanced_filters if f.id == found_vlib.advanced_filter_id), None)
-        if adv_filter:
-            emby_native_params, post_filter_rules = translate_rules(adv_filter.rules)
-            new_params.update(emby_native_params)
-            logger.info(f"HOME_LATEST_HANDLER: 应用了 {len(emby_native_params)} 条原生筛选规则。")
+    if plan.native_params:
+        new_params.update(plan.native_params)
+        logger.debug("HOME_LATEST_HANDLER: 应用了 %d 条原生筛选规则。", len(plan.native_params))
     
-    is_tmdb_merge_enabled = found_vlib.merge_by_tmdb_id or config.force_merge_by_tmdb_id
-    if post_filter_rules or is_tmdb_merge_enabled:
-        fetch_limit = 200
-        client_limit = int(params.get("Limit", 20))
-        try: fetch_limit = min(max(client_limit * 10, 50), 200)
-        except (ValueError, TypeError): pass
-        new_params["Limit"] = fetch_limit
-        logger.info(f"HOME_LATEST_HANDLER: 后筛选或合并需要，已将获取限制提高到 {fetch_limit}。")
-
-    required_fields = set(["ProviderIds"])
-    if post_filter_rules:
-        for rule in post_filter_rules: required_fields.add(rule.field.split('.')[0])
-    if required_fields:
-        current_fields = set(new_params.get("Fields", "").split(','))
-        current_fields.discard('')
-        current_fields.update(required_fields)
-        new_params["Fields"] = ",".join(sorted(list(current_fields)))
-
-    resource_map = {"collection": "CollectionIds", "tag": "TagIds", "person": "PersonIds", "genre": "GenreIds", "studio": "StudioIds"}
-    if found_vlib.resource_type in resource_map:
-        new_params[resource_map[found_vlib.resource_type]] = found_vlib.resource_id
+    is_tmdb_merge_enabled = plan.is_merge_enabled
+
+    current_fields = set(new_params.get("Fields", "").split(','))
+    current_fields.discard('')
+    current_fields.update(plan.latest_fields)
+    new_params["Fields"] = ",".join(sorted(current_fields))
+
+    if plan.resource_param:
+        resource_key, resource_value = plan.resource_param
+        new_params[resource_key] = resource_value
     elif found_vlib.resource_type == 'all':
         # For 'all' type, we don't add any specific resource filter,
         # which means it will fetch from all libraries.
@@ -172,20 +160,36 @@ async def handle_home_latest_items(
     }
     
     target_url = f"{real_emby_url}/emby/Users/{user_id}/Items"
-    logger.debug(f"HOME_LATEST_HANDLER: Forwarding to URL={target_url}, Params={new_params}")
+
+    # 否定规则与虚拟库分页使用同样的执行方式 (原生排除或代理端按 ID 减去)，主页行与库内容保持一致
+    post_filter, _, _ = await apply_exclusions(
+        session, target_url, new_params, headers_to_forward, config, plan,
+        library_id=found_vlib.id, user_id=user_id
+    )
+
+    if post_filter or is_tmdb_merge_enabled:
+        fetch_limit = 200
+        client_limit = int(params.get("Limit", 20))
+        try: fetch_limit = min(max(client_limit * 10, 50), 200)
+        except (ValueError, TypeError): pass
+        new_params["Limit"] = fetch_limit
+        logger.debug("HOME_LATEST_HANDLER: 后筛选或合并需要，已将获取限制提高到 %d。", fetch_limit)
+
+    logger.debug("HOME_LATEST_HANDLER: Forwarding to URL=%s, Params=%s", target_url, new_params)
 
     async with session.get(target_url, params=new_params, headers=headers_to_forward) as resp:
         if resp.status != 200 or "application/json" not in resp.headers.get("Content-Type", ""):
             content = await resp.read(); return Response(content=content, status_code=resp.status, headers={"Content-Type": resp.headers.get("Content-Type")})
 
-        data = await resp.json()
+        data = await json_codec.read_json(resp)
         items_list = data.get("Items", [])
 
-        if post_filter_rules:
-            items_list = _apply_post_filter(items_list, post_filter_rules)
+        if post_filter:
+            items_list = post_filter(items_list)
 
         if is_tmdb_merge_enabled:
-            items_list = await handler_merger.merge_items_by_tmdb(items_list)
+            with span("merge"):
+                items_list = await handler_merger.merge_items_by_tmdb(items_list)
 
         client_limit_str = params.get("Limit")
         if client_limit_str:
@@ -196,7 +200,8 @@ async def handle_home_latest_items(
         
         # 关键修复：/Items/Latest 端点需要直接返回一个 JSON 数组，而不是一个包含 "Items" 键的对象。
         # 这与 Go 版本的实现保持一致。
-        content = json.dumps(items_list).encode('utf-8')
+        with span("serialize"):
+            content = json_codec.dumps(items_list)
         return Response(content=content, status_code=200, headers={"Content-Type": "application/json"})
 
     return None
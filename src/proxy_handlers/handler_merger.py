@@ -19,7 +19,7 @@ async def merge_items_by_tmdb(items: List[Dict]) -> List[Dict]:
     if not items:
         return []
 
-    logger.info(f"开始执行TMDB ID合并，原始项目数量: {len(items)}")
+    logger.debug("开始执行TMDB ID合并，原始项目数量: %d", len(items))
     
     tmdb_map: Dict[str, Dict] = {}
     final_items: List[Dict] = []
@@ -43,12 +43,12 @@ async def merge_items_by_tmdb(items: List[Dict]) -> List[Dict]:
                 tmdb_map[tmdb_id] = item
                 final_items.append(item)
             else:
-                logger.debug(f"合并项目 '{item.get('Name')}' (ID: {item.get('Id')})，因为它与已有项目共享 TMDB ID: {tmdb_id}")
+                logger.debug("合并项目 '%s' (ID: %s)，因为它与已有项目共享 TMDB ID: %s", item.get('Name'), item.get('Id'), tmdb_id)
         else:
             final_items.append(item)
             
     merged_count = len(items) - len(final_items)
     if merged_count > 0:
-        logger.info(f"TMDB ID 合并完成。{merged_count} 个项目被合并。最终项目数量: {len(final_items)}")
+        logger.debug("TMDB ID 合并完成。%d 个项目被合并。最终项目数量: %d", merged_count, len(final_items))
         
     return final_items
\ No newline at end of file
@@ -1,7 +1,7 @@
 from db_manager import DBManager
 from pathlib import Path
 import requests
-import json
+import json_codec
 import config_manager
 
 DB_DIR = Path(__file__).parent.parent.parent / "config"
@@ -12,7 +12,7 @@ class RssHandler:
     def __init__(self):
         self.rss_library_db = DBManager(RSS_LIBRARY_DB)
         self.tmdb_cache_db = DBManager(TMDB_CACHE_DB)
-        self.config = config_manager.load_config()
+        self.config = config_manager.get_config()
 
     async def handle(self, request_path: str, vlib_id: str, request_params, user_id: str, session, real_emby_url: str, request_headers):
         all_items_from_db = self.rss_library_db.fetchall(
@@ -67,7 +67,7 @@ class RssHandler:
         try:
             async with session.get(url, params=params, headers=headers) as resp:
                 if resp.status == 200:
-                    return (await resp.json()).get("Items", [])
+                    return (await json_codec.read_json(resp)).get("Items", [])
                 return []
         except Exception as e:
             print(f"通过 ID 查询 Emby 项目失败 (async): {e}")
@@ -77,7 +77,7 @@ class RssHandler:
         cached = self.tmdb_cache_db.fetchone("SELECT data FROM tmdb_cache WHERE tmdb_id = ? AND media_type = ?", (tmdb_id, media_type))
         if cached:
             # 关键：即使是从缓存加载，也要用最新的真实 ServerId 覆盖
-            cached_data = json.loads(cached['data'])
+            cached_data = json_codec.loads(cached['data'])
             cached_data["ServerId"] = server_id
             return cached_data
 
@@ -90,13 +90,13 @@ class RssHandler:
         try:
             response = requests.get(url, proxies=proxies, timeout=10)
             response.raise_for_status()
-            data = response.json()
+            data = json_codec.loads(response.content)
             
             emby_item = self._format_tmdb_to_emby(data, media_type, tmdb_id, server_id) # 传递 server_id
             
             self.tmdb_cache_db.execute(
                 "INSERT OR REPLACE INTO tmdb_cache (tmdb_id, media_type, data) VALUES (?, ?, ?)",
-                (tmdb_id, media_type, json.dumps(emby_item, ensure_ascii=False)),
+                (tmdb_id, media_type, json_codec.dumps_str(emby_item)),
                 commit=True
             )
             return emby_item
@@ -1,11 +1,12 @@
 # src/proxy_handlers/handler_seasons.py (修改后)
 
 import asyncio
-import json
+import json_codec
 import logging
 import re
 from fastapi import Request, Response
 from aiohttp import ClientSession
+from logging_setup import sample
 from ._find_helper import find_all_series_by_tmdb_id, is_item_in_a_merge_enabled_vlib # <-- 导入新函数
 
 logger = logging.getLogger(__name__)
@@ -17,7 +18,7 @@ async def handle_seasons_merge(request: Request, full_path: str, session: Client
     if not match: return None
 
     representative_id = match.group(1)
-    logger.info(f"SEASONS_HANDLER: 拦截到对剧集 {representative_id} 的“季”请求。")
+    logger.info("SEASONS_HANDLER: 拦截到对剧集 %s 的“季”请求。", representative_id, extra=sample("seasons"))
 
     params = request.query_params
     user_id = params.get("UserId")
@@ -40,22 +41,22 @@ async def handle_seasons_merge(request: Request, full_path: str, session: Client
         item_url = f"{real_emby_url}/emby/Users/{user_id}/Items/{representative_id}"
         item_params = {'Fields': 'ProviderIds', **auth_token_param}
         async with session.get(item_url, params=item_params, headers=headers) as resp:
-            tmdb_id = (await resp.json()).get("ProviderIds", {}).get("Tmdb")
+            tmdb_id = (await json_codec.read_json(resp)).get("ProviderIds", {}).get("Tmdb")
     except Exception as e:
         logger.error(f"SEASONS_HANDLER: 获取TMDB ID失败: {e}"); return None
 
     if not tmdb_id: return None
-    logger.info(f"SEASONS_HANDLER: 找到TMDB ID: {tmdb_id}。")
+    logger.debug("SEASONS_HANDLER: 找到TMDB ID: %s。", tmdb_id)
 
-    original_series_ids = await find_all_series_by_tmdb_id(session, real_emby_url, user_id, tmdb_id, headers, auth_token_param)
+    original_series_ids = await find_all_series_by_tmdb_id(session, real_emby_url, user_id, tmdb_id, headers, auth_token_param, expected_id=representative_id)
     if len(original_series_ids) < 2: return None
-    logger.info(f"SEASONS_HANDLER: ✅ 找到 {len(original_series_ids)} 个关联剧集: {original_series_ids}。")
+    logger.debug("SEASONS_HANDLER: ✅ 找到 %d 个关联剧集: %s。", len(original_series_ids), original_series_ids)
 
     async def fetch_seasons(series_id: str):
         url = f"{real_emby_url}/emby/Shows/{series_id}/Seasons"
         try:
             async with session.get(url, params=params, headers=headers) as resp:
-                return (await resp.json()).get("Items", []) if resp.status == 200 else []
+                return (await json_codec.read_json(resp)).get("Items", []) if resp.status == 200 else []
         except Exception: return []
 
     tasks = [fetch_seasons(sid) for sid in original_series_ids]
@@ -68,6 +69,6 @@ async def handle_seasons_merge(request: Request, full_path: str, session: Client
             merged_seasons[key] = season
     
     final_items = sorted(merged_seasons.values(), key=lambda x: x.get("IndexNumber", 0))
-    logger.info(f"SEASONS_HANDLER: 合并完成。合并前总数: {len(all_seasons)}, 合并后最终数量: {len(final_items)}")
+    logger.debug("SEASONS_HANDLER: 合并完成。合并前总数: %d, 合并后最终数量: %d", len(all_seasons), len(final_items))
 
-    return Response(content=json.dumps({"Items": final_items, "TotalRecordCount": len(final_items)}), status_code=200, media_type="application/json")
+    return Response(content=json_codec.dumps({"Items": final_items, "TotalRecordCount": len(final_items)}), status_code=200, media_type="application/json")
@@ -3,6 +3,7 @@ import json
 import logging
 from fastapi import Request, Response
 from aiohttp import ClientSession
+from logging_setup import sample
 
 logger = logging.getLogger(__name__)
 
@@ -21,11 +22,11 @@ async def handle_system_and_playback_info(
     target_url = f"{real_emby_url}/{full_path}"
     headers = dict(request.headers)
     params = request.query_params
-    data = await request.body()
+    # 注意：不要在这里读取请求体，否则每个上传/POST 都会被整体缓冲到内存中
     
     # 关键功能 1: 欺骗客户端，使其始终通过代理通信
     if ("/System/Info" in full_path or "/system/info/public" in full_path) and method == "GET":
-        logger.info(f"Intercepting /System/Info to rewrite URLs for path: {full_path}")
+        logger.info("Intercepting /System/Info to rewrite URLs for path: %s", full_path, extra=sample("system_info"))
         async with session.get(target_url, params=params, headers=headers) as resp:
             if resp.status == 200:
                 content_text = await resp.text()
@@ -39,6 +40,7 @@ async def handle_system_and_playback_info(
     # 关键功能 2: 重写播放信息中的地址 (已禁用)
     # if "/PlaybackInfo" in full_path:
     #     logger.info(f"Intercepting /PlaybackInfo to rewrite stream URLs for path: {full_path}")
+    #     data = await request.body()
     #     async with session.request(method, target_url, params=params, headers=headers, data=data) as resp:
     #         if resp.status == 200 and "application/json" in resp.headers.get("Content-Type", ""):
     #             content_json = await resp.json()
@@ -1,12 +1,14 @@
 # src/proxy_handlers/handler_views.py
 
-import json
+import json_codec
 import logging
 from fastapi import Request, Response
 from aiohttp import ClientSession
 from models import AppConfig
 import asyncio
 from pathlib import Path
+from logging_setup import sample
+from request_timing import span
 
 # 【新增】导入后台生成处理器和任务锁
 from . import handler_autogen
@@ -31,7 +33,7 @@ async def handle_view_injection(
         # 旧版逻辑可以保持原样，或者也进行相应修改，但我们主要关注新版
         return await legacy_handle_view_injection(request, full_path, method, real_emby_url, session, config)
 
-    logger.info(f"Full layout control enabled. Intercepting views for path: {full_path}")
+    logger.info("Full layout control enabled. Intercepting views for path: %s", full_path, extra=sample("views"))
     
     target_url = f"{real_emby_url}/{full_path}"
     params = request.query_params
@@ -51,7 +53,7 @@ async def handle_view_injection(
         if resp.status != 200 or "application/json" not in resp.headers.get("Content-Type", ""):
             return None
 
-        original_data = await resp.json()
+        original_data = await json_codec.read_json(resp)
         
         all_available_libs = {item["Id"]: item for item in original_data.get("Items", [])}
         
@@ -104,7 +106,8 @@ async def handle_view_injection(
         original_data["Items"] = sorted_items
         original_data["TotalRecordCount"] = len(sorted_items)
         
-        final_content = json.dumps(original_data).encode('utf-8')
+        with span("serialize"):
+            final_content = json_codec.dumps(original_data)
         return Response(content=final_content, status_code=200, media_type="application/json")
 
 
@@ -125,7 +128,7 @@ async def legacy_handle_view_injection(request: Request, full_path: str, method:
     
     async with session.get(target_url, params=params, headers=headers_to_forward) as resp:
         if resp.status == 200 and "application/json" in resp.headers.get("Content-Type", ""):
-            content_json = await resp.json()
+            content_json = await json_codec.read_json(resp)
             if content_json.get("Items"):
                 if config.hide:
                     content_json["Items"] = [item for item in content_json["Items"] if item.get("CollectionType") not in config.hide]
@@ -141,6 +144,6 @@ async def legacy_handle_view_injection(request: Request, full_path: str, method:
                             "Type": "CollectionFolder", "CollectionType": "tvshows", 
                             "IsFolder": True, "ImageTags": {}
                         })
-                final_content = json.dumps(content_json).encode('utf-8')
+                final_content = json_codec.dumps(content_json)
                 return Response(content=final_content, status_code=200, media_type="application/json")
     return None
@@ -1,8 +1,10 @@
 # src/proxy_handlers/handler_virtual_items.py (新文件)
 import logging
-import json
+import json_codec
 from fastapi import Request, Response
 from models import AppConfig
+from logging_setup import sample
+from ._query_plan import get_plan
 
 logger = logging.getLogger(__name__)
 
@@ -19,13 +21,14 @@ async def handle_get_virtual_item_info(request: Request, full_path: str, config:
     vlib_id_from_path = path_parts[3]
     
     # 在配置中查找这个ID对应的虚拟库
-    found_vlib = next((vlib for vlib in config.virtual_libraries if vlib.id == vlib_id_from_path), None)
+    plan = get_plan(config, vlib_id_from_path)
+    found_vlib = plan.vlib if plan else None
 
     # 如果没找到，或者这个虚拟库没有设置 image_tag，则不处理
     if not found_vlib or not found_vlib.image_tag:
         return None
 
-    logger.info(f"✅ VLIB_ITEM_INFO: Intercepting request for virtual library '{found_vlib.name}' info.")
+    logger.info("✅ VLIB_ITEM_INFO: Intercepting request for virtual library '%s' info.", found_vlib.name, extra=sample("virtual_item"))
 
     # 获取 ServerId 以便伪造响应 (从任意一个真实库中获取)
     # 注意: 这需要 config.display_order 至少包含一个真实库ID，如果全是虚拟库可能会出问题
@@ -57,4 +60,4 @@ async def handle_get_virtual_item_info(request: Request, full_path: str, config:
     }
     
     # 返回伪造的 JSON 响应
-    return Response(content=json.dumps(fake_item_data), status_code=200, media_type="application/json")
\ No newline at end of file
+    return Response(content=json_codec.dumps(fake_item_data), status_code=200, media_type="application/json")
\ No newline at end of file
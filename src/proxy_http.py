@@ -0,0 +1,174 @@
+# src/proxy_http.py
+
+import gzip
+import asyncio
+import hashlib
+from typing import Dict, Iterable, Optional
+
+from fastapi import Request, Response
+
+from request_timing import span
+
+# Brotli 是可选依赖：未安装时只提供 gzip
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# 小于此大小的响应不压缩，压缩收益抵不过开销
+MIN_COMPRESS_SIZE = 1024
+# 大于此大小的响应放到线程池中压缩，避免阻塞事件循环
+THREAD_COMPRESS_SIZE = 256 * 1024
+
+# 按优先级排列的支持的编码
+SUPPORTED_ENCODINGS = ("br", "gzip") if brotli else ("gzip",)
+
+# 缓存条目只压缩一次，使用较高的压缩级别；未缓存的响应每次都要压缩，使用较低的级别
+CACHE_LEVELS = {"br": 5, "gzip": 6}
+ONTHEFLY_LEVELS = {"br": 3, "gzip": 4}
+
+# 这些响应头描述的是原始响应体，换成压缩变体后必须重新生成
+_REPRESENTATION_HEADERS = ("content-length", "content-encoding", "etag")
+
+
+def compute_etag(body: bytes) -> str:
+    """为响应体计算强 ETag。"""
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: Optional[str]) -> bool:
+    """按 RFC 9110 对 If-None-Match 做弱比较（忽略 W/ 前缀）。"""
+    if not if_none_match or not etag:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = (tag.strip() for tag in if_none_match.split(","))
+    return any((tag[2:] if tag.startswith("W/") else tag) == etag for tag in candidates)
+
+
+def with_etag(body: bytes, headers: Dict[str, str]) -> Dict[str, str]:
+    """返回附带 ETag 的响应头副本；已有 ETag 时保持不变。"""
+    if any(k.lower() == "etag" for k in headers):
+        return headers
+    return {**headers, "ETag": compute_etag(body)}
+
+
+def _get_header(headers: Dict[str, str], name: str) -> Optional[str]:
+    for k, v in headers.items():
+        if k.lower() == name:
+            return v
+    return None
+
+
+def _with_vary(headers: Dict[str, str]) -> Dict[str, str]:
+    """返回 Vary 中包含 Accept-Encoding 的响应头副本 (保留已有的 Vary 字段)。"""
+    vary = _get_header(headers, "vary")
+    if vary and ("*" in vary or "accept-encoding" in vary.lower()):
+        return headers
+    rest = {k: v for k, v in headers.items() if k.lower() != "vary"}
+    rest["Vary"] = f"{vary}, Accept-Encoding" if vary else "Accept-Encoding"
+    return rest
+
+
+def _compress(body: bytes, encoding: str, level: int) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=level)
+    return gzip.compress(body, compresslevel=level, mtime=0)
+
+
+def compress_variants(body: bytes, encodings: Iterable[str] = SUPPORTED_ENCODINGS) -> Dict[str, bytes]:
+    """为缓存条目一次性生成所有压缩变体；压缩后没有变小的变体会被丢弃。"""
+    if len(body) < MIN_COMPRESS_SIZE:
+        return {}
+    variants = {}
+    for encoding in encodings:
+        data = _compress(body, encoding, CACHE_LEVELS[encoding])
+        if len(data) < len(body):
+            variants[encoding] = data
+    return variants
+
+
+async def compress_variants_async(body: bytes) -> Dict[str, bytes]:
+    with span("compress"):
+        if len(body) >= THREAD_COMPRESS_SIZE:
+            return await asyncio.to_thread(compress_variants, body)
+        return compress_variants(body)
+
+
+def choose_encoding(accept_encoding: Optional[str], available: Iterable[str]) -> Optional[str]:
+    """
+    根据客户端的 Accept-Encoding 从可用编码中选出一个。
+    同等 q 值下按 SUPPORTED_ENCODINGS 的顺序优先 (br 优先于 gzip)；q=0 表示明确拒绝。
+    """
+    if not accept_encoding:
+        return None
+    weights: Dict[str, float] = {}
+    for token in accept_encoding.split(","):
+        parts = token.strip().split(";")
+        name = parts[0].strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for param in parts[1:]:
+            key, _, value = param.strip().partition("=")
+            if key.strip() == "q":
+                try: q = float(value)
+                except ValueError: q = 0.0
+        weights[name] = q
+
+    best, best_q = None, 0.0
+    for encoding in SUPPORTED_ENCODINGS:
+        if encoding not in available:
+            continue
+        q = weights.get(encoding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+async def build_json_response(
+    request: Request, body: bytes, status: int, headers: Dict[str, str],
+    variants: Optional[Dict[str, bytes]] = None
+) -> Response:
+    """
+    用（可能来自缓存的）响应体构造最终响应：
+    - 按 Accept-Encoding 选择预先压缩好的变体；没有预压缩变体的大响应现场压缩一次；
+    - 客户端携带的 If-None-Match 与所选表示的 ETag 一致时直接返回 304，不再发送响应体。
+    只要响应存在多种编码的表示 (有压缩变体，或足够大会被现场压缩)，无论最终选了哪一种都带上 Vary: Accept-Encoding，
+    否则共享缓存可能把未压缩的表示发给所有客户端。
+    """
+    etag = _get_header(headers, "etag")
+    accept_encoding = request.headers.get("accept-encoding")
+    encoding = None
+    payload = body
+    negotiable = status == 200 and (bool(variants) or (variants is None and len(body) >= MIN_COMPRESS_SIZE))
+
+    if status == 200:
+        if variants:
+            encoding = choose_encoding(accept_encoding, variants.keys())
+            if encoding:
+                payload = variants[encoding]
+        elif variants is None and len(body) >= MIN_COMPRESS_SIZE:
+            encoding = choose_encoding(accept_encoding, SUPPORTED_ENCODINGS)
+            if encoding:
+                compress = lambda: _compress(body, encoding, ONTHEFLY_LEVELS[encoding])
+                with span("compress"):
+                    payload = await asyncio.to_thread(compress) if len(body) >= THREAD_COMPRESS_SIZE else compress()
+
+    if encoding:
+        # 不同编码是不同的表示，强 ETag 必须区分
+        if etag:
+            etag = etag[:-1] + f"-{encoding}" + '"'
+        response_headers = _with_vary({k: v for k, v in headers.items() if k.lower() not in _REPRESENTATION_HEADERS})
+        response_headers["Content-Encoding"] = encoding
+        if etag:
+            response_headers["ETag"] = etag
+    else:
+        response_headers = _with_vary(headers) if negotiable else headers
+
+    if status == 200 and etag_matches(request.headers.get("if-none-match"), etag):
+        not_modified_headers = {"ETag": etag}
+        if negotiable:
+            not_modified_headers["Vary"] = "Accept-Encoding"
+        return Response(status_code=304, headers=not_modified_headers)
+    return Response(content=payload, status_code=status, headers=response_headers)
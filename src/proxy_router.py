@@ -0,0 +1,226 @@
+# src/proxy_router.py
+
+import re
+import time
+import logging
+from collections import Counter
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from aiohttp import ClientSession
+from fastapi import Request, Response
+
+from models import AppConfig
+from metrics import HANDLER_LATENCY
+from proxy_cache import cache_policy_for
+from request_timing import record
+from proxy_handlers._query_plan import get_plans
+from proxy_handlers import (
+    handler_system,
+    handler_views,
+    handler_items,
+    handler_seasons,
+    handler_episodes,
+    handler_default,
+    handler_latest,
+    handler_images,
+    handler_virtual_items
+)
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class RequestContext:
+    """一次代理请求在各处理器之间共享的上下文。"""
+    request: Request
+    full_path: str
+    method: str
+    real_emby_url: str
+    proxy_address: str
+    session: ClientSession
+    config: AppConfig
+
+
+HandlerFunc = Callable[[RequestContext], Awaitable[Optional[Response]]]
+
+
+@dataclass(frozen=True)
+class Route:
+    """
+    路由分类结果。
+    - name:     路由名称，用于统计。
+    - handlers: 按顺序尝试的处理器；全部返回 None 时由默认转发器兜底。
+    """
+    name: str
+    handlers: Tuple[Tuple[str, HandlerFunc], ...]
+
+
+# --- 处理器适配层：统一为 handler(ctx) 的调用形式 ---
+async def _images(ctx: RequestContext):
+    return await handler_images.handle_virtual_library_image(ctx.request, ctx.full_path)
+
+async def _virtual_item(ctx: RequestContext):
+    return await handler_virtual_items.handle_get_virtual_item_info(ctx.request, ctx.full_path, ctx.config)
+
+async def _latest(ctx: RequestContext):
+    return await handler_latest.handle_home_latest_items(ctx.request, ctx.full_path, ctx.method, ctx.real_emby_url, ctx.session, ctx.config)
+
+async def _system(ctx: RequestContext):
+    return await handler_system.handle_system_and_playback_info(ctx.request, ctx.full_path, ctx.method, ctx.real_emby_url, ctx.proxy_address, ctx.session)
+
+async def _episodes(ctx: RequestContext):
+    return await handler_episodes.handle_episodes_merge(ctx.request, ctx.full_path, ctx.session, ctx.real_emby_url)
+
+async def _seasons(ctx: RequestContext):
+    return await handler_seasons.handle_seasons_merge(ctx.request, ctx.full_path, ctx.session, ctx.real_emby_url)
+
+async def _vlib_items(ctx: RequestContext):
+    return await handler_items.handle_virtual_library_items(ctx.request, ctx.full_path, ctx.method, ctx.real_emby_url, ctx.session, ctx.config)
+
+async def _views(ctx: RequestContext):
+    return await handler_views.handle_view_injection(ctx.request, ctx.full_path, ctx.method, ctx.real_emby_url, ctx.session, ctx.config)
+
+async def _passthrough(ctx: RequestContext):
+    # 单项目详情的小 JSON 响应读完整后返回，才能按 item_detail 策略缓存；其余请求保持流式转发
+    buffer_json = (
+        ctx.method == "GET" and ctx.config.enable_cache
+        and cache_policy_for("passthrough", ctx.full_path, ctx.request.query_params) == "item_detail"
+    )
+    return await handler_default.forward_request(ctx.request, ctx.full_path, ctx.method, ctx.real_emby_url, ctx.session, buffer_json=buffer_json)
+
+
+# 路由名称 -> 处理器模块名，用作延迟指标的标签
+HANDLER_MODULES = {
+    "image": "handler_images",
+    "virtual_item": "handler_virtual_items",
+    "latest": "handler_latest",
+    "system_info": "handler_system",
+    "episodes": "handler_episodes",
+    "seasons": "handler_seasons",
+    "vlib_items": "handler_items",
+    "views": "handler_views",
+    "passthrough": "handler_default",
+}
+
+
+class ProxyRouter:
+    """
+    预编译的路由表。启动时构建一次，对每个请求只解析一遍路径，
+    直接选出可能处理它的处理器，而不是让九个处理器依次重新解析路径。
+
+    分类规则与原先的处理器瀑布保持一致：每个处理器的前置条件都在这里集中判断，
+    不满足前置条件的处理器不会被调用，因此请求体只有在真正需要时才会被读取。
+    """
+
+    def __init__(self):
+        self.image_regex = handler_images.IMAGE_PATH_REGEX
+        self.episodes_regex = handler_episodes.EPISODES_PATH_REGEX
+        self.seasons_regex = handler_seasons.SEASONS_PATH_REGEX
+        self.items_excluded = re.compile(r"/Items/(?:Prefixes|Counts|Latest)")
+
+        self.handlers: Dict[str, HandlerFunc] = {
+            "image": _images,
+            "virtual_item": _virtual_item,
+            "latest": _latest,
+            "system_info": _system,
+            "episodes": _episodes,
+            "seasons": _seasons,
+            "vlib_items": _vlib_items,
+            "views": _views,
+        }
+        self.fallback: HandlerFunc = _passthrough
+        self._routes: Dict[Tuple[str, ...], Route] = {}
+
+        self.dispatch_counts: Counter = Counter()
+        self.fallthrough_counts: Counter = Counter()
+
+    def _route_for(self, names: Tuple[str, ...]) -> Route:
+        route = self._routes.get(names)
+        if route is None:
+            route = Route(
+                name=names[0] if names else "passthrough",
+                handlers=tuple((name, self.handlers[name]) for name in names)
+            )
+            self._routes[names] = route
+        return route
+
+    def classify(self, method: str, full_path: str, params, config: AppConfig) -> Route:
+        """单次遍历，按原处理器顺序收集所有前置条件成立的处理器。"""
+        names = []
+        slashed_path = f"/{full_path}"
+        is_get = method == "GET"
+        plans = get_plans(config)
+        parts = full_path.split('/')
+        parent_id = params.get("ParentId")
+
+        # 1. 虚拟库封面 / 占位图
+        if "/Images/" in slashed_path:
+            match = self.image_regex.search(slashed_path)
+            if match and match.group(2) == "Primary":
+                names.append("image")
+
+        # 2. 虚拟库自身的详情 (/Users/{uid}/Items/{vlib_id})
+        if len(parts) == 4 and parts[0] == "Users" and parts[2] == "Items":
+            plan = plans.get(parts[3])
+            if plan and plan.vlib.image_tag:
+                names.append("virtual_item")
+
+        # 3. 首页“最新项目”
+        if is_get and "/Items/Latest" in full_path and parent_id in plans:
+            names.append("latest")
+
+        # 4. /System/Info 地址改写
+        if is_get and ("/System/Info" in full_path or "/system/info/public" in full_path):
+            names.append("system_info")
+
+        # 5/6. 剧集合并
+        if "/Shows/" in slashed_path:
+            if params.get("SeasonId") and self.episodes_regex.search(slashed_path):
+                names.append("episodes")
+            if self.seasons_regex.search(slashed_path):
+                names.append("seasons")
+
+        # 7. 虚拟库项目列表
+        if plans and not self.items_excluded.search(full_path):
+            is_vlib_request = parent_id in plans
+            if not is_vlib_request and is_get and 'Items' in full_path:
+                try:
+                    items_index = parts.index('Items')
+                    if items_index + 1 < len(parts):
+                        is_vlib_request = parts[items_index + 1] in plans
+                except ValueError:
+                    pass
+            if is_vlib_request:
+                names.append("vlib_items")
+
+        # 8. 主页视图注入
+        if is_get and "Users" in full_path and "/Views" in full_path:
+            names.append("views")
+
+        return self._route_for(tuple(names))
+
+    async def dispatch(self, route: Route, ctx: RequestContext) -> Response:
+        self.dispatch_counts[route.name] += 1
+        for name, handler in route.handlers:
+            start = time.perf_counter()
+            response = await handler(ctx)
+            elapsed = time.perf_counter() - start
+            HANDLER_LATENCY.observe(elapsed, handler=HANDLER_MODULES[name])
+            record("dispatch", elapsed)
+            if response is not None:
+                return response
+        if route.handlers:
+            self.fallthrough_counts[route.name] += 1
+        start = time.perf_counter()
+        response = await self.fallback(ctx)
+        elapsed = time.perf_counter() - start
+        HANDLER_LATENCY.observe(elapsed, handler=HANDLER_MODULES["passthrough"])
+        record("dispatch", elapsed)
+        return response
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {
+            "dispatched": dict(self.dispatch_counts),
+            "fell_through": dict(self.fallthrough_counts),
+        }
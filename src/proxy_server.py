@@ -1,52 +1,80 @@
 # src/proxy_server.py (最终修复版)
 
+import os
 import asyncio
 import logging
 from contextlib import asynccontextmanager
 import aiohttp
 # 【【【 修改这一行 】】】
 from fastapi import FastAPI, Request, Response, WebSocket, WebSocketDisconnect, HTTPException
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi.responses import StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from pathlib import Path
-from typing import Tuple, Dict
+from typing import Tuple, Dict, Optional
+from urllib.parse import urlencode
+from pydantic import BaseModel
 
 # 【【【 同时修改这一行，从 proxy_cache 导入两个缓存实例 】】】
-from proxy_cache import api_cache, vlib_items_cache
+from proxy_cache import api_cache, vlib_items_cache, get_vlib_items, query_cursors, merge_eligibility, cache_policy_for, request_coalescer, invalidate_for_config_change, cache_invalidation_broadcast
 import config_manager
-from proxy_handlers import (
-    handler_system, 
-    handler_views, 
-    handler_items,
-    handler_seasons,
-    handler_episodes,
-    handler_default,
-    handler_latest,
-    handler_images,
-    handler_virtual_items
-)
-
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+import logging_setup
+import metrics
+import request_timing
+import upstream_pool
+from proxy_router import ProxyRouter, RequestContext
+from proxy_handlers._page_filler import all_filter_stats
+from proxy_http import build_json_response, with_etag, compress_variants_async
+from json_codec import JSONResponse
+
+# 日志经由队列在后台线程输出，级别跟随 config.log_level
+_startup_config = config_manager.get_config()
+logging_setup.setup_logging(_startup_config.log_level, sample_every=_startup_config.log_sample_every)
+config_manager.add_config_listener(logging_setup.apply_config)
 logger = logging.getLogger(__name__)
 
-def get_cache_key(request: Request, full_path: str) -> str:
-    if request.method != "GET": return None
-    params = dict(request.query_params); params.pop("X-Emby-Token", None); params.pop("api_key", None)
-    sorted_params = tuple(sorted(params.items())); user_id_from_path = "public"
+def get_cache_user_id(request: Request, full_path: str) -> str:
+    user_id_from_path = "public"
     if "/Users/" in full_path:
         try: parts = full_path.split("/"); user_id_from_path = parts[parts.index("Users") + 1]
         except (ValueError, IndexError): pass
-    user_id = params.get("UserId", user_id_from_path)
+    return request.query_params.get("UserId", user_id_from_path)
+
+def get_cache_key(request: Request, full_path: str) -> str:
+    if request.method != "GET": return None
+    params = dict(request.query_params); params.pop("X-Emby-Token", None); params.pop("api_key", None)
+    sorted_params = tuple(sorted(params.items()))
+    user_id = get_cache_user_id(request, full_path)
     return f"user:{user_id}:path:{full_path}:params:{sorted_params}"
 
+_last_seen_config = None
+
+def apply_cache_config(config):
+    """配置变化时调整缓存容量，并只淘汰受这次变化影响的缓存条目。"""
+    global _last_seen_config
+    api_cache.configure(max_bytes=config.cache_max_mb * 1024 * 1024, route_ttls=config.cache_route_ttls)
+    removed = invalidate_for_config_change(_last_seen_config, config)
+    if removed:
+        logger.info(f"配置已变化，淘汰了 {removed} 条受影响的缓存。")
+    _last_seen_config = config
+
+config_manager.add_config_listener(apply_cache_config)
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    app.state.aiohttp_session = aiohttp.ClientSession(cookie_jar=aiohttp.DummyCookieJar()); logger.info("Global AIOHTTP ClientSession created.")
+    apply_cache_config(config_manager.get_config())
+    # 由 main.py 以多 worker 启动时，各 worker 的缓存相互独立，显式淘汰需要广播
+    if int(os.getenv("PROXY_WORKERS", "1")) > 1:
+        cache_invalidation_broadcast.enable()
+        logger.info(f"Worker {os.getpid()} 已启用跨进程缓存淘汰同步。")
+    app.state.aiohttp_session = upstream_pool.get_session(config_manager.get_config()); logger.info("Global AIOHTTP ClientSession created.")
     yield
-    await app.state.aiohttp_session.close(); logger.info("Global AIOHTTP ClientSession closed.")
+    await upstream_pool.close_session(); logger.info("Global AIOHTTP ClientSession closed.")
 
 proxy_app = FastAPI(title="Emby Virtual Proxy - Core", lifespan=lifespan)
 
+# 路由表只在启动时构建一次
+router = ProxyRouter()
+
 covers_dir = Path("/app/config/images")
 if covers_dir.is_dir():
     proxy_app.mount("/covers", StaticFiles(directory=str(covers_dir)), name="generated_covers")
@@ -59,7 +87,8 @@ async def get_cached_items_for_admin(library_id: str):
     """
     一个内部API，专门用于给admin服务提供已缓存的虚拟库项目列表。
     """
-    cached_items = vlib_items_cache.get(library_id)
+    cached_items = get_vlib_items(library_id)
+    metrics.VLIB_ITEMS_CACHE_LOOKUPS.inc(result="hit" if cached_items else "miss")
     if not cached_items:
         logger.warning(f"Admin请求缓存，但未找到库 {library_id} 的缓存。")
         raise HTTPException(
@@ -69,11 +98,93 @@ async def get_cached_items_for_admin(library_id: str):
     
     logger.info(f"Admin成功获取到库 {library_id} 的 {len(cached_items)} 条缓存项目。")
     return JSONResponse(content={"Items": cached_items})
+
+class CacheInvalidationRequest(BaseModel):
+    user_id: Optional[str] = None
+    library_id: Optional[str] = None
+    path_prefix: Optional[str] = None
+    route: Optional[str] = None
+    all: bool = False
+
+def apply_cache_invalidation(scope: Dict) -> int:
+    """按淘汰条件淘汰本进程的缓存；空条件或 all=true 时清空全部。"""
+    if scope.get("all") or not any(scope.get(k) for k in ("user_id", "library_id", "path_prefix", "route")):
+        vlib_items_cache.clear()
+        query_cursors.invalidate()
+        merge_eligibility.invalidate()
+        return api_cache.invalidate()
+    if scope.get("library_id"):
+        vlib_items_cache.pop(scope["library_id"], None)
+        query_cursors.invalidate(scope["library_id"])
+        merge_eligibility.invalidate()
+    return api_cache.invalidate(
+        user_id=scope.get("user_id"), library_id=scope.get("library_id"),
+        path_prefix=scope.get("path_prefix"), policy=scope.get("route")
+    )
+
+@proxy_app.post("/api/internal/cache/invalidate")
+async def invalidate_cache(body: CacheInvalidationRequest):
+    """
+    一个内部API，供admin服务在修改配置后精确淘汰缓存，无需重启容器。
+    可按用户、虚拟库、路径前缀、路由组合淘汰；all=true 时清空全部缓存。
+    """
+    if not body.all and not any((body.user_id, body.library_id, body.path_prefix, body.route)):
+        raise HTTPException(status_code=400, detail="请至少指定一个淘汰条件，或设置 all=true。")
+    scope = body.model_dump(exclude_defaults=True)
+    removed = apply_cache_invalidation(scope)
+    cache_invalidation_broadcast.publish(scope)
+    logger.info(f"缓存淘汰请求 {scope}，共淘汰 {removed} 条。")
+    return JSONResponse(content={"removed": removed})
+
+@proxy_app.get("/api/internal/cache-stats")
+async def get_cache_stats():
+    """一个内部API，返回 API 响应缓存的容量与按路由统计的命中情况。"""
+    return JSONResponse(content={**api_cache.stats(), "coalescing": request_coalescer.stats()})
+
+@proxy_app.get("/api/internal/pool-stats")
+async def get_pool_stats():
+    """一个内部API，返回上游连接池的在用连接数、排队数和连接复用率。"""
+    return JSONResponse(content=upstream_pool.stats())
+
+def _collect_cache_metrics():
+    stats = api_cache.stats()
+    for route_name, route_stats in stats["routes"].items():
+        metrics.CACHE_ENTRIES.set(route_stats["entries"], route=route_name)
+        metrics.CACHE_BYTES.set(route_stats["bytes"], route=route_name)
+        metrics.CACHE_HITS.set_total(route_stats["hits"], route=route_name)
+        metrics.CACHE_MISSES.set_total(route_stats["misses"], route=route_name)
+        lookups = route_stats["hits"] + route_stats["misses"]
+        metrics.CACHE_HIT_RATIO.set(route_stats["hits"] / lookups if lookups else 0, route=route_name)
+    metrics.VLIB_ITEMS_CACHE_ENTRIES.set(len(vlib_items_cache))
+
+metrics.registry.add_collector(_collect_cache_metrics)
+
+@proxy_app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    """Prometheus 抓取端点。多 worker 部署时每次抓取只反映其中一个 worker。"""
+    return Response(content=metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
+
+@proxy_app.get("/api/internal/slow-requests")
+async def get_slow_requests():
+    """一个内部API，返回最近超过 slow_request_ms 的请求及其分阶段耗时 (最新的在前)。"""
+    return JSONResponse(content={"threshold_ms": config_manager.get_config().slow_request_ms, "requests": list(reversed(request_timing.slow_requests))})
+
+@proxy_app.get("/api/internal/filter-stats")
+async def get_filter_stats():
+    """一个内部API，返回各高级筛选器的后筛选选择率、请求耗时与执行路径统计 (本 worker)。"""
+    return JSONResponse(content=all_filter_stats())
+
+@proxy_app.get("/api/internal/route-stats")
+async def get_route_stats():
+    """一个内部API，返回各路由的分发计数。"""
+    return JSONResponse(content=router.stats())
+
 # --- 【【【 核心修复：重写 WebSocket 代理 】】】 ---
 @proxy_app.websocket("/{full_path:path}")
 async def websocket_proxy(client_ws: WebSocket, full_path: str):
     await client_ws.accept()
-    config = config_manager.load_config()
+    metrics.ACTIVE_WEBSOCKETS.inc()
+    config = config_manager.get_config()
     target_url = config.emby_url.replace("http", "ws", 1).rstrip('/') + "/" + full_path
     
     session = proxy_app.state.aiohttp_session
@@ -91,7 +202,7 @@ async def websocket_proxy(client_ws: WebSocket, full_path: str):
                 except WebSocketDisconnect:
                     logger.debug("Client WebSocket disconnected.")
                 except Exception as e:
-                    logger.debug(f"Error forwarding C->S: {e}")
+                    logger.debug("Error forwarding C->S: %s", e)
 
             async def forward_server_to_client():
                 try:
@@ -102,7 +213,7 @@ async def websocket_proxy(client_ws: WebSocket, full_path: str):
                         elif msg.type == aiohttp.WSMsgType.BINARY:
                             await client_ws.send_bytes(msg.data)
                 except Exception as e:
-                    logger.debug(f"Error forwarding S->C: {e}")
+                    logger.debug("Error forwarding S->C: %s", e)
 
             # 并发运行两个转发任务
             await asyncio.gather(forward_client_to_server(), forward_server_to_client())
@@ -110,6 +221,7 @@ async def websocket_proxy(client_ws: WebSocket, full_path: str):
     except Exception as e:
         logger.warning(f"WebSocket proxy error for path '{full_path}': {e}")
     finally:
+        metrics.ACTIVE_WEBSOCKETS.dec()
         try:
             await client_ws.close()
         except Exception:
@@ -117,51 +229,108 @@ async def websocket_proxy(client_ws: WebSocket, full_path: str):
 # --- 【【【 修复结束 】】】 ---
 
 
+def _trace_path(request: Request, full_path: str) -> str:
+    params = [(k, v) for k, v in request.query_params.multi_items() if k not in ("api_key", "X-Emby-Token")]
+    return f"/{full_path}" + (f"?{urlencode(params)}" if params else "")
+
 @proxy_app.api_route("/{full_path:path}", methods=["GET", "POST", "DELETE", "PUT"])
 async def reverse_proxy(request: Request, full_path: str):
-    config = config_manager.load_config()
+    config = config_manager.get_config()
+    trace = request_timing.start_trace(request.method, _trace_path(request, full_path))
+    response = None
+    try:
+        response = await _proxy_request(request, full_path, config, trace)
+        if config.server_timing or request.headers.get("x-server-timing"):
+            response.headers["Server-Timing"] = trace.server_timing_header()
+        return response
+    finally:
+        request_timing.finish_trace(trace, response.status_code if response is not None else None, config.slow_request_ms)
+
+
+async def _proxy_request(request: Request, full_path: str, config, trace) -> Response:
     real_emby_url = config.emby_url.rstrip('/')
+
+    for scope in cache_invalidation_broadcast.poll():
+        removed = apply_cache_invalidation(scope)
+        logger.info(f"同步其他 worker 的缓存淘汰请求 {scope}，共淘汰 {removed} 条。")
+
+    # 单次分类后只调用匹配的处理器，其余请求直接流式转发
+    with request_timing.span("classify"):
+        route = router.classify(request.method, full_path, request.query_params, config)
+    cache_policy = cache_policy_for(route.name, full_path, request.query_params)
+    trace.route = cache_policy
     
     cache_key = None
+    cache_outcome = "bypass"
     if config.enable_cache:
         cache_key = get_cache_key(request, full_path)
-        if cache_key and cache_key in api_cache:
-            cached_response_data = api_cache.get(cache_key)
+        if cache_key:
+            with request_timing.span("cache"):
+                cached_response_data = api_cache.get(cache_key, cache_policy)
             if cached_response_data:
-                content, status, headers = cached_response_data
-                logger.info(f"✅ Cache HIT for key: {cache_key}")
-                return Response(content=content, status_code=status, headers=headers)
+                content, status, headers, variants = cached_response_data
+                logger.debug("✅ Cache HIT for key: %s", cache_key)
+                metrics.REQUESTS.inc(route=cache_policy, cache="hit")
+                return await build_json_response(request, content, status, headers, variants)
+            logger.debug("❌ Cache MISS for key: %s", cache_key)
+            cache_outcome = "miss"
+
+            # 相同的请求正在处理中：等待它的结果，而不是再向 Emby 发起一次完整的处理
+            inflight = request_coalescer.join(cache_key)
+            if inflight is not None:
+                shared_response_data = await asyncio.shield(inflight)
+                if shared_response_data:
+                    content, status, headers, variants = shared_response_data
+                    logger.debug("🔗 Coalesced request for key: %s", cache_key)
+                    metrics.REQUESTS.inc(route=cache_policy, cache="coalesced")
+                    return await build_json_response(request, content, status, headers, variants)
+                # leader 的结果不可共享，自行处理 (不再参与合并)
+                cache_key = None
+
+    metrics.REQUESTS.inc(route=cache_policy, cache=cache_outcome)
+    shared_result = None
+    try:
+        response = await _dispatch(request, full_path, route, config, real_emby_url)
+
+        if response and response.status_code == 200 and not isinstance(response, StreamingResponse):
+            content_type = response.headers.get("Content-Type", "")
+            if "application/json" in content_type:
+                # For aiohttp responses, we need to read the body before caching
+                if hasattr(response, 'body'):
+                    response_body = response.body
+                else: # For regular FastAPI responses
+                    response_body = await response.body()
+
+                # ETag 只在这里计算一次，随缓存条目一起保存
+                response_headers = with_etag(response_body, dict(response.headers))
+
+                variants = None
+                if config.enable_cache and cache_key:
+                    # 压缩变体在写入缓存时一次性生成，之后的命中直接发送压缩好的字节
+                    variants = await compress_variants_async(response_body)
+                    response_to_cache: Tuple[bytes, int, Dict, Dict[str, bytes]] = (response_body, response.status_code, response_headers, variants)
+                    api_cache.set(
+                        cache_key, response_to_cache, cache_policy,
+                        user_id=get_cache_user_id(request, full_path), path=full_path,
+                        library_id=request.query_params.get("ParentId")
+                    )
+                    shared_result = response_to_cache
+                    logger.debug("📝 Cache SET for key: %s (policy: %s)", cache_key, cache_policy)
+                
+                # Since body is already read, return a new Response object
+                return await build_json_response(request, response_body, response.status_code, response_headers, variants)
+
+        return response
+    finally:
         if cache_key:
-            logger.info(f"❌ Cache MISS for key: {cache_key}")
+            request_coalescer.finish(cache_key, shared_result)
 
-    proxy_address = f"{request.url.scheme}://{request.url.netloc}"
-    session = request.app.state.aiohttp_session
-    response = None
 
-    if not response: response = await handler_images.handle_virtual_library_image(request, full_path)
-    if not response: response = await handler_virtual_items.handle_get_virtual_item_info(request, full_path, config)
-    if not response: response = await handler_latest.handle_home_latest_items(request, full_path, request.method, real_emby_url, session, config)
-    if not response: response = await handler_system.handle_system_and_playback_info(request, full_path, request.method, real_emby_url, proxy_address, session)
-    if not response: response = await handler_episodes.handle_episodes_merge(request, full_path, session, real_emby_url)
-    if not response: response = await handler_seasons.handle_seasons_merge(request, full_path, session, real_emby_url)
-    if not response: response = await handler_items.handle_virtual_library_items(request, full_path, request.method, real_emby_url, session, config)
-    if not response: response = await handler_views.handle_view_injection(request, full_path, request.method, real_emby_url, session, config)
-    if not response: response = await handler_default.forward_request(request, full_path, request.method, real_emby_url, session)
-
-    if config.enable_cache and cache_key and response and response.status_code == 200 and not isinstance(response, StreamingResponse):
-        content_type = response.headers.get("Content-Type", "")
-        if "application/json" in content_type:
-            # For aiohttp responses, we need to read the body before caching
-            if hasattr(response, 'body'):
-                response_body = response.body
-            else: # For regular FastAPI responses
-                response_body = await response.body()
-
-            response_to_cache: Tuple[bytes, int, Dict] = (response_body, response.status_code, dict(response.headers))
-            api_cache[cache_key] = response_to_cache
-            logger.info(f"📝 Cache SET for key: {cache_key}")
-            
-            # Since body is already read, return a new Response object
-            return Response(content=response_body, status_code=response.status_code, headers=response.headers)
-
-    return response
+async def _dispatch(request: Request, full_path: str, route, config, real_emby_url: str) -> Response:
+    proxy_address = f"{request.url.scheme}://{request.url.netloc}"
+    ctx = RequestContext(
+        request=request, full_path=full_path, method=request.method,
+        real_emby_url=real_emby_url, proxy_address=proxy_address,
+        session=request.app.state.aiohttp_session, config=config
+    )
+    return await router.dispatch(route, ctx)
@@ -0,0 +1,112 @@
+# src/request_timing.py
+
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Any, Deque, Dict, List, Optional
+
+# 慢请求环形缓冲区的容量
+SLOW_REQUEST_BUFFER_SIZE = 100
+
+# Server-Timing 中各阶段的固定输出顺序，未列出的阶段排在后面
+SPAN_ORDER = ("classify", "cache", "plan_compile", "dispatch", "upstream", "post_filter", "merge", "serialize", "compress")
+
+
+class RequestTrace:
+    """
+    一次请求的分阶段耗时。同名阶段累加 (例如多次上游调用)，并记录次数。
+    并发子任务 (asyncio.gather) 会继承同一个 trace，因此 upstream 等阶段的累计值可能大于墙钟时间。
+    """
+    __slots__ = ("method", "path", "route", "started", "spans")
+
+    def __init__(self, method: str, path: str):
+        self.method = method
+        self.path = path
+        self.route = None
+        self.started = time.perf_counter()
+        self.spans: Dict[str, List[float]] = {}  # name -> [总秒数, 次数]
+
+    def add(self, name: str, seconds: float):
+        span = self.spans.get(name)
+        if span is None:
+            self.spans[name] = [seconds, 1]
+        else:
+            span[0] += seconds
+            span[1] += 1
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def _ordered(self):
+        known = [name for name in SPAN_ORDER if name in self.spans]
+        return known + sorted(name for name in self.spans if name not in SPAN_ORDER)
+
+    def server_timing_header(self) -> str:
+        parts = []
+        for name in self._ordered():
+            seconds, count = self.spans[name]
+            part = f"{name};dur={seconds * 1000:.1f}"
+            if count > 1:
+                part += f';desc="{count}x"'
+            parts.append(part)
+        parts.append(f"total;dur={self.elapsed() * 1000:.1f}")
+        return ", ".join(parts)
+
+    def to_dict(self, status: Optional[int]) -> Dict[str, Any]:
+        return {
+            "time": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "method": self.method,
+            "path": self.path,
+            "route": self.route,
+            "status": status,
+            "total_ms": round(self.elapsed() * 1000, 1),
+            "spans": {name: {"ms": round(self.spans[name][0] * 1000, 1), "count": self.spans[name][1]} for name in self._ordered()},
+        }
+
+
+_current: ContextVar[Optional[RequestTrace]] = ContextVar("request_trace", default=None)
+slow_requests: Deque[Dict[str, Any]] = deque(maxlen=SLOW_REQUEST_BUFFER_SIZE)
+
+
+def start_trace(method: str, path: str) -> RequestTrace:
+    trace = RequestTrace(method, path)
+    _current.set(trace)
+    return trace
+
+
+def current_trace() -> Optional[RequestTrace]:
+    return _current.get()
+
+
+def detach_trace():
+    """在后台任务开头调用：任务复制了发起它的请求的上下文，之后的耗时不应再计入该请求。"""
+    _current.set(None)
+
+
+def record(name: str, seconds: float):
+    """向当前请求追加一段耗时；不在请求上下文中时什么也不做。"""
+    trace = _current.get()
+    if trace is not None:
+        trace.add(name, seconds)
+
+
+@contextmanager
+def span(name: str):
+    """用法: with span("merge"): ...  不在请求上下文中时几乎没有开销。"""
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, time.perf_counter() - start)
+
+
+def finish_trace(trace: RequestTrace, status: Optional[int], slow_threshold_ms: int):
+    """请求结束时调用：超过阈值的请求记入慢请求缓冲区 (阈值为 0 时不记录)。"""
+    if slow_threshold_ms > 0 and trace.elapsed() * 1000 >= slow_threshold_ms:
+        slow_requests.append(trace.to_dict(status))
@@ -8,6 +8,7 @@ from pathlib import Path
 from bs4 import BeautifulSoup
 from db_manager import DBManager, RSS_CACHE_DB, TMDB_CACHE_DB
 import config_manager
+from provider_index import provider_index
 
 logger = logging.getLogger(__name__)
 
@@ -293,6 +294,11 @@ class BaseRssProcessor:
         if not tmdb_ids_map or not self.config.emby_url or not self.config.emby_api_key:
             return {}
 
+        if self.config.provider_index_enabled:
+            provider_index.sync_from_disk()
+            if provider_index.ready:
+                return self._find_items_in_index(tmdb_ids_map)
+
         logger.info(f"将逐个查询 {len(tmdb_ids_map)} 个 TMDB ID 在 Emby 中的存在状态...")
         
         emby_id_map = {}
@@ -337,6 +343,17 @@ class BaseRssProcessor:
         logger.info(f"Emby API 查询完成，在您的库中找到了 {len(emby_id_map)} 个匹配的项目。")
         return emby_id_map
 
+    def _find_items_in_index(self, tmdb_ids_map):
+        """通过本地的外部 ID 索引查找已存在的项目 (索引在刷新 RSS 库之前已更新)"""
+        emby_id_map = {}
+        for tmdb_id, media_type in tmdb_ids_map.items():
+            item_type = {"movie": "Movie", "tv": "Series"}.get(media_type.lower())
+            found = provider_index.lookup("Tmdb", str(tmdb_id), item_type)
+            if found:
+                emby_id_map[tmdb_id] = found[0]
+        logger.info(f"外部 ID 索引查询完成，{len(tmdb_ids_map)} 个 TMDB ID 中有 {len(emby_id_map)} 个已在您的库中。")
+        return emby_id_map
+
     def _match_items_in_emby(self, tmdb_ids_map):
         """获取所有项目的 TMDB ID，查询 Emby，并更新数据库"""
         # 【核心修复】移除子类中重写的 _find_items_in_emby 方法，因为现在基类方法已足够智能
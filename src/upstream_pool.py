@@ -0,0 +1,179 @@
+# src/upstream_pool.py
+
+import asyncio
+import logging
+from collections import Counter
+from functools import lru_cache
+from types import SimpleNamespace
+from typing import Any, Dict, Optional
+from urllib.parse import urlsplit
+
+import aiohttp
+
+import config_manager
+import metrics
+import request_timing
+from models import AppConfig
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=8)
+def _host_of(url: str) -> Optional[str]:
+    return urlsplit(url).hostname
+
+
+def _upstream_name(host: Optional[str]) -> str:
+    """把上游主机归类为 emby / tmdb / other，作为指标标签。"""
+    if host and host == _host_of(config_manager.get_config().emby_url):
+        return "emby"
+    if host and "themoviedb" in host:
+        return "tmdb"
+    return "other"
+
+
+class PoolStats:
+    """通过 aiohttp 的 TraceConfig 统计连接池的使用情况。"""
+
+    def __init__(self):
+        self.counters: Counter = Counter()
+        self.queued = 0
+
+    def trace_config(self) -> aiohttp.TraceConfig:
+        trace = aiohttp.TraceConfig()
+
+        async def on_request_start(session, ctx, params):
+            self.counters["requests"] += 1
+            ctx.start = asyncio.get_running_loop().time()
+
+        async def on_request_end(session, ctx, params):
+            upstream = _upstream_name(params.url.host)
+            elapsed = asyncio.get_running_loop().time() - ctx.start
+            metrics.UPSTREAM_LATENCY.observe(elapsed, upstream=upstream)
+            request_timing.record("upstream", elapsed)
+            metrics.UPSTREAM_REQUESTS.inc(upstream=upstream, outcome="ok" if params.response.status < 500 else "error")
+
+        async def on_request_exception(session, ctx, params):
+            self.counters["errors"] += 1
+            upstream = _upstream_name(params.url.host)
+            metrics.UPSTREAM_LATENCY.observe(asyncio.get_running_loop().time() - ctx.start, upstream=upstream)
+            metrics.UPSTREAM_REQUESTS.inc(upstream=upstream, outcome="exception")
+
+        async def on_queued_start(session, ctx, params):
+            self.queued += 1
+            self.counters["queued_total"] += 1
+
+        async def on_queued_end(session, ctx, params):
+            self.queued -= 1
+
+        async def on_create_end(session, ctx, params):
+            self.counters["connections_created"] += 1
+
+        async def on_reuse(session, ctx, params):
+            self.counters["connections_reused"] += 1
+
+        async def on_dns_hit(session, ctx, params):
+            self.counters["dns_cache_hits"] += 1
+
+        async def on_dns_miss(session, ctx, params):
+            self.counters["dns_cache_misses"] += 1
+
+        trace.on_request_start.append(on_request_start)
+        trace.on_request_end.append(on_request_end)
+        trace.on_request_exception.append(on_request_exception)
+        trace.on_connection_queued_start.append(on_queued_start)
+        trace.on_connection_queued_end.append(on_queued_end)
+        trace.on_connection_create_end.append(on_create_end)
+        trace.on_connection_reuseconn.append(on_reuse)
+        trace.on_dns_cache_hit.append(on_dns_hit)
+        trace.on_dns_cache_miss.append(on_dns_miss)
+        return trace
+
+    def snapshot(self, connector: Optional[aiohttp.BaseConnector]) -> Dict[str, Any]:
+        created = self.counters["connections_created"]
+        reused = self.counters["connections_reused"]
+        acquisitions = created + reused
+        # 连接器没有公开在用/空闲连接数，读取其内部状态；aiohttp 版本不同时退化为 None
+        in_use = len(getattr(connector, "_acquired", ())) if connector else 0
+        idle_conns = getattr(connector, "_conns", None) if connector else None
+        return {
+            **self.counters,
+            "in_use": in_use,
+            "idle": sum(len(v) for v in idle_conns.values()) if idle_conns is not None else None,
+            "queued": self.queued,
+            "limit": connector.limit if connector else None,
+            "limit_per_host": connector.limit_per_host if connector else None,
+            "reuse_ratio": round(reused / acquisitions, 4) if acquisitions else None,
+        }
+
+
+def create_session(config: AppConfig, stats: Optional[PoolStats] = None) -> aiohttp.ClientSession:
+    """
+    按配置创建连接池会话。
+    total 超时默认关闭，因为视频串流可能持续数小时；
+    sock_read 只在等待上游数据时计时 (客户端未读时暂停)，因此能发现卡住的 Emby 请求而不会中断正常串流。
+    """
+    connector = aiohttp.TCPConnector(
+        limit=config.upstream_pool_limit,
+        limit_per_host=config.upstream_pool_limit_per_host,
+        keepalive_timeout=config.upstream_keepalive_timeout,
+        ttl_dns_cache=config.upstream_dns_ttl or None,
+        use_dns_cache=config.upstream_dns_ttl > 0,
+    )
+    timeout = aiohttp.ClientTimeout(
+        total=config.upstream_total_timeout or None,
+        sock_connect=config.upstream_connect_timeout or None,
+        sock_read=config.upstream_read_timeout or None,
+    )
+    return aiohttp.ClientSession(
+        connector=connector,
+        timeout=timeout,
+        cookie_jar=aiohttp.DummyCookieJar(),
+        trace_configs=[stats.trace_config()] if stats else None,
+    )
+
+
+_state = SimpleNamespace(session=None, loop=None)
+pool_stats = PoolStats()
+
+
+def get_session(config: Optional[AppConfig] = None) -> aiohttp.ClientSession:
+    """
+    返回本进程共享的上游会话，首次调用时按当前配置创建。
+    连接池参数只在创建时读取，修改后需重启服务生效。
+    """
+    loop = asyncio.get_running_loop()
+    if _state.session is None or _state.session.closed or _state.loop is not loop:
+        config = config or config_manager.get_config()
+        _state.session = create_session(config, pool_stats)
+        _state.loop = loop
+        logger.info(
+            f"上游连接池已创建: limit={config.upstream_pool_limit}, limit_per_host={config.upstream_pool_limit_per_host}, "
+            f"keepalive={config.upstream_keepalive_timeout}s, connect/read timeout={config.upstream_connect_timeout}/{config.upstream_read_timeout}s"
+        )
+    return _state.session
+
+
+async def close_session():
+    if _state.session is not None and not _state.session.closed:
+        await _state.session.close()
+        logger.info("上游连接池已关闭。")
+    _state.session = None
+    _state.loop = None
+
+
+def stats() -> Dict[str, Any]:
+    session = _state.session
+    return pool_stats.snapshot(session.connector if session is not None and not session.closed else None)
+
+
+POOL_CONNECTIONS = metrics.registry.gauge("evp_upstream_pool_connections", "Upstream pool connections by state.", ("state",))
+POOL_REUSE_RATIO = metrics.registry.gauge("evp_upstream_pool_reuse_ratio", "Share of upstream connection acquisitions served by a kept-alive connection.")
+
+def _collect_pool_metrics():
+    snapshot = stats()
+    for state in ("in_use", "idle", "queued"):
+        POOL_CONNECTIONS.set(snapshot[state] or 0, state=state)
+    POOL_REUSE_RATIO.set(snapshot["reuse_ratio"] or 0)
+
+metrics.registry.add_collector(_collect_pool_metrics)
@@ -0,0 +1,67 @@
+# tests/test_negative_filters.py
+"""
+列表字段 (Genres/Tags/Studios) 的否定规则有两种执行方式：
+按正向查询的 ID 集合排除 (exclusions + residual_filter)，以及直接求值 post_filter
+(filter_negative_pushdown 关闭、取 ID 失败或其他处理器时使用)。两者必须得到相同的结果。
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from models import AdvancedFilter, AdvancedFilterRule  # noqa: E402
+from proxy_handlers._filter_translator import plan_filter  # noqa: E402
+from proxy_handlers._exclusion import exclusion_filter  # noqa: E402
+
+ITEMS = [
+    {"Id": "1", "Name": "Alpha", "Genres": ["Anime", "Drama"], "Tags": ["T1"], "Studios": [{"Name": "Ghibli", "Id": "s1"}], "CommunityRating": 8},
+    {"Id": "2", "Name": "Beta", "Genres": ["Drama"], "Tags": ["T2"], "Studios": [{"Name": "Toei", "Id": "s2"}], "CommunityRating": 6},
+    {"Id": "3", "Name": "Gamma", "Genres": ["anime"], "Tags": [], "Studios": [], "CommunityRating": 9},
+    {"Id": "4", "Name": "Delta", "CommunityRating": 7},
+    {"Id": "5", "Name": "Epsilon", "Genres": ["Comedy"], "Tags": ["T1", "T2"], "Studios": [{"Name": "ghibli", "Id": "s3"}], "CommunityRating": 5},
+]
+
+
+def _native_ids(positive):
+    """模拟 Emby 的正向原生查询：列表字段中有任一元素 (不区分大小写) 等于参数值。"""
+    (field, value), = positive.items()
+    ids = set()
+    for item in ITEMS:
+        names = [e.get("Name") if isinstance(e, dict) else e for e in item.get(field) or []]
+        if any(str(name).lower() == value.lower() for name in names):
+            ids.add(item["Id"])
+    return frozenset(ids)
+
+
+RULE_SETS = [
+    [AdvancedFilterRule(field="Genres", operator="not_equals", value="Anime")],
+    [AdvancedFilterRule(field="Genres", operator="not_contains", value="Anime")],
+    [AdvancedFilterRule(field="Tags", operator="not_equals", value="T1")],
+    [AdvancedFilterRule(field="Studios", operator="not_contains", value="Ghibli")],
+    [AdvancedFilterRule(field="Tags", operator="not_contains", value="T2"),
+     AdvancedFilterRule(field="CommunityRating", operator="greater_than", value="5.5")],
+]
+
+
+@pytest.mark.parametrize("rules", RULE_SETS, ids=lambda rules: ",".join(f"{r.field}:{r.operator}" for r in rules))
+def test_exclusion_and_post_filter_agree(rules):
+    plan = plan_filter(AdvancedFilter(id="f", name="f", rules=rules))
+    assert plan.exclusions and plan.post_filter is not None
+
+    ids = frozenset().union(*(_native_ids(positive) for positive in plan.exclusions))
+    via_exclusion = [item["Id"] for item in exclusion_filter(ids, plan.residual_filter)(ITEMS)]
+    via_post_filter = [item["Id"] for item in plan.post_filter(ITEMS)]
+
+    assert via_post_filter == via_exclusion
+    assert via_post_filter  # 否定规则不应把整个库筛空
+
+
+def test_positive_list_rules_match_elements():
+    plan = plan_filter(AdvancedFilter(id="f", name="f", rules=[
+        AdvancedFilterRule(field="Studios", operator="contains", value="Ghibli"),
+        AdvancedFilterRule(field="Name", operator="contains", value="l"),
+    ]))
+    assert [item["Id"] for item in plan.post_filter(ITEMS)] == ["1", "5"]